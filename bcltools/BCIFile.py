@@ -1,3 +1,5 @@
+import numpy as np
+
 from .BinaryFile import BinaryFile
 
 
@@ -17,12 +19,42 @@ class BCIFile(BinaryFile):
 
         self.version_num = 0
 
+    def columns(self, records):
+        return {'tile': records['f0'], 'n_clusters': records['f1']}
+
+    def header_values(self, n_tiles):
+        return (self.version_num, n_tiles)
+
     def read_header_bci(self):
         version_num, num_tiles = self.read_header()
         return ((version_num, num_tiles),)
 
-    def read_record_bci(self, skip_header=True):
-        for record in self.read_record(skip_header=skip_header):
+    def read_record_bci(
+        self, skip_header=True, start=None, stop=None, step=None, indices=None
+    ):
+        records = self.read_record(
+            skip_header, start=start, stop=stop, step=step, indices=indices
+        )
+        for record in records:
             tile_num, num_clusters = record
 
             yield (tile_num, num_clusters)
+
+    def tile_ranges(self):
+        """
+        Return the clusters of every tile in the bcl files of the lane, as a
+        list of (tile, first cluster, last cluster + 1) in file order.
+        """
+        records = self.read_array()
+        stops = np.cumsum(records['f1'], dtype=np.int64)
+        starts = stops - records['f1']
+        return list(
+            zip(records['f0'].tolist(), starts.tolist(), stops.tolist())
+        )
+
+    def tile_range(self, tile):
+        """Return the (first cluster, last cluster + 1) of a tile"""
+        for tile_num, start, stop in self.tile_ranges():
+            if tile_num == tile:
+                return start, stop
+        raise ValueError(f'{self.path} has no tile {tile}')
@@ -1,16 +1,80 @@
-from .utils import (num2qual, qual2num)
+import numpy as np
+
 from .BinaryFile import BinaryFile
 
 num2base = {0: "A", 1: "C", 2: "G", 3: "T"}
 base2num = {"A": 0, "C": 1, "G": 2, "T": 3}
 
+# Lookup tables indexed by the raw bcl byte. Bits 0-1 are the base and bits
+# 2-7 the quality score, the all zero byte is a no-call.
+BYTE2BASE = np.frombuffer(b"ACGT" * 64, dtype=np.uint8).copy()
+BYTE2BASE[0] = ord("N")
+BYTE2QUAL = ((np.arange(256) >> 2) + 33).astype(np.uint8)
+
+# The same tables for bytes.translate
+BYTE2BASE_TABLE = BYTE2BASE.tobytes()
+BYTE2QUAL_TABLE = BYTE2QUAL.tobytes()
+
+# Lookup table from the ascii codes of a base and its quality score to the
+# raw bcl byte, indexed by (base << 8) | qual. Anything that is not one of
+# A, C, G, T is written as a no-call, quality scores wrap at 6 bits.
+BASEQUAL2BYTE = np.zeros((256, 256), dtype=np.uint8)
+for _base, _num in base2num.items():
+    BASEQUAL2BYTE[ord(_base)] = (((np.arange(256) - 33) & 0x3f) << 2) | _num
+BASEQUAL2BYTE = BASEQUAL2BYTE.reshape(-1)
+
+
+def decode_bcl(records, qual_table=BYTE2QUAL):
+    """
+    Decode an array of raw bcl bytes.
+    Returns the bases and the quality scores as arrays of ascii codes,
+    qual_table can replace BYTE2QUAL (e.g. to give no-calls a quality).
+    """
+    records = np.asarray(records, dtype=np.uint8)
+    return np.take(BYTE2BASE, records), np.take(qual_table, records)
+
+
+def encode_bcl(base, qual):
+    """Encode a single base and quality score as a raw bcl byte"""
+    return int(BASEQUAL2BYTE[(ord(base) << 8) | ord(qual)])
+
+
+def encode_bcl_array(bases, quals):
+    """
+    Encode arrays of base and quality score ascii codes (of any shape) as
+    raw bcl bytes, with a single lookup in BASEQUAL2BYTE.
+    """
+    index = np.asarray(bases, dtype=np.uint16) << 8
+    index |= np.asarray(quals, dtype=np.uint8)
+    return np.take(BASEQUAL2BYTE, index)
+
+
+def unpack_bcl(records):
+    """
+    Split an array of raw bcl bytes into its 2-bit base (0-3 for A, C, G, T)
+    and 6-bit quality score fields, without mapping them to characters.
+    """
+    records = np.asarray(records, dtype=np.uint8)
+    return records & 3, records >> 2
+
 
 class BCLFile(BinaryFile):
 
     def __init__(
-        self, path, header_fmt="<I", record_fmt="<B", compression=None
+        self,
+        path,
+        header_fmt="<I",
+        record_fmt="<B",
+        compression=None,
+        threads=1
     ):
-        super().__init__(path, header_fmt, record_fmt, compression=compression)
+        super().__init__(
+            path,
+            header_fmt,
+            record_fmt,
+            compression=compression,
+            threads=threads
+        )
 
     def read_header_bcl(self):
         """
@@ -22,7 +86,33 @@ class BCLFile(BinaryFile):
         n_reads = self.read_header()
         return ((n_reads),)
 
-    def read_record_bcl(self, skip_header=True):
+    def read_array_bcl(self, start=None, stop=None, step=None, indices=None):
+        """
+        Read a range (or the given indices) of clusters of the cycle as a
+        uint8 array of raw bcl bytes. Uncompressed files are memory-mapped,
+        nothing is copied.
+        """
+        return self.read_array(start, stop, step, indices)['f0']
+
+    def read_tile_bcl(self, tile, bci):
+        """
+        Read the clusters of one tile of a lane wide (nextseq) cycle file.
+        bci is the BCIFile of the lane, its cumulative cluster counts give the
+        range of the tile, bgzf files only inflate the blocks holding it.
+        """
+        start, stop = bci.tile_range(tile)
+        return self.read_array_bcl(start, stop)
+
+    def read_decoded_bcl(self, start=None, stop=None, step=None, indices=None):
+        """
+        Read a range of clusters of the cycle and decode it in one go.
+        Returns the bases and the quality scores as arrays of ascii codes.
+        """
+        return decode_bcl(self.read_array_bcl(start, stop, step, indices))
+
+    def read_record_bcl(
+        self, skip_header=True, start=None, stop=None, step=None, indices=None
+    ):
         """
         # Byte specification of *.bcl
         # Note: N is the cluster index
@@ -40,42 +130,67 @@ class BCLFile(BinaryFile):
         #               | ‘0’ in a byte is reserved
         #               | for no-call.
         """
-        for record in self.read_record(skip_header=skip_header):
-            r, = record
-
-            base = num2base.get(3 & r, 0)
-            num = r >> 2
-            qual = num2qual(num)
+        records = self.read_array_bcl(start, stop, step, indices).tobytes()
 
+        bases = records.translate(BYTE2BASE_TABLE).decode("ascii")
+        quals = records.translate(BYTE2QUAL_TABLE).decode("ascii")
+        for base, qual in zip(bases, quals):
             yield (base, qual)
 
+    def format_text(self, records):
+        """Format records as "base\tqual" lines with a lookup per byte"""
+        raw = records['f0']
+        lines = np.empty((len(records), 4), dtype=np.uint8)
+        np.take(BYTE2BASE, raw, out=lines[:, 0], mode='clip')
+        lines[:, 1] = ord('\t')
+        np.take(BYTE2QUAL, raw, out=lines[:, 2], mode='clip')
+        lines[:, 3] = ord('\n')
+        return lines.tobytes()
+
+    def columns(self, records):
+        """The base (N for no-calls) and the quality score of every cluster"""
+        raw = records['f0']
+        return {'base': np.take(BYTE2BASE, raw).view('S1'), 'qual': raw >> 2}
+
+    def header_values(self, n_reads):
+        return (n_reads,)
+
     def write_header_bcl(self, n_reads):
-        header_values = (n_reads,)
+        header_values = self.header_values(n_reads)
         return self.write_header(*header_values)
 
     def change_header_bcl(self, n_reads):
-        header_values = (n_reads,)
+        header_values = self.header_values(n_reads)
         return self.change_header(*header_values)
 
     def write_record_bcl(self, base, qual, keep_open=False):
         """
         Write a single record containing a quality score and a base, to the bcl file.
         """
-        r = 0
-        if base != "N":
-            q = qual2num(qual) << 2
-            b = base2num[base]
-            r = q | b
-        record_values = (r,)
+        record_values = (encode_bcl(base, qual),)
         return self.write_record(*record_values, keep_open=keep_open)
 
-    def write_from_stream_bcl(self, infile):
+    def parse_text(self, text):
+        """Parse "base\tqual" lines into raw bcl bytes, see parse_text"""
+        # text written by read_text is 4 bytes per line and needs no split
+        if len(text) % 4 == 0:
+            lines = np.frombuffer(text, dtype=np.uint8).reshape(-1, 4)
+            if ((lines[:, 1] == ord('\t')).all()
+                    and (lines[:, 3] == ord('\n')).all()):
+                return encode_bcl_array(lines[:, 0], lines[:, 2])
 
-        for idx, data in enumerate(self.write_from_stream(infile), 1):
-            base, qual = data
-            self.write_record_bcl(base, qual, keep_open=True)
+        tokens = text.split()
+        chars = np.frombuffer(b''.join(tokens), dtype=np.uint8)
+        if len(chars) != len(tokens) or len(tokens) % 2:
+            raise ValueError(
+                f'Expected a base and a quality character per line to write '
+                f'{self.path}'
+            )
+        chars = chars.reshape(-1, 2)
+        return encode_bcl_array(chars[:, 0], chars[:, 1])
 
-        self.close()
+    def write_from_stream_bcl(self, infile):
 
-        n_reads = idx
-        self.change_header_bcl(n_reads)
+        with self.writer() as writer:
+            for records in self.write_from_stream(infile):
+                writer.write_array(records)
@@ -1,14 +1,22 @@
 import os
 
 from .utils import prepend_zeros_to_number
-from .BCLFile import BCLFile
+from .BCLFile import BCLFile, encode_bcl_array
 from .LOCSFile import LOCSFile
+from .CLOCSFile import CLOCSFile
 from .FILTERFile import FILTERFile
-from .utils import lane2num, parse_fastq_header
+from .BCIFile import BCIFile
+from .BGZFFile import is_bgzf
+from .utils import parse_fastq_headers
+from .config import CONVERT_BLOCK_SIZE, COMPRESSION, CLOCS_IMAGE_WIDTH
 from collections import defaultdict
-import gzip
+from itertools import zip_longest
+import numpy as np
 
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import ExitStack
+import shutil
+import tempfile
 import logging
 
 logger = logging.getLogger(__name__)
@@ -21,10 +29,213 @@ logger = logging.getLogger(__name__)
 # Data/Intensities/L00X/s_LANEX_TILE.locs
 
 
+def spill_dtype(n_cycles):
+    """Record of a spilled read: its bcl byte of every cycle, position and
+    filter flag"""
+    return np.dtype([
+        ('bcl', np.uint8, (n_cycles,)),
+        ('x', np.float32),
+        ('y', np.float32),
+        ('pass_filter', np.uint8),
+    ])
+
+
+def map_tasks(func, tasks, processes=1):
+    """
+    Return func(task) of every task, in task order. With processes > 1 the
+    tasks run in a pool of processes, every task gets everything it needs
+    (its files and spill files) so nothing is shared between the processes.
+    """
+    if processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return list(executor.map(func, tasks))
+    return [func(task) for task in tasks]
+
+
+def spill_file(spill_path, lane, tile):
+    return os.path.join(spill_path, f'{lane}_{tile}.spill')
+
+
+def spill_block(spill_path, lanes, tiles, records, counts):
+    """Append a block of spill records to the files of their lane and tile
+    in spill_path, keeping the order of the reads within a tile. counts maps
+    (lane, tile) to the number of reads spilled so far"""
+    order = np.lexsort((tiles, lanes))
+    lanes, tiles, records = lanes[order], tiles[order], records[order]
+
+    changes = (np.diff(lanes) != 0) | (np.diff(tiles) != 0)
+    bounds = [0] + (np.flatnonzero(changes) + 1).tolist() + [len(lanes)]
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        key = (int(lanes[start]), int(tiles[start]))
+        with open(spill_file(spill_path, *key), 'ab') as f:
+            records[start:stop].tofile(f)
+        counts[key] = counts.get(key, 0) + stop - start
+
+
+def spill_reads(task):
+    """
+    Spill the reads [start, stop) of FASTQ files to the files of their lane
+    and tile in spill_path, see BCLFolderStructure.fastq2bcl. task is
+    (fastq_objects, start, stop, spill_path, dtype, n_lanes, tiles,
+    block_size), reads without an Illumina header are dealt over n_lanes
+    lanes and the tiles by read number.
+
+    Returns {(lane, tile): number of reads} and the number of reads without
+    an Illumina header.
+    """
+    (
+        fastq_objects, start, stop, spill_path, dtype, n_lanes, default_tiles,
+        block_size
+    ) = task
+    n_default = n_lanes * len(default_tiles)
+    default_tiles = np.array(default_tiles, dtype=np.int64)
+
+    # every FASTQ file is decompressed in its own thread
+    # a file that runs out of blocks first is padded with None
+    readers = [
+        fastq.prefetch_blocks(block_size, start, stop)
+        for fastq in fastq_objects
+    ]
+    blocks = zip_longest(*readers)
+
+    counts = {}
+    read_number = start
+    n_invalid = 0
+    for block in blocks:
+        if any(b is None for b in block):
+            raise ValueError('FASTQ files have a different number of reads')
+        headers, _, _ = block[0]
+        n_block = len(headers)
+        if any(len(b[0]) != n_block for b in block):
+            raise ValueError('FASTQ files have a different number of reads')
+
+        # should check that the headers are consistent
+        fields = parse_fastq_headers(headers)
+        lanes, tiles = fields['lane'], fields['tile']
+        invalid = np.flatnonzero(~fields['valid'])
+        if len(invalid):
+            turns = (read_number + invalid) % n_default
+            lanes[invalid] = turns % n_lanes + 1
+            tiles[invalid] = default_tiles[turns // n_lanes]
+            n_invalid += len(invalid)
+
+        seqs = np.hstack([seq for _, seq, _ in block])
+        quals = np.hstack([qual for _, _, qual in block])
+
+        records = np.empty(n_block, dtype=dtype)
+        records['bcl'] = encode_bcl_array(seqs, quals)
+        records['x'] = fields['x']
+        records['y'] = fields['y']
+        records['pass_filter'] = fields['pass_filter']
+        spill_block(spill_path, lanes, tiles, records, counts)
+
+        read_number += n_block
+        logger.info(f"Read {read_number} reads")
+
+    if stop is not None and read_number != stop:
+        raise ValueError('FASTQ files have fewer reads than their index')
+    return counts, n_invalid
+
+
+def iter_spill_blocks(parts, order, block_size):
+    """
+    Yield the spilled reads of a tile block_size reads at a time. parts are
+    the memory mapped spill files of the tile, in read order. order lists
+    the reads to yield as indices into the parts put end to end, None yields
+    the reads in file order.
+    """
+    if order is None:
+        for part in parts:
+            for start in range(0, len(part), block_size):
+                yield part[start:start + block_size]
+        return
+
+    starts = np.cumsum([0] + [len(part) for part in parts[:-1]])
+    for start in range(0, len(order), block_size):
+        rows = order[start:start + block_size]
+        if len(parts) == 1:
+            yield parts[0][rows]
+            continue
+        which = np.searchsorted(starts, rows, side='right') - 1
+        block = np.empty(len(rows), dtype=parts[0].dtype)
+        for i, part in enumerate(parts):
+            in_part = which == i
+            block[in_part] = part[rows[in_part] - starts[i]]
+        yield block
+
+
+def write_tiles(task):
+    """
+    Write the spilled reads of consecutive tiles of a lane to their files.
+    task is (spills, dtype, first_cycle, bcls, locs, filter_file,
+    block_size): spills lists the spill files of every tile (one per shard
+    of reads holding some, in read order) with its clocs file (None for
+    locs files), bcls the files of the cycles from first_cycle on. The
+    reads of a tile with a clocs file are written in bin order. locs is the
+    locs file of the tiles, None for clocs files, and filter_file their
+    filter file. Tasks writing only some cycles of the tiles get None for
+    both and leave the locs, clocs and filter files to another task.
+
+    The spill files are memory mapped and written block_size reads at a
+    time, so memory does not grow with the size of a tile.
+    """
+    spills, dtype, first_cycle, bcls, locs, filter_file, block_size = task
+    last_cycle = first_cycle + len(bcls)
+
+    with ExitStack() as stack:
+        # the writers stay open for the whole task, so bgzf blocks are only
+        # cut when full and the last short block is written on close
+        writers = [stack.enter_context(bcl.writer()) for bcl in bcls]
+        if locs is not None:
+            locs_writer = stack.enter_context(locs.writer())
+        if filter_file is not None:
+            filter_writer = stack.enter_context(filter_file.writer())
+
+        for spill_paths, clocs in spills:
+            parts = [
+                np.memmap(path, dtype=dtype, mode='r') for path in spill_paths
+            ]
+            order = None
+            if clocs is not None:
+                coords = np.concatenate([
+                    np.column_stack((part['x'], part['y'])) for part in parts
+                ])
+                order = clocs.sort_order(coords)
+                if filter_file is not None:
+                    clocs.write_coords(coords[order])
+
+            for records in iter_spill_blocks(parts, order, block_size):
+                # one contiguous row of reads per cycle, only the cycles of
+                # the task are read from the spill
+                cycles = records['bcl'][:, first_cycle:last_cycle]
+                for writer, column in zip(writers,
+                                          np.ascontiguousarray(cycles.T)):
+                    writer.write_array(column)
+                if locs is not None:
+                    locs_writer.write_array(
+                        np.column_stack((records['x'], records['y']))
+                    )
+                if filter_file is not None:
+                    filter_writer.write_array(records['pass_filter'])
+            # release the memory maps of the tile
+            parts = records = None
+
+
 class BCLFolderStructure(object):
+    """
+    Writes the reads of FASTQ files to a run folder. The reads go to the
+    lane and tile of their FASTQ header, reads without an Illumina header
+    are spread over n_lanes lanes of the tiles listed in self.tiles.
+    """
 
     def __init__(
-        self, n_lanes, n_cycles, reads_per_lane, machine_type, base_path
+        self,
+        n_lanes,
+        n_cycles,
+        machine_type,
+        base_path,
+        locs_format='locs',
+        image_width=CLOCS_IMAGE_WIDTH
     ):
 
         intensities_path = "Data/Intensities"
@@ -32,9 +243,10 @@ class BCLFolderStructure(object):
 
         self.n_lanes = n_lanes
         self.n_cycles = n_cycles
-        self.reads_per_lane = reads_per_lane
         self.machine_type = machine_type
         self.base_path = base_path
+        self.locs_format = locs_format
+        self.image_width = image_width
 
         self.tiles = [
             1101,
@@ -70,6 +282,9 @@ class BCLFolderStructure(object):
         self.intensities_path = os.path.join(self.base_path, intensities_path)
         self.base_calls_path = os.path.join(self.base_path, base_calls_path)
 
+        # lane -> tiles holding reads, known once the reads are spilled
+        self.lane_tiles = {}
+
         self.bcl_files = defaultdict(lambda: defaultdict(list))
         self.locs_files = defaultdict(lambda: defaultdict(list))
         self.filter_files = defaultdict(lambda: defaultdict(list))
@@ -83,182 +298,283 @@ class BCLFolderStructure(object):
         return os.path.join(self.intensities_path, lane)
 
     def make_base_calls_lane_folders(self):
-        base_path = self.base_calls_path
-        lanes = []
-
-        if self.machine_type == "nextseq":
-            for i in range(self.n_lanes):
-                L = os.path.join(
-                    base_path, f"L{prepend_zeros_to_number(3, i+1)}"
-                )
-                os.makedirs(L)
-                lanes.append(L)
-
-        elif self.machine_type == "miseq":
-            for n in range(self.n_lanes):
-                L = os.path.join(
-                    base_path, f"L{prepend_zeros_to_number(3, n+1)}"
-                )
-                os.makedirs(L)
-                lanes.append(L)
-
-        elif self.machine_type == "novaseq":
+        if self.machine_type == "novaseq":
             raise Exception("Novaseq is not supported yet.")
 
+        lanes = []
+        for lane in self.lane_tiles:
+            L = self.base_calls_lane_path(lane)
+            os.makedirs(L)
+            lanes.append(L)
         return lanes
 
     # for locs files
     def make_intensities_lane_folders(self):
-        base_path = self.intensities_path
         lanes = []
-        for n in range(self.n_lanes):
-            L = os.path.join(base_path, f"L{prepend_zeros_to_number(3, n+1)}")
-
+        for lane in self.lane_tiles:
+            L = self.locs_lane_path(lane)
             os.makedirs(L)
             lanes.append(L)
         return lanes
 
-    def initialize_locs_files(self, lane, n_reads):
-        lane_name = os.path.basename(lane)
-        if self.machine_type == 'nextseq':
-            path = os.path.join(lane, f's_{lane2num(lane_name)}.locs')
-            locs = LOCSFile(path)
-            locs.write_header_locs(n_reads)  # account for lanes
-            self.locs_files[lane_name].append(locs)
+    def initialize_locs_files(self, lane):
+        """Create the locs (or clocs) file objects of a lane, the files are
+        written by spill2bcl"""
+        lane_path = self.locs_lane_path(lane)
+        if self.locs_format == 'clocs':
+            # one clocs file per tile
+            for tile in self.lane_tiles[lane]:
+                path = os.path.join(lane_path, f's_{lane}_{tile}.clocs')
+                clocs = CLOCSFile(path, image_width=self.image_width)
+                self.locs_files[lane][tile].append(clocs)
+        elif self.machine_type == 'nextseq':
+            # one file per lane instead of one per tile
+            path = os.path.join(lane_path, f's_{lane}.locs')
+            self.locs_files[lane] = [LOCSFile(path)]
         elif self.machine_type == 'miseq':
-            for tidx, tile in enumerate(self.tiles):
-                path = os.path.join(
-                    lane, f's_{lane2num(lane_name)}_{tile}.locs'
-                )
-                locs = LOCSFile(path)
-                locs.write_header_locs(n_reads[tidx])  # account for lanes
-                self.locs_files[lane_name][tile].append(locs)
+            for tile in self.lane_tiles[lane]:
+                path = os.path.join(lane_path, f's_{lane}_{tile}.locs')
+                self.locs_files[lane][tile].append(LOCSFile(path))
         return
 
-    def initialize_bcl_files(self, lane, n_reads):
-        # perform action for one lane at a time
-        lane_name = os.path.basename(lane)
+    def initialize_bcl_files(self, lane):
+        lane_path = self.base_calls_lane_path(lane)
         if self.machine_type == 'nextseq':
-            # need to fix gz
+            compression = COMPRESSION[self.machine_type]
+            extension = '.bcl.bgzf' if compression == 'bgzip' else '.bcl'
+
+            self.bcl_files[lane] = []
             for m in range(self.n_cycles):
                 path = os.path.join(
-                    lane, f'{prepend_zeros_to_number(4, m+1)}.bcl'
+                    lane_path, f'{prepend_zeros_to_number(4, m+1)}{extension}'
                 )
-
-                bcl = BCLFile(path)
-                bcl.write_header_bcl(n_reads)
-
-                self.bcl_files[lane_name].append(bcl)
+                bcl = BCLFile(path, compression=compression)
+                self.bcl_files[lane].append(bcl)
 
         if self.machine_type == 'miseq':
             for m in range(self.n_cycles):
-                path = os.path.join(lane, f"C{m+1}.1")
+                path = os.path.join(lane_path, f"C{m+1}.1")
                 os.makedirs(path)
-                for tidx, tile in enumerate(self.tiles):
-                    file_path = os.path.join(
-                        path, f's_{lane2num(lane_name)}_{tile}.bcl'
-                    )
-
-                    bcl = BCLFile(file_path)
-                    bcl.write_header_bcl(n_reads[tidx])
-                    self.bcl_files[lane_name][tile].append(bcl)
+                for tile in self.lane_tiles[lane]:
+                    file_path = os.path.join(path, f's_{lane}_{tile}.bcl')
+                    self.bcl_files[lane][tile].append(BCLFile(file_path))
 
         return
 
-    def initialize_filter_files(self, lane, n_reads):
-        lane_name = os.path.basename(lane)
+    def initialize_filter_files(self, lane):
+        lane_path = self.base_calls_lane_path(lane)
         if self.machine_type == 'nextseq':
-            path = os.path.join(lane, f's_{lane2num(lane_name)}.filter')
-            filter_file = FILTERFile(path)
-            filter_file.write_header_filter(n_reads)  # account for lanes
-            self.filter_files[lane_name].append(filter_file)
+            path = os.path.join(lane_path, f's_{lane}.filter')
+            self.filter_files[lane] = [FILTERFile(path)]
         elif self.machine_type == 'miseq':
-            for tidx, tile in enumerate(self.tiles):
-                path = os.path.join(
-                    lane, f's_{lane2num(lane_name)}_{tile}.filter'
-                )
-                filter_file = FILTERFile(path)
-                filter_file.write_header_filter(
-                    n_reads[tidx]
-                )  # account for lanes
-                self.filter_files[lane_name][tile].append(filter_file)
+            for tile in self.lane_tiles[lane]:
+                path = os.path.join(lane_path, f's_{lane}_{tile}.filter')
+                self.filter_files[lane][tile].append(FILTERFile(path))
         return
 
-    # Super naive implementation
-    def fastq2bcl(self, fastq_objects, reads_per_lane):
-        seq_bool = False
-        qual_bool = False
-        coord_bool = False
-
-        tile_num_idx = 0
-        num_passed = 0
-        tile = self.tiles[tile_num_idx]
-
-        lane = 'L001'
-        with ExitStack() as stack:
-            infiles = [
-                stack.enter_context(gzip.open(fastq.path))
-                for fastq in fastq_objects
-            ]
-            # lane_counter = 0
-            # lane = 'L001'
-            for idx, lines in enumerate(zip(*infiles), 0):
-                if idx % 1000 == 0:
-                    logger.info(f"Wrote {idx//4} reads")
-                if idx % 4 == 0:
-                    num_reads = idx // 4
-
-                    # switch between each lane every iteration
-                    # this is fine for now but needs to be changed
-                    # lane = f'L{prepend_zeros_to_number(3, (idx//4)%self.n_lanes + 1)}'
-                    if num_passed % reads_per_lane[tile_num_idx
-                                                   ] == 0 and num_reads > 0:
-                        num_passed = 0
-                        tile_num_idx += 1
-                        tile = self.tiles[tile_num_idx]
-                    num_passed += 1
-
-                    line = lines[0]
-                    # should check that the headers are consistent
-                    h = parse_fastq_header(line.strip().decode())
-
-                    x = h['x']
-                    y = h['y']
-
-                    pass_filter = h['is_filtered_out']
-
-                    coord_bool = True
-
-                elif (idx - 1) % 4 == 0:
-                    seqs = [seq.strip().decode() for seq in lines]
-                    seq_bool = True
-
-                elif (idx + 1) % 4 == 0:
-                    quals = [qual.strip().decode() for qual in lines]
-                    qual_bool = True
-
-                if seq_bool and qual_bool and coord_bool:
-                    seq_bool = False
-                    qual_bool = False
-                    coord_bool = False
-
-                    # print(x, y)
-                    # print(seqs)
-                    # print(quals)
-
-                    seq = "".join(seqs)
-                    qual = "".join(quals)
-
-                    for jdx, (b, q) in enumerate(zip(seq, qual)):
-                        # fix the tile, iterate through the cycles
-                        self.bcl_files[lane][tile][jdx].write_record_bcl(
-                            b, q, keep_open=False
-                        )
-                    self.locs_files[lane][tile][0].write_record_locs(
-                        x, y, keep_open=True
-                    )
+    def initialize_bci_files(self, lane):
+        """
+        Write the tile index of a nextseq lane, listing the number of reads
+        of every tile in the order the tiles are stored in the bcl files.
+        """
+        lane_path = self.base_calls_lane_path(lane)
+        tiles = self.lane_tiles[lane]
+        n_reads = [self.spill_counts[lane, tile] for tile in tiles]
+        bci = BCIFile(os.path.join(lane_path, f's_{lane}.bci'))
+        with bci.writer() as writer:
+            writer.write_array(np.column_stack([tiles, n_reads]))
+        return
 
-                    self.filter_files[lane][tile][0].write_record_filter(
-                        pass_filter, keep_open=True
-                    )
-            logger.info(f"Wrote {idx//4 + 1} reads")
+    def tile_files(self, lane, tile):
+        """
+        Return the bcl files (one per cycle), locs (or clocs) file and filter
+        file that the clusters of a tile are written to.
+        """
+        if self.machine_type == 'nextseq':
+            # all tiles of a lane share the same files, but clocs files
+            if self.locs_format == 'clocs':
+                locs = self.locs_files[lane][tile][0]
+            else:
+                locs = self.locs_files[lane][0]
+            return (self.bcl_files[lane], locs, self.filter_files[lane][0])
+        return (
+            self.bcl_files[lane][tile], self.locs_files[lane][tile][0],
+            self.filter_files[lane][tile][0]
+        )
+
+    def make_spill_files(self):
+        """
+        Create the folder of the uncompressed files that the reads are
+        spilled to, one file per lane and tile holding its reads in FASTQ
+        order, see spill_dtype. Reads read in parallel are spilled to a
+        sub folder per shard of reads, see fastq2bcl.
+        """
+        # fail before reading any read if the run folder already exists
+        if os.path.exists(self.intensities_path):
+            raise FileExistsError(
+                f'{self.intensities_path} already exists, convert writes a '
+                f'new run folder'
+            )
+        os.makedirs(self.base_calls_path)
+        self.spill_path = tempfile.mkdtemp(prefix='.spill', dir=self.base_path)
+        self.spill_dtype = spill_dtype(self.n_cycles)
+        # (lane, tile) -> number of spilled reads
+        self.spill_counts = {}
+        # (lane, tile) -> spill files of the tile, in read order
+        self.spill_files = defaultdict(list)
+
+    def remove_spill_files(self):
+        shutil.rmtree(self.spill_path)
+
+    def read_shards(self, fastq_objects, processes):
+        """
+        Split the reads of the FASTQ files into up to processes ranges of
+        reads, as a list of (start, stop). The ranges are read in parallel,
+        seeking to their first read with the index of every file (see
+        FASTQIndex), which is built for bgzf files and saved next to them.
+        Files that can only be decompressed from their start (a single gzip
+        member) are read in one range, stop None reads to the end.
+        """
+        if processes == 1:
+            return [(0, None)]
+
+        indexes = [
+            fastq.index(build=is_bgzf(fastq.path)) for fastq in fastq_objects
+        ]
+        if any(index is None or len(index.checkpoints) == 1
+               for index in indexes):
+            return [(0, None)]
+
+        n_reads = {index.n_reads for index in indexes}
+        if len(n_reads) != 1:
+            raise ValueError('FASTQ files have a different number of reads')
+        bounds = np.linspace(0, n_reads.pop(), processes + 1).astype(np.int64)
+        return [(int(start), int(stop))
+                for start, stop in zip(bounds[:-1], bounds[1:])
+                if stop > start]
+
+    def fastq2bcl(
+        self, fastq_objects, block_size=CONVERT_BLOCK_SIZE, processes=1
+    ):
+        """
+        Spill the reads of the FASTQ files to the files of their lane and
+        tile (see make_spill_files) and return the number of reads.
+
+        The FASTQ files are read block_size reads at a time, so peak memory
+        is bounded by the block size. The lane and tile of a read are read
+        from the header of the first FASTQ file, reads without an Illumina
+        header are dealt over the lanes and tiles in turn. With processes > 1
+        the reads are split into shards (see read_shards) spilled in
+        parallel.
+        """
+        shards = self.read_shards(fastq_objects, processes)
+        tasks = []
+        for shard, (start, stop) in enumerate(shards):
+            spill_path = os.path.join(self.spill_path, str(shard))
+            os.mkdir(spill_path)
+            tasks.append((
+                fastq_objects, start, stop, spill_path, self.spill_dtype,
+                self.n_lanes, self.tiles, block_size
+            ))
+
+        if len(tasks) > 1:
+            logger.info(f'Reading {len(tasks)} shards of reads in parallel')
+        results = map_tasks(spill_reads, tasks, processes=len(tasks))
+
+        n_invalid = 0
+        for task, (counts, shard_invalid) in zip(tasks, results):
+            spill_path = task[3]
+            for key, count in sorted(counts.items()):
+                self.spill_counts[key] = self.spill_counts.get(key, 0) + count
+                self.spill_files[key].append(spill_file(spill_path, *key))
+            n_invalid += shard_invalid
+
+        if n_invalid:
+            logger.warning(
+                f'{n_invalid} reads do not have an Illumina header, they are '
+                f'spread over {self.n_lanes} lanes at 0, 0 and pass filter'
+            )
+
+        for lane, tile in sorted(self.spill_counts):
+            self.lane_tiles.setdefault(lane, []).append(tile)
+        return sum(self.spill_counts.values())
+
+    def write_tasks(self, processes=1, block_size=CONVERT_BLOCK_SIZE):
+        """
+        Create the files of the run folder and split their writing into
+        write_tiles tasks that run in parallel, see spill2bcl.
+
+        Miseq tiles have files of their own, so every tile is a task. The
+        tiles of a nextseq lane share their files, so the cycles of a lane are
+        split into processes groups instead, each task writing its cycles of
+        every tile. The first group also writes the positions and filters.
+        Every file is written by a single task, in order, and its writers
+        stay open for the whole task.
+        """
+        self.make_base_calls_lane_folders()
+        self.make_intensities_lane_folders()
+
+        tasks = []
+        for lane, tiles in self.lane_tiles.items():
+            self.initialize_locs_files(lane)
+            self.initialize_bcl_files(lane)
+            # filter is in same folder as bcl
+            self.initialize_filter_files(lane)
+
+            spills = []
+            for tile in tiles:
+                bcls, locs, filter_file = self.tile_files(lane, tile)
+                clocs = None
+                if self.locs_format == 'clocs':
+                    # clocs files are written by write_tiles from the spill
+                    clocs, locs = locs, None
+                spills.append((self.spill_files[lane, tile], clocs))
+                if self.machine_type == 'miseq':
+                    tasks.append((
+                        spills[-1:], self.spill_dtype, 0, bcls, locs,
+                        filter_file, block_size
+                    ))
+
+            if self.machine_type == 'nextseq':
+                self.initialize_bci_files(lane)
+                n_groups = min(processes, self.n_cycles)
+                groups = np.array_split(np.arange(self.n_cycles), n_groups)
+                for group in groups:
+                    first = int(group[0])
+                    bcl_group = bcls[first:first + len(group)]
+                    if first == 0:
+                        # the first group writes the positions and filters
+                        tasks.append((
+                            spills, self.spill_dtype, first, bcl_group, locs,
+                            filter_file, block_size
+                        ))
+                    else:
+                        tasks.append((
+                            spills, self.spill_dtype, first, bcl_group, None,
+                            None, block_size
+                        ))
+        return tasks
+
+    def spill2bcl(self, processes=1, block_size=CONVERT_BLOCK_SIZE):
+        """
+        Write the spilled reads of every lane and tile to the bcl, locs and
+        filter files of the run folder, block_size reads at a time. The
+        tasks of write_tasks run in processes worker processes, which
+        encode and compress the files of their task.
+        """
+        map_tasks(
+            write_tiles,
+            self.write_tasks(processes, block_size),
+            processes=processes
+        )
+
+        if self.machine_type == 'nextseq':
+            # readers of the run seek to tiles with the block index
+            for lane in self.lane_tiles:
+                for bcl in self.bcl_files[lane]:
+                    bcl.save_block_index()
+
+        logger.info(
+            f"Wrote {sum(self.spill_counts.values())} reads to "
+            f"{len(self.spill_counts)} tiles of {len(self.lane_tiles)} lanes"
+        )
@@ -0,0 +1,652 @@
+import os
+import re
+import zlib
+import logging
+import xml.etree.ElementTree as ElementTree
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from .BCLFile import BCLFile, BYTE2BASE, BYTE2QUAL, decode_bcl
+from .BCIFile import BCIFile
+from .LOCSFile import LOCSFile
+from .CLOCSFile import CLOCSFile
+from .FILTERFile import FILTERFile
+from .SpatialIndex import SpatialIndex
+from .utils import prepend_zeros_to_number
+from .config import (
+    DEMUX_BLOCK_SIZE, DEMUX_COMPRESSION_LEVEL, CLOCS_IMAGE_WIDTH,
+    SPATIAL_INDEX_EXTENSION, SPATIAL_INDEX_CELL_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+LANE_FOLDER = re.compile(r'^L(\d{3})$')
+MISEQ_CYCLE_FOLDER = re.compile(r'^C(\d+)\.1$')
+MISEQ_BCL = re.compile(r'^s_(\d+)_(\d+)\.bcl(\.gz)?$')
+NEXTSEQ_BCL = re.compile(r'^(\d{4})\.bcl(\.bgzf)?$')
+
+# quality written for no-calls, bcl2fastq reports them as Q2
+NO_CALL_QUAL = ord('#')
+DEMUX_BYTE2QUAL = BYTE2QUAL.copy()
+DEMUX_BYTE2QUAL[0] = NO_CALL_QUAL
+
+# header fields used when the run folder has no RunInfo.xml
+DEFAULT_RUN_INFO = {
+    'instrument': 'bcltools',
+    'run_number': 1,
+    'flowcell': 'FLOWCELL',
+    'read_structure': None,
+}
+
+# the clusters of one tile, bases and quals are (clusters x cycles) arrays of
+# ascii codes (see decode_bcl), x and y the cluster coordinates
+Tile = namedtuple(
+    'Tile', ['lane', 'tile', 'bases', 'quals', 'pass_filter', 'x', 'y']
+)
+
+
+def fastq_reads(read_structure):
+    """
+    Map the (length, type) segments of a parsed read structure to the FASTQ
+    files they are written to. Returns a list of (name, read number, first
+    cycle, last cycle + 1), template reads are named R1, R2, ... and barcode
+    reads I1, I2, ... Skipped segments are not written. Reads are numbered
+    in read structure order, the number written in FASTQ headers.
+    """
+    reads = []
+    numbers = {'T': 0, 'B': 0}
+    cycle = 0
+    for length, kind in read_structure:
+        if kind in numbers:
+            numbers[kind] += 1
+            prefix = 'R' if kind == 'T' else 'I'
+            name = f'{prefix}{numbers[kind]}'
+            reads.append((name, len(reads) + 1, cycle, cycle + length))
+        cycle += length
+    return reads
+
+
+def index_cycles(read_structure, lengths):
+    """
+    Return the cycles holding barcodes of the given lengths, the barcode of
+    the i-th index is read from the first cycles of the i-th barcode (B)
+    segment of the parsed read structure.
+    """
+    starts = []
+    cycle = 0
+    for length, kind in read_structure:
+        if kind == 'B':
+            starts.append((cycle, length))
+        cycle += length
+
+    if len(lengths) > len(starts):
+        raise ValueError(
+            f'The samples have {len(lengths)} barcodes but the read structure '
+            f'has {len(starts)}'
+        )
+
+    cycles = []
+    for length, (start, segment_length) in zip(lengths, starts):
+        if length > segment_length:
+            raise ValueError(
+                f'Barcodes of {length} bases do not fit in a barcode read of '
+                f'{segment_length} cycles'
+            )
+        cycles.extend(range(start, start + length))
+    return cycles
+
+
+def index_bases(records, reads):
+    """
+    Return the bases of the index reads (I1, I2, ...) of reads (see
+    fastq_reads) of every cluster as a (clusters x width) matrix of ascii
+    codes, the index reads joined by +. None if reads has no index read.
+    records is a (clusters x cycles) matrix of raw bcl bytes.
+    """
+    parts = []
+    for name, _, first, last in reads:
+        if name.startswith('I'):
+            if parts:
+                parts.append(np.full((len(records), 1), ord('+'), np.uint8))
+            parts.append(np.take(BYTE2BASE, records[:, first:last]))
+    if not parts:
+        return None
+    return np.hstack(parts)
+
+
+def interleave_rows(heads, rows):
+    """
+    Concatenate heads[i] + rows[i] for every read into a single array of
+    bytes. heads are variable length bytes, rows a (reads x width) uint8
+    matrix, the scatter is done with numpy instead of a join per read.
+    """
+    n_rows, width = rows.shape
+    if n_rows == 0:
+        return np.empty(0, dtype=np.uint8)
+
+    lengths = np.fromiter(map(len, heads), dtype=np.int64, count=n_rows)
+    ends = np.cumsum(lengths + width)
+
+    out = np.empty(ends[-1], dtype=np.uint8)
+    body = (ends - width)[:, None] + np.arange(width)
+    out[body] = rows
+
+    is_head = np.ones(len(out), dtype=bool)
+    is_head[body] = False
+    out[is_head] = np.frombuffer(b''.join(heads), dtype=np.uint8)
+    return out
+
+
+def format_fastq(heads, comments, records):
+    """
+    Format FASTQ records. heads are the variable part of the header lines
+    (up to and including the space), comments a (reads x k) uint8 matrix with
+    the rest of the header line and records a (reads x cycles) matrix of raw
+    bcl bytes.
+    """
+    n_reads, n_comment = comments.shape
+    n_cycles = records.shape[1]
+
+    rows = np.empty((n_reads, n_comment + 2 * n_cycles + 4), dtype=np.uint8)
+    seq_start = n_comment
+    qual_start = seq_start + n_cycles + 3
+
+    # bases and quals are decoded straight into the rows
+    rows[:, :seq_start] = comments
+    seqs = rows[:, seq_start:seq_start + n_cycles]
+    np.take(BYTE2BASE, records, out=seqs, mode='clip')
+    rows[:, qual_start - 3:qual_start] = np.frombuffer(b'\n+\n', np.uint8)
+    quals = rows[:, qual_start:qual_start + n_cycles]
+    np.take(DEMUX_BYTE2QUAL, records, out=quals, mode='clip')
+    rows[:, -1] = ord('\n')
+
+    return interleave_rows(heads, rows)
+
+
+def compress_fastq(heads, comments, records, compression_level):
+    """Format FASTQ records (see format_fastq) into a single gzip member"""
+    compressor = zlib.compressobj(compression_level, zlib.DEFLATED, 31)
+
+    chunks = []
+    for start in range(0, len(records), DEMUX_BLOCK_SIZE):
+        block = slice(start, start + DEMUX_BLOCK_SIZE)
+        text = format_fastq(heads[block], comments[block], records[block])
+        chunks.append(compressor.compress(text))
+    chunks.append(compressor.flush())
+    return b''.join(chunks)
+
+
+def map_tile(task):
+    """Process pool entry point, see BCLRunFolder.map_tiles"""
+    run_folder, lane, tile, func = task
+    return func(run_folder.load_tile(lane, tile))
+
+
+def demux_tile(task):
+    """Process pool entry point, see BCLRunFolder.tile2fastq"""
+    run_folder, lane, tile, kwargs = task
+    return run_folder.tile2fastq(lane, tile, **kwargs)
+
+
+class BCLRunFolder(object):
+    """
+    Reads the clusters of an existing run folder one tile at a time.
+
+    The lanes, cycles and tiles are discovered from the files in
+    Data/Intensities/BaseCalls. Miseq runs have a C<cycle>.1 folder per cycle
+    with one bcl file per tile, nextseq runs have a single (bgzf compressed)
+    bcl file per cycle holding the tiles of the lane one after the other, in
+    the order listed in the bci file of the lane.
+
+    The cluster positions are read from locs files, or from the clocs file
+    of each tile if there is none, binned over an image of image_width
+    pixels.
+    """
+
+    def __init__(
+        self, base_path, machine_type=None, image_width=CLOCS_IMAGE_WIDTH
+    ):
+        self.base_path = base_path
+        self.image_width = image_width
+        self.intensities_path = os.path.join(base_path, 'Data/Intensities')
+        self.base_calls_path = os.path.join(self.intensities_path, 'BaseCalls')
+
+        if not os.path.isdir(self.base_calls_path):
+            raise ValueError(
+                f'{base_path} is not a run folder, '
+                f'{self.base_calls_path} does not exist'
+            )
+
+        self.lanes = self.discover_lanes()
+        if not self.lanes:
+            raise ValueError(f'No lanes found in {self.base_calls_path}')
+
+        self.machine_type = machine_type or self.detect_machine_type()
+        if self.machine_type not in ('miseq', 'nextseq'):
+            raise ValueError(f'{self.machine_type} runs are not supported yet')
+
+        self.cycle_paths = {
+            lane: self.discover_cycles(lane)
+            for lane in self.lanes
+        }
+        n_cycles = {len(paths) for paths in self.cycle_paths.values()}
+        if len(n_cycles) != 1:
+            raise ValueError('Lanes have a different number of cycles')
+        self.n_cycles = n_cycles.pop()
+
+        # lane -> list of (tile, first cluster, last cluster + 1)
+        self.tiles = {lane: self.discover_tiles(lane) for lane in self.lanes}
+
+    def lane_name(self, lane):
+        return f'L{prepend_zeros_to_number(3, lane)}'
+
+    def base_calls_lane_path(self, lane):
+        return os.path.join(self.base_calls_path, self.lane_name(lane))
+
+    def locs_lane_path(self, lane):
+        return os.path.join(self.intensities_path, self.lane_name(lane))
+
+    def discover_lanes(self):
+        lanes = []
+        for name in os.listdir(self.base_calls_path):
+            match = LANE_FOLDER.match(name)
+            if match and os.path.isdir(os.path.join(self.base_calls_path, name)
+                                       ):
+                lanes.append(int(match.group(1)))
+        return sorted(lanes)
+
+    def detect_machine_type(self):
+        names = os.listdir(self.base_calls_lane_path(self.lanes[0]))
+        if any(MISEQ_CYCLE_FOLDER.match(name) for name in names):
+            return 'miseq'
+        if any(NEXTSEQ_BCL.match(name) for name in names):
+            return 'nextseq'
+        raise ValueError(f'Can not detect the machine type of {self.base_path}')
+
+    def discover_cycles(self, lane):
+        """Return the cycle folders (miseq) or bcl files (nextseq) of a lane,
+        ordered by cycle"""
+        lane_path = self.base_calls_lane_path(lane)
+        pattern = (
+            MISEQ_CYCLE_FOLDER if self.machine_type == 'miseq' else NEXTSEQ_BCL
+        )
+
+        cycles = {}
+        for name in os.listdir(lane_path):
+            match = pattern.match(name)
+            if match:
+                cycles[int(match.group(1))] = os.path.join(lane_path, name)
+
+        if sorted(cycles) != list(range(1, len(cycles) + 1)):
+            raise ValueError(f'Missing cycles in {lane_path}')
+        return [cycles[cycle] for cycle in sorted(cycles)]
+
+    def discover_tiles(self, lane):
+        if self.machine_type == 'miseq':
+            tiles = []
+            for name in sorted(os.listdir(self.cycle_paths[lane][0])):
+                match = MISEQ_BCL.match(name)
+                if match and int(match.group(1)) == lane:
+                    tile = int(match.group(2))
+                    n_clusters, = self.tile_bcls(lane, tile)[0].read_header()
+                    tiles.append((tile, 0, n_clusters))
+            return tiles
+
+        n_clusters, = self.tile_bcls(lane, None)[0].read_header()
+        bci_path = os.path.join(
+            self.base_calls_lane_path(lane), f's_{lane}.bci'
+        )
+        if not os.path.exists(bci_path):
+            logger.warning(
+                f'{bci_path} does not exist, reading lane {lane} as one tile'
+            )
+            return [(0, 0, n_clusters)]
+
+        tiles = BCIFile(bci_path).tile_ranges()
+        n_bci_clusters = tiles[-1][2] if tiles else 0
+        if n_bci_clusters != n_clusters:
+            raise ValueError(
+                f'{bci_path} lists {n_bci_clusters} clusters, '
+                f'the bcl files of lane {lane} have {n_clusters}'
+            )
+        return tiles
+
+    def tile_range(self, lane, tile):
+        """Return the range of clusters of a tile in its bcl files"""
+        for tile_number, start, stop in self.tiles[lane]:
+            if tile_number == tile:
+                return start, stop
+        raise ValueError(f'Lane {lane} has no tile {tile}')
+
+    def tile_bcls(self, lane, tile):
+        """Return the bcl files (one per cycle) holding the clusters of a
+        tile, on nextseq the tiles of a lane share their files"""
+        if self.machine_type == 'nextseq':
+            return [
+                BCLFile(path, compression='bgzip')
+                for path in self.cycle_paths[lane]
+            ]
+
+        bcls = []
+        for path in self.cycle_paths[lane]:
+            bcl_path = os.path.join(path, f's_{lane}_{tile}.bcl')
+            if os.path.exists(bcl_path):
+                bcls.append(BCLFile(bcl_path))
+            else:
+                bcls.append(BCLFile(bcl_path + '.gz', compression='gzip'))
+        return bcls
+
+    def tile_filter(self, lane, tile):
+        lane_path = self.base_calls_lane_path(lane)
+        if self.machine_type == 'nextseq':
+            path = os.path.join(lane_path, f's_{lane}.filter')
+        else:
+            path = os.path.join(lane_path, f's_{lane}_{tile}.filter')
+        return FILTERFile(path) if os.path.exists(path) else None
+
+    def tile_locs(self, lane, tile):
+        lane_path = self.locs_lane_path(lane)
+        if self.machine_type == 'nextseq':
+            path = os.path.join(lane_path, f's_{lane}.locs')
+        else:
+            path = os.path.join(lane_path, f's_{lane}_{tile}.locs')
+        if os.path.exists(path):
+            return LOCSFile(path)
+
+        path = os.path.join(lane_path, f's_{lane}_{tile}.clocs')
+        if os.path.exists(path):
+            return CLOCSFile(path, image_width=self.image_width)
+        return None
+
+    def read_tile(self, lane, tile):
+        """
+        Read every cycle of a tile.
+        Returns a (clusters x cycles) matrix of raw bcl bytes, the pass filter
+        flags as a boolean array and the (clusters x 2) cluster coordinates.
+        The matrix is stored cycle-major, like the bcl files, so a column is
+        contiguous. Missing filter files pass every cluster, missing locs
+        files give zero coordinates.
+        """
+        start, stop = self.tile_range(lane, tile)
+        n_clusters = stop - start
+
+        records = np.empty((self.n_cycles, n_clusters), dtype=np.uint8).T
+        for cycle, bcl in enumerate(self.tile_bcls(lane, tile)):
+            column = bcl.read_array_bcl(start, stop)
+            if len(column) != n_clusters:
+                raise ValueError(
+                    f'{bcl.path} has {len(column)} clusters for tile {tile}, '
+                    f'expected {n_clusters}'
+                )
+            records[:, cycle] = column
+
+        pass_filter = np.ones(n_clusters, dtype=bool)
+        filter_file = self.tile_filter(lane, tile)
+        if filter_file is not None:
+            pass_filter = filter_file.read_mask(start, stop)
+
+        return records, pass_filter, self.tile_coords(lane, tile)
+
+    def tile_coords(self, lane, tile):
+        """Read the (clusters x 2) coordinates of the clusters of a tile,
+        zeros if the tile has no locs or clocs file"""
+        start, stop = self.tile_range(lane, tile)
+        n_clusters = stop - start
+
+        coords = np.zeros((n_clusters, 2), dtype=np.float32)
+        locs = self.tile_locs(lane, tile)
+        if isinstance(locs, CLOCSFile):
+            # clocs files hold a single tile
+            tile_coords = locs.read_coords()
+            if len(tile_coords) != n_clusters:
+                raise ValueError(
+                    f'{locs.path} has {len(tile_coords)} clusters, '
+                    f'expected {n_clusters}'
+                )
+            coords[:] = tile_coords
+        elif locs is not None:
+            coords[:] = locs.read_coords(start, stop)
+        return coords
+
+    def tile_index(self, lane, tile, cell_size=SPATIAL_INDEX_CELL_SIZE):
+        """
+        Return the SpatialIndex of the clusters of a tile. The index is read
+        from its sidecar file next to the locs files if it is newer than
+        them, or built and saved there.
+        """
+        locs = self.tile_locs(lane, tile)
+        if locs is None:
+            raise ValueError(f'Lane {lane} tile {tile} has no locs file')
+
+        path = os.path.join(
+            self.locs_lane_path(lane),
+            f's_{lane}_{tile}{SPATIAL_INDEX_EXTENSION}'
+        )
+        mtime = os.stat(locs.path).st_mtime
+        if os.path.exists(path) and os.stat(path).st_mtime >= mtime:
+            try:
+                index = SpatialIndex.load(path)
+                if index.cell_size >= cell_size:
+                    return index
+            except (ValueError, KeyError, OSError):
+                logger.warning(f'Ignoring the invalid spatial index {path}')
+
+        logger.debug(f'Indexing the clusters of lane {lane} tile {tile}')
+        index = SpatialIndex(self.tile_coords(lane, tile), cell_size=cell_size)
+        try:
+            index.save(path)
+        except OSError:
+            logger.warning(f'Could not save the spatial index of {locs.path}')
+        return index
+
+    def load_clusters(self, lane, tile, indices):
+        """
+        Read and decode some clusters of a tile, e.g. the result of a
+        tile_index query, as a Tile. indices are relative to the tile, only
+        the records between the first and the last index are read.
+        """
+        start, stop = self.tile_range(lane, tile)
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        if len(indices) and (indices.min() < 0
+                             or indices.max() >= stop - start):
+            raise IndexError(
+                f'Cluster index out of range for lane {lane} tile {tile} '
+                f'with {stop - start} clusters'
+            )
+
+        records = np.empty((self.n_cycles, len(indices)), dtype=np.uint8).T
+        for cycle, bcl in enumerate(self.tile_bcls(lane, tile)):
+            records[:, cycle] = bcl.read_array_bcl(indices=start + indices)
+
+        pass_filter = np.ones(len(indices), dtype=bool)
+        filter_file = self.tile_filter(lane, tile)
+        if filter_file is not None:
+            pass_filter = filter_file.read_mask(indices=start + indices)
+
+        coords = self.tile_coords(lane, tile)[indices]
+        bases, quals = decode_bcl(records)
+        return Tile(
+            lane, tile, bases, quals, pass_filter, coords[:, 0], coords[:, 1]
+        )
+
+    def load_tile(self, lane, tile):
+        """Read and decode the clusters of a tile, see Tile"""
+        records, pass_filter, coords = self.read_tile(lane, tile)
+        bases, quals = decode_bcl(records)
+        return Tile(
+            lane, tile, bases, quals, pass_filter, coords[:, 0], coords[:, 1]
+        )
+
+    def tile_keys(self, lanes=None, tiles=None, shard=0, n_shards=1):
+        """
+        List the (lane, tile) pairs of the run, optionally restricted to
+        some lanes and tile numbers. With n_shards > 1 only every n_shards-th
+        tile starting at shard is kept, so that independent workers can each
+        take a disjoint share of the run.
+        """
+        if not 0 <= shard < n_shards:
+            raise ValueError(f'Shard {shard} is not in [0, {n_shards})')
+
+        keys = []
+        for lane in self.lanes:
+            if lanes is not None and lane not in lanes:
+                continue
+            for tile, _, _ in self.tiles[lane]:
+                if tiles is None or tile in tiles:
+                    keys.append((lane, tile))
+        return keys[shard::n_shards]
+
+    def iter_tiles(self, lanes=None, tiles=None, shard=0, n_shards=1):
+        """
+        Lazily yield the tiles of the run (see tile_keys for the arguments)
+        as Tile tuples. Tiles are read one at a time, so memory is bounded
+        by the largest tile rather than the run.
+        """
+        for lane, tile in self.tile_keys(lanes, tiles, shard, n_shards):
+            yield self.load_tile(lane, tile)
+
+    def map_tiles(self, func, lanes=None, tiles=None, processes=1):
+        """
+        Apply func to every Tile of the run in a pool of processes and yield
+        (lane, tile, result) as tiles finish, in no particular order. func
+        must be picklable, i.e. a module level function. Every worker holds
+        at most one tile.
+        """
+        keys = self.tile_keys(lanes, tiles)
+        if processes <= 1:
+            for lane, tile in keys:
+                yield lane, tile, func(self.load_tile(lane, tile))
+            return
+
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = {
+                executor.submit(map_tile, (self, lane, tile, func)):
+                    (lane, tile)
+                for lane, tile in keys
+            }
+            for future in as_completed(futures):
+                lane, tile = futures[future]
+                yield lane, tile, future.result()
+
+    def run_info(self):
+        """
+        Read the instrument, run number, flowcell and read structure from
+        the RunInfo.xml of the run, if it has one.
+        """
+        info = dict(DEFAULT_RUN_INFO)
+        path = os.path.join(self.base_path, 'RunInfo.xml')
+        if not os.path.exists(path):
+            return info
+
+        run = ElementTree.parse(path).getroot().find('Run')
+        if run is None:
+            return info
+
+        info['run_number'] = int(run.get('Number', info['run_number']))
+        for key, tag in (('instrument', 'Instrument'), ('flowcell',
+                                                        'Flowcell')):
+            element = run.find(tag)
+            if element is not None and element.text:
+                info[key] = element.text.strip()
+
+        reads = run.findall('Reads/Read')
+        if reads:
+            info['read_structure'] = ''.join(
+                read.get('NumCycles') +
+                ('B' if read.get('IsIndexedRead') == 'Y' else 'T')
+                for read in sorted(reads, key=lambda r: int(r.get('Number')))
+            )
+        return info
+
+    def tile2fastq(
+        self,
+        lane,
+        tile,
+        reads,
+        run_info,
+        samples=None,
+        include_non_pf=False,
+        compression_level=DEMUX_COMPRESSION_LEVEL
+    ):
+        """
+        Write the clusters of a tile as FASTQ records, one gzip member per
+        sample and read of reads (see fastq_reads). Clusters that do not pass
+        filter are dropped unless include_non_pf is set.
+
+        samples maps a lane to (BarcodeMatcher, index cycles, sample numbers)
+        to assign the clusters of the lane to samples by the bases of their
+        index cycles. Clusters of lanes without samples, and clusters that
+        match no sample, get sample number 0 (undetermined).
+
+        The header comments end with the bases read in the index reads of
+        reads (joined by +, as bcl2fastq writes them), or the sample number
+        if there are none.
+
+        Returns {(sample number, read name): gzipped FASTQ}, the number of
+        clusters, the number of clusters passing filter and {sample number:
+        number of clusters written}.
+        """
+        records, pass_filter, coords = self.read_tile(lane, tile)
+        n_clusters = len(records)
+        n_pf = int(pass_filter.sum())
+
+        sample_numbers = np.zeros(n_clusters, dtype=np.int64)
+        if samples is not None and lane in samples:
+            matcher, index_cycles, numbers = samples[lane]
+            assigned = matcher.assign(records[:, index_cycles])
+            # undetermined clusters (-1) map to the trailing 0
+            sample_numbers = np.append(numbers, 0)[assigned]
+
+        if not include_non_pf:
+            records = records[pass_filter]
+            coords = coords[pass_filter]
+            sample_numbers = sample_numbers[pass_filter]
+            pass_filter = pass_filter[pass_filter]
+
+        # group the clusters of every sample, keeping their order
+        order = np.argsort(sample_numbers, kind='stable')
+        numbers, starts, counts = np.unique(
+            sample_numbers[order], return_index=True, return_counts=True
+        )
+
+        prefix = (
+            f'@{run_info["instrument"]}:{run_info["run_number"]}:'
+            f'{run_info["flowcell"]}:{lane}:{tile}:'
+        ).encode()
+
+        outputs = {}
+        for number, start, count in zip(numbers, starts, counts):
+            idx = order[start:start + count]
+            sample_records = records[idx]
+
+            xy = np.rint(coords[idx]).astype(np.int64).tolist()
+            heads = [b'%s%d:%d ' % (prefix, x, y) for x, y in xy]
+
+            # Y means the cluster is filtered out, see utils.filter2num
+            is_filtered = np.where(pass_filter[idx], ord('N'), ord('Y'))
+
+            index = index_bases(sample_records, reads)
+            if index is None:
+                index = np.tile(
+                    np.frombuffer(b'%d' % number, np.uint8), (count, 1)
+                )
+
+            for name, read_number, first, last in reads:
+                read_field = b'%d:' % read_number
+                comment = np.frombuffer(read_field + b'N:0:', dtype=np.uint8)
+                comments = np.empty((count, len(comment) + index.shape[1] + 1),
+                                    dtype=np.uint8)
+                comments[:, :len(comment)] = comment
+                comments[:, len(read_field)] = is_filtered
+                comments[:, len(comment):-1] = index
+                comments[:, -1] = ord('\n')
+
+                outputs[number, name] = compress_fastq(
+                    heads, comments, sample_records[:, first:last],
+                    compression_level
+                )
+
+        sample_counts = dict(zip(numbers.tolist(), counts.tolist()))
+        return outputs, n_clusters, n_pf, sample_counts
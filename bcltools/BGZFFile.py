@@ -0,0 +1,514 @@
+import bisect
+import logging
+import os
+import struct
+import tempfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import BGZF_INDEX_EXTENSION
+
+logger = logging.getLogger(__name__)
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Every bgzf block is a gzip member whose extra field holds a "BC" subfield
+# with the total size of the block minus 1 (BSIZE)
+BLOCK_HEADER = (
+    b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00'
+    b'BC\x02\x00'
+)
+BLOCK_HEADER_LEN = len(BLOCK_HEADER) + 2
+BLOCK_TRAILER_LEN = 8
+
+# An empty block marks the end of a bgzf file
+EOF_BLOCK = bytes.fromhex(
+    '1f8b08040000000000ff0600424302001b0003000000000000000000'
+)
+
+# Uncompressed bytes per block, leaves room for the deflate overhead of
+# incompressible data within the 64 KiB block limit
+MAX_BLOCK_DATA = 0xff00
+
+DEFAULT_LEVEL = 6
+
+
+def make_virtual_offset(block_offset, within_block_offset):
+    """
+    Combine the offset of a block in the compressed file with an offset in
+    the uncompressed data of that block into a 64-bit virtual offset.
+    """
+    if not 0 <= within_block_offset < 1 << 16:
+        raise ValueError(f'Invalid within block offset {within_block_offset}')
+    return (block_offset << 16) | within_block_offset
+
+
+def split_virtual_offset(virtual_offset):
+    """Return the block offset and within block offset of a virtual offset"""
+    return virtual_offset >> 16, virtual_offset & 0xffff
+
+
+def compress_block(data, level=DEFAULT_LEVEL):
+    """Compress at most MAX_BLOCK_DATA bytes into a single bgzf block"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+
+    block_size = BLOCK_HEADER_LEN + len(deflated) + BLOCK_TRAILER_LEN
+    return b''.join((
+        BLOCK_HEADER,
+        struct.pack('<H', block_size - 1),
+        deflated,
+        struct.pack('<II', zlib.crc32(data), len(data)),
+    ))
+
+
+def read_block_size(handle):
+    """
+    Read the header of the block at the current position of handle and
+    return the total size of the block, or None at the end of the file.
+    The handle is left after the block header.
+    """
+    header = handle.read(12)
+    if not header:
+        return None
+    if len(header) < 12 or header[:4] != b'\x1f\x8b\x08\x04':
+        raise ValueError('Not a valid bgzf block')
+
+    xlen, = struct.unpack('<H', header[10:12])
+    extra = handle.read(xlen)
+
+    # walk the subfields of the extra field until the BC one
+    idx = 0
+    while idx + 4 <= len(extra):
+        subfield_id = extra[idx:idx + 2]
+        slen, = struct.unpack('<H', extra[idx + 2:idx + 4])
+        if subfield_id == b'BC' and slen == 2:
+            bsize, = struct.unpack('<H', extra[idx + 4:idx + 6])
+            return bsize + 1
+        idx += 4 + slen
+
+    raise ValueError('Not a valid bgzf block, missing BSIZE')
+
+
+def read_block(handle):
+    """
+    Read and inflate the block at the current position of handle.
+    Returns the total size of the block and its uncompressed data, or None
+    at the end of the file.
+    """
+    start = handle.tell()
+    block_size = read_block_size(handle)
+    if block_size is None:
+        return None
+
+    header_len = handle.tell() - start
+    deflated = handle.read(block_size - header_len - BLOCK_TRAILER_LEN)
+    crc, isize = struct.unpack('<II', handle.read(BLOCK_TRAILER_LEN))
+
+    data = zlib.decompress(deflated, -15)
+    if len(data) != isize or zlib.crc32(data) != crc:
+        raise ValueError(f'Corrupt bgzf block at offset {start}')
+
+    return block_size, data
+
+
+def replace_first_block(path, data):
+    """
+    Overwrite the first block of a bgzf file with data. The first block must
+    be an uncompressed (level 0) block of the same length, as written by
+    BGZFWriter.write_stored_block, so its size does not depend on data.
+    """
+    block = compress_block(data, level=0)
+    with open(path, 'r+b') as f:
+        block_size = read_block_size(f)
+        if block_size != len(block):
+            raise ValueError(
+                f'The first block of {path} can not be replaced in place'
+            )
+        f.seek(0)
+        f.write(block)
+
+
+def extend_block_index(path, block_offsets, data_offsets):
+    """
+    Extend a block index ending at the start of a block with the blocks that
+    follow it, up to the end of the file. Only the block headers and sizes
+    are read, nothing is inflated.
+    """
+    with open(path, 'rb') as f:
+        while True:
+            f.seek(block_offsets[-1])
+            block_size = read_block_size(f)
+            if block_size is None:
+                return block_offsets, data_offsets
+
+            # the last 4 bytes of a block are the size of its data (ISIZE)
+            f.seek(block_offsets[-1] + block_size - 4)
+            isize, = struct.unpack('<I', f.read(4))
+            block_offsets.append(block_offsets[-1] + block_size)
+            data_offsets.append(data_offsets[-1] + isize)
+
+
+def build_block_index(path):
+    """
+    Index the blocks of a bgzf file. Returns the offsets of the blocks in
+    the file and the offsets of their data in the uncompressed stream, both
+    ending with the size of the file and the total uncompressed size.
+    """
+    return extend_block_index(path, [0], [0])
+
+
+def write_gzi(path, block_offsets, data_offsets):
+    """
+    Write a block index in the .gzi format of bgzip: the number of entries
+    and a (compressed offset, uncompressed offset) pair of uint64 per block,
+    the first block is implied. The file is replaced atomically, so
+    concurrent readers never see a partial index.
+    """
+    entries = list(zip(block_offsets[1:-1], data_offsets[1:-1]))
+    data = struct.pack(
+        f'<Q{2 * len(entries)}Q', len(entries),
+        *(offset for entry in entries for offset in entry)
+    )
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_gzi(path, bgzf_path):
+    """Read a .gzi block index (see write_gzi) of the bgzf file bgzf_path"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    n_entries, = struct.unpack_from('<Q', data)
+    offsets = struct.unpack_from(f'<{2 * n_entries}Q', data, 8)
+
+    # the index does not store where the data of the last block ends
+    return extend_block_index(
+        bgzf_path, [0] + list(offsets[0::2]), [0] + list(offsets[1::2])
+    )
+
+
+# path -> (mtime, block index), so that the tiles of a file only walk its
+# blocks once per process
+_block_indexes = {}
+
+
+def block_index(path, save=False):
+    """
+    Return the block index of a bgzf file (see build_block_index). The index
+    is read from its .gzi sidecar file if it is newer than the file, or built
+    in memory. With save, a built index is saved as the sidecar, reading a
+    file never writes next to it otherwise.
+    """
+    mtime = os.stat(path).st_mtime
+    cached = _block_indexes.get(path)
+    if cached is not None and cached[0] == mtime and not save:
+        return cached[1]
+
+    gzi_path = path + BGZF_INDEX_EXTENSION
+    index = None
+    if os.path.exists(gzi_path) and os.stat(gzi_path).st_mtime >= mtime:
+        try:
+            index = read_gzi(gzi_path, path)
+        except (ValueError, struct.error):
+            logger.warning(f'Ignoring the invalid block index {gzi_path}')
+
+    if index is None:
+        logger.debug(f'Indexing the blocks of {path}')
+        index = build_block_index(path)
+        if save:
+            try:
+                write_gzi(gzi_path, *index)
+            except OSError:
+                logger.warning(f'Could not save the block index of {path}')
+
+    _block_indexes[path] = (mtime, index)
+    return index
+
+
+class BGZFReader(object):
+    """
+    File-like reader for bgzf files.
+
+    tell and seek work with virtual offsets, so a position returned by tell
+    can be seeked to later without inflating anything before it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.handle = open(path, 'rb')
+
+        self.block_offset = 0
+        self.next_block_offset = 0
+        self.buffer = b''
+        self.within_block_offset = 0
+
+        self._load_block(0)
+
+    @property
+    def closed(self):
+        return self.handle.closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        return self.handle.close()
+
+    def _load_block(self, block_offset):
+        self.handle.seek(block_offset)
+        block = read_block(self.handle)
+
+        self.block_offset = block_offset
+        self.within_block_offset = 0
+        if block is None:
+            self.buffer = b''
+            self.next_block_offset = block_offset
+        else:
+            block_size, self.buffer = block
+            self.next_block_offset = block_offset + block_size
+
+    def tell(self):
+        return make_virtual_offset(self.block_offset, self.within_block_offset)
+
+    def size(self):
+        """Total size of the uncompressed data, from the block index"""
+        _, data_offsets = block_index(self.path)
+        return data_offsets[-1]
+
+    def seek_uncompressed(self, offset):
+        """
+        Seek to an offset in the uncompressed data. The block holding it is
+        found in the block index (see block_index), only that block is
+        inflated.
+        """
+        block_offsets, data_offsets = block_index(self.path)
+        if not 0 <= offset <= data_offsets[-1]:
+            raise ValueError(f'Offset {offset} is outside of {self.path}')
+
+        # the last block starting at or before offset, empty blocks share
+        # their data offset with the next block and are skipped
+        idx = min(
+            bisect.bisect_right(data_offsets, offset) - 1,
+            len(block_offsets) - 2
+        )
+        if idx < 0:
+            return self.seek(0)
+
+        within_block_offset = offset - data_offsets[idx]
+        return self.seek(
+            make_virtual_offset(block_offsets[idx], within_block_offset)
+        )
+
+    def seek(self, virtual_offset):
+        block_offset, within_block_offset = split_virtual_offset(virtual_offset)
+        if block_offset != self.block_offset:
+            self._load_block(block_offset)
+        if within_block_offset > len(self.buffer):
+            raise ValueError(f'Invalid virtual offset {virtual_offset}')
+
+        self.within_block_offset = within_block_offset
+        return virtual_offset
+
+    def read(self, size=-1):
+        chunks = []
+        while size != 0:
+            if self.within_block_offset == len(self.buffer):
+                if self.next_block_offset == self.block_offset:
+                    # end of file
+                    break
+                self._load_block(self.next_block_offset)
+                continue
+
+            start = self.within_block_offset
+            stop = len(self.buffer)
+            if size > 0:
+                stop = min(start + size, stop)
+            chunks.append(self.buffer[start:stop])
+
+            self.within_block_offset = stop
+            if size > 0:
+                size -= stop - start
+
+        return b''.join(chunks)
+
+
+class BGZFWriter(object):
+    """
+    File-like writer for bgzf files.
+
+    Data is cut into blocks of MAX_BLOCK_DATA bytes. With threads > 1 the
+    blocks are compressed on a thread pool (zlib releases the GIL) and
+    written in order. Opening an existing file in append mode drops its end
+    of file marker so new blocks follow the existing ones.
+    """
+
+    def __init__(self, path, mode='wb', level=DEFAULT_LEVEL, threads=1):
+        self.path = path
+        self.level = level
+
+        if 'a' in mode:
+            strip_eof_block(path)
+        self.handle = open(path, mode)
+
+        self.buffer = bytearray()
+
+        self.threads = threads
+        self.executor = None
+        if threads > 1:
+            self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.pending = deque()
+
+    @property
+    def closed(self):
+        return self.handle.closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write_block(self, data):
+        if self.executor is None:
+            self.handle.write(compress_block(data, self.level))
+            return
+
+        self.pending.append(
+            self.executor.submit(compress_block, data, self.level)
+        )
+        # bound the number of blocks held in memory
+        while len(self.pending) > 2 * self.threads:
+            self.handle.write(self.pending.popleft().result())
+
+    def _drain(self):
+        while self.pending:
+            self.handle.write(self.pending.popleft().result())
+
+    def write(self, data):
+        data = memoryview(data).cast('B')
+
+        if self.buffer:
+            fill = MAX_BLOCK_DATA - len(self.buffer)
+            self.buffer += data[:fill]
+            data = data[fill:]
+            if len(self.buffer) < MAX_BLOCK_DATA:
+                return
+            self._write_block(bytes(self.buffer))
+            self.buffer = bytearray()
+
+        # full blocks go straight from data
+        n_full = len(data) - len(data) % MAX_BLOCK_DATA
+        for start in range(0, n_full, MAX_BLOCK_DATA):
+            self._write_block(data[start:start + MAX_BLOCK_DATA].tobytes())
+
+        self.buffer += data[n_full:]
+
+    def write_stored_block(self, data):
+        """
+        Write data as its own uncompressed block. The size of such a block
+        only depends on the length of data, so it can later be replaced in
+        place with replace_first_block.
+        """
+        self.flush()
+        self.handle.write(compress_block(data, level=0))
+
+    def flush(self):
+        if self.buffer:
+            self._write_block(bytes(self.buffer))
+            self.buffer = bytearray()
+        self._drain()
+
+    def tell(self):
+        self.flush()
+        return make_virtual_offset(self.handle.tell(), 0)
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self.handle.write(EOF_BLOCK)
+        self.handle.close()
+
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+def strip_eof_block(path):
+    """Remove the end of file marker of a bgzf file, if it has one"""
+    if not os.path.exists(path):
+        return
+
+    with open(path, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size < len(EOF_BLOCK):
+            return
+        f.seek(size - len(EOF_BLOCK))
+        if f.read() == EOF_BLOCK:
+            f.truncate(size - len(EOF_BLOCK))
+
+
+def is_bgzf(path):
+    """Whether the file starts with a bgzf block"""
+    with open(path, 'rb') as f:
+        try:
+            return read_block_size(f) is not None
+        except ValueError:
+            return False
+
+
+def iter_gzip_members(handle, chunk_size=1 << 20):
+    """
+    Decompress the gzip (or bgzf) file handle from its current position.
+    Yields (offset, data) chunks, where offset is the position in handle of
+    the gzip member that data was decompressed from.
+    """
+    offset = handle.tell()
+
+    decompressor = zlib.decompressobj(31)
+    # compressed bytes of the current member consumed so far
+    consumed = 0
+    pending = b''
+    while True:
+        data = pending or handle.read(chunk_size)
+        pending = b''
+        if not data:
+            return
+
+        out = decompressor.decompress(data)
+        if out:
+            yield offset, out
+
+        if decompressor.eof:
+            pending = decompressor.unused_data
+            offset += consumed + len(data) - len(pending)
+            consumed = 0
+            decompressor = zlib.decompressobj(31)
+        else:
+            consumed += len(data)
+
+
+def iter_bgzf_blocks(handle):
+    """Same as iter_gzip_members for bgzf files, without inflating more than
+    one block at a time or copying the rest of the file per block"""
+    offset = handle.tell()
+    while True:
+        block = read_block(handle)
+        if block is None:
+            return
+        block_size, data = block
+        if data:
+            yield offset, data
+        offset += block_size
@@ -0,0 +1,393 @@
+import itertools
+
+import numpy as np
+
+from .config import BASES, BARCODE_LOOKUP_BITS, BARCODE_BATCH_SIZE
+
+# number of reads with no-calls compared to every barcode at a time
+NO_CALL_BATCH_SIZE = 1 << 12
+
+# 2^64 divided by the golden ratio
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def encode_barcode(barcode):
+    """Encode a barcode as an integer, 2 bits per base"""
+    key = 0
+    for base in barcode:
+        key = (key << 2) | BASES.index(base)
+    return key
+
+
+def barcode_variants(barcode, mismatches):
+    """
+    Yield (key, distance) for every sequence within mismatches of barcode,
+    including barcode itself at distance 0.
+    """
+    length = len(barcode)
+    codes = [BASES.index(base) for base in barcode]
+    key = encode_barcode(barcode)
+
+    yield key, 0
+    for distance in range(1, mismatches + 1):
+        for positions in itertools.combinations(range(length), distance):
+            shifts = [2 * (length - 1 - p) for p in positions]
+            others = [set(range(len(BASES))) - {codes[p]} for p in positions]
+            for bases in itertools.product(*map(sorted, others)):
+                variant = key
+                for shift, p, base in zip(shifts, positions, bases):
+                    variant += (base - codes[p]) << shift
+                yield variant, distance
+
+
+def hash_keys(keys, n_bits):
+    """Fibonacci hash of uint64 keys into n_bits bits"""
+    keys = np.asarray(keys, dtype=np.uint64)
+    return (keys * HASH_MULTIPLIER) >> np.uint64(64 - n_bits)
+
+
+class BarcodeMatcher(object):
+    """
+    Assigns reads to samples by their index barcodes, allowing up to
+    mismatches[i] mismatches in index read i.
+
+    Every barcode is expanded up front into all the sequences within the
+    allowed Hamming distances, encoded 2 bits per base into integer keys.
+    Reads are encoded the same way straight from their raw bcl bytes and
+    looked up in batches, in a direct lookup table when the keys are short
+    enough and in a hash table otherwise. No-calls count
+    as mismatches, reads with no-calls are compared to every barcode.
+
+    Two samples collide when a read can be within the allowed mismatches of
+    both. Collisions raise a ValueError unless allow_collisions is set, in
+    which case a read goes to the closest sample and ties are undetermined.
+    """
+
+    def __init__(self, barcodes, mismatches=1, allow_collisions=False):
+        self.barcodes = [tuple(barcode) for barcode in barcodes]
+        if not self.barcodes:
+            raise ValueError('No barcodes to match')
+
+        self.n_indexes = len(self.barcodes[0])
+        self.lengths = tuple(len(index) for index in self.barcodes[0])
+        if any(tuple(map(len, b)) != self.lengths for b in self.barcodes):
+            raise ValueError('Barcodes of an index read differ in length')
+        if sum(self.lengths) > 32:
+            raise ValueError('Barcodes longer than 32 bases are not supported')
+        if self.n_indexes == 0 and len(self.barcodes) > 1:
+            raise ValueError('Samples without barcodes can not be told apart')
+
+        if isinstance(mismatches, int):
+            mismatches = (mismatches,) * self.n_indexes
+        self.mismatches = tuple(mismatches)
+        if len(self.mismatches) != self.n_indexes:
+            raise ValueError('Expected the mismatches of every index read')
+
+        # sample barcodes as (samples x cycles) base codes
+        self.codes = np.array([[BASES.index(base)
+                                for base in ''.join(barcode)]
+                               for barcode in self.barcodes],
+                              dtype=np.uint8).reshape(len(self.barcodes), -1)
+
+        self.collisions = self.find_collisions()
+        if self.collisions and not allow_collisions:
+            pairs = ', '.join(
+                f'{"+".join(self.barcodes[a])} and {"+".join(self.barcodes[b])}'
+                for a, b in self.collisions[:5]
+            )
+            raise ValueError(
+                f'{len(self.collisions)} barcode collisions with '
+                f'{self.mismatches} mismatches: {pairs}'
+            )
+
+        self.keys, self.samples = self.build_keys()
+        self.table = None
+
+    def __getstate__(self):
+        # the lookup table is rebuilt from the keys instead of being sent to
+        # other processes
+        state = self.__dict__.copy()
+        state['table'] = None
+        return state
+
+    def index_slices(self):
+        starts = np.cumsum((0,) + self.lengths)
+        return [slice(a, b) for a, b in zip(starts[:-1], starts[1:])]
+
+    def find_collisions(self):
+        """
+        Return the (sample, sample) pairs a read can be assigned to both of,
+        barcodes collide when every index is within twice the allowed
+        mismatches of the other sample.
+        """
+        collide = np.ones((len(self.codes),) * 2, dtype=bool)
+        for index, mismatches in zip(self.index_slices(), self.mismatches):
+            codes = self.codes[:, index]
+            distances = (codes[:, None, :] != codes[None, :, :]).sum(axis=2)
+            collide &= distances <= 2 * mismatches
+
+        first, second = np.nonzero(np.triu(collide, k=1))
+        return list(zip(first.tolist(), second.tolist()))
+
+    def build_keys(self):
+        """
+        Expand the barcodes into sorted keys and the sample each key is
+        assigned to, -1 where the closest samples are tied.
+        """
+        keys = []
+        samples = []
+        distances = []
+        for sample, barcode in enumerate(self.barcodes):
+            variants = [
+                list(barcode_variants(index, mismatches))
+                for index, mismatches in zip(barcode, self.mismatches)
+            ]
+            for combination in itertools.product(*variants):
+                key = 0
+                distance = 0
+                for length, variant in zip(self.lengths, combination):
+                    key = (key << 2 * length) | variant[0]
+                    distance += variant[1]
+                keys.append(key)
+                samples.append(sample)
+                distances.append(distance)
+
+        keys = np.array(keys, dtype=np.uint64)
+        samples = np.array(samples, dtype=np.int32)
+        distances = np.array(distances, dtype=np.int32)
+
+        order = np.lexsort((distances, keys))
+        keys, samples, distances = keys[order], samples[order], distances[order]
+
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+
+        # the closest sample of a key is tied when the next variant of the
+        # same key is as close and belongs to another sample
+        tied = np.zeros(len(keys), dtype=bool)
+        tied[:-1] = (
+            ~first[1:] & (distances[1:] == distances[:-1]) &
+            (samples[1:] != samples[:-1])
+        )
+        samples = np.where(tied, -1, samples)
+
+        return keys[first], samples[first]
+
+    def index_values(self):
+        """
+        Return the distinct barcodes of every index read and, for every
+        sample, the position of its barcode among them.
+        """
+        values = []
+        for index in self.index_slices():
+            distinct, inverse = np.unique(
+                self.codes[:, index], axis=0, return_inverse=True
+            )
+            values.append((distinct, inverse.reshape(-1)))
+        return values
+
+    def is_factorable(self):
+        """
+        Whether reads can be assigned one index read at a time, which needs
+        the distinct barcodes of every index read to be far enough apart for
+        a read to be within the allowed mismatches of at most one of them.
+        """
+        if self.n_indexes < 2:
+            return False
+        for length, (distinct, _), mismatches in zip(self.lengths,
+                                                     self.index_values(),
+                                                     self.mismatches):
+            if 2 * length > BARCODE_LOOKUP_BITS:
+                return False
+            distances = (distinct[:, None, :] != distinct[None]).sum(axis=2)
+            if np.triu(distances <= 2 * mismatches, k=1).any():
+                return False
+        return True
+
+    def lookup_table(self):
+        """
+        Build the table reads are looked up in, one of
+        - a direct lookup table from key to sample (-1 if no sample) for
+          short barcodes,
+        - ('index', tables, samples) with a direct lookup table per index read
+          from its key to the distinct barcode it matches and the samples of
+          every combination of distinct barcodes, when the barcodes factor
+          that way (see is_factorable),
+        - ('hash', slot keys, slot samples), an open addressing hash table of
+          the keys with -2 marking empty slots.
+        """
+        if self.table is not None:
+            return self.table
+
+        n_bits = 2 * sum(self.lengths)
+        if n_bits <= BARCODE_LOOKUP_BITS:
+            table = np.full(1 << n_bits, -1, dtype=np.int32)
+            table[self.keys.astype(np.int64)] = self.samples
+            self.table = table
+
+        elif self.is_factorable():
+            tables = []
+            combinations = []
+            for length, (distinct,
+                         inverse), mismatches in zip(self.lengths,
+                                                     self.index_values(),
+                                                     self.mismatches):
+                table = np.full(1 << 2 * length, -1, dtype=np.int32)
+                for value, codes in enumerate(distinct):
+                    barcode = ''.join(BASES[code] for code in codes)
+                    for key, _ in barcode_variants(barcode, mismatches):
+                        table[key] = value
+                tables.append(table)
+                combinations.append(inverse)
+
+            shape = tuple(len(distinct) for distinct, _ in self.index_values())
+            flat = np.ravel_multi_index(combinations, shape)
+            samples = np.full(np.prod(shape), -1, dtype=np.int32)
+            samples[flat] = np.arange(len(self.barcodes))
+            # samples with the same barcodes are tied
+            samples[np.bincount(flat, minlength=len(samples)) > 1] = -1
+            self.table = ('index', tables, samples.reshape(shape))
+
+        else:
+            # at most a quarter of the slots are used, so lookups of keys
+            # that are not in the table hit an empty slot after a probe or two
+            n_slot_bits = max(int(len(self.keys) * 4 - 1).bit_length(), 1)
+            slot_keys = np.zeros(1 << n_slot_bits, dtype=np.uint64)
+            slot_samples = np.full(1 << n_slot_bits, -2, dtype=np.int32)
+
+            mask = (1 << n_slot_bits) - 1
+            slots = hash_keys(self.keys, n_slot_bits).tolist()
+            for key, sample, slot in zip(self.keys.tolist(),
+                                         self.samples.tolist(), slots):
+                while slot_samples[slot] != -2:
+                    slot = (slot + 1) & mask
+                slot_keys[slot] = key
+                slot_samples[slot] = sample
+            self.table = ('hash', slot_keys, slot_samples)
+
+        return self.table
+
+    def lookup(self, index_keys):
+        """
+        Look up the samples of reads from the keys of each of their index
+        reads, -1 if no sample.
+        """
+        table = self.lookup_table()
+
+        if isinstance(table, tuple) and table[0] == 'index':
+            _, tables, samples = table
+            values = [t[keys] for t, keys in zip(tables, index_keys)]
+            matched = np.logical_and.reduce([v >= 0 for v in values])
+            return np.where(matched, samples[tuple(values)], -1)
+
+        keys = index_keys[0].astype(np.uint64)
+        for length, part in zip(self.lengths[1:], index_keys[1:]):
+            keys <<= np.uint64(2 * length)
+            keys |= part
+
+        if not isinstance(table, tuple):
+            return table[keys]
+
+        _, slot_keys, slot_samples = table
+        n_slot_bits = len(slot_keys).bit_length() - 1
+        mask = np.uint64(len(slot_keys) - 1)
+
+        slots = hash_keys(keys, n_slot_bits)
+        slot_sample = slot_samples[slots]
+        hit = (slot_keys[slots] == keys) & (slot_sample != -2)
+        samples = np.where(hit, slot_sample, -1).astype(np.int32)
+
+        # linear probing of the keys that hit another key, one vectorized
+        # probe at a time until they hit their key or an empty slot
+        active = np.nonzero(~hit & (slot_sample != -2))[0]
+        slots = slots[active]
+        while len(active):
+            slots = (slots + np.uint64(1)) & mask
+            slot_sample = slot_samples[slots]
+            hit = (slot_keys[slots] == keys[active]) & (slot_sample != -2)
+            samples[active[hit]] = slot_sample[hit]
+
+            unresolved = ~hit & (slot_sample != -2)
+            active = active[unresolved]
+            slots = slots[unresolved]
+        return samples
+
+    def assign(self, records):
+        """
+        Assign reads to samples from a (reads x index cycles) matrix of raw
+        bcl bytes, holding the cycles of every index read one after the
+        other. Returns the sample of every read, -1 when undetermined.
+        """
+        records = np.asarray(records, dtype=np.uint8)
+        assigned = np.empty(len(records), dtype=np.int32)
+        if self.n_indexes == 0:
+            assigned[:] = 0
+            return assigned
+
+        no_call = np.zeros(len(records), dtype=bool)
+        # batches small enough for the intermediate arrays to stay in cache
+        for start in range(0, len(records), BARCODE_BATCH_SIZE):
+            stop = start + BARCODE_BATCH_SIZE
+            assigned[start:stop], no_call[start:stop] = self.assign_batch(
+                records[start:stop]
+            )
+
+        no_call = np.nonzero(no_call)[0]
+        if len(no_call):
+            assigned[no_call] = self.assign_no_calls(records[no_call])
+        return assigned
+
+    def assign_batch(self, records):
+        """
+        Look up the samples of a batch of reads by their barcode keys.
+        Returns the samples and which reads have no-calls, the samples of
+        those reads are not valid.
+        """
+        n_reads = len(records)
+
+        index_keys = []
+        no_call = np.zeros(n_reads, dtype=bool)
+        for index in self.index_slices():
+            key_dtype = np.uint32 if index.stop - index.start <= 16 else np.uint64
+            keys = np.zeros(n_reads, dtype=key_dtype)
+            # one pass per cycle, contiguous when records is cycle-major
+            for cycle in range(index.start, index.stop):
+                column = records[:, cycle]
+                keys <<= key_dtype(2)
+                keys |= column & 3
+                no_call |= column == 0
+            index_keys.append(keys)
+
+        return self.lookup(index_keys), no_call
+
+    def assign_no_calls(self, records):
+        """Assign reads with no-calls by comparing them to every barcode"""
+        # no-calls get a code that mismatches every base
+        codes = np.where(records == 0, len(BASES), records & 3)
+
+        n_samples = len(self.codes)
+        assigned = np.empty(len(records), dtype=np.int32)
+        for start in range(0, len(records), NO_CALL_BATCH_SIZE):
+            batch = codes[start:start + NO_CALL_BATCH_SIZE]
+
+            # reads x samples distances, accumulated one cycle at a time
+            distance = np.zeros((len(batch), n_samples), dtype=np.int32)
+            within = np.ones((len(batch), n_samples), dtype=bool)
+            for index, mismatches in zip(self.index_slices(), self.mismatches):
+                index_distance = np.zeros_like(distance)
+                for cycle in range(index.start, index.stop):
+                    index_distance += (
+                        batch[:, cycle, None] != self.codes[None, :, cycle]
+                    )
+                within &= index_distance <= mismatches
+                distance += index_distance
+
+            distance[~within] = np.iinfo(np.int32).max
+            best = distance.argmin(axis=1)
+            best_distance = distance[np.arange(len(batch)), best]
+            n_best = (distance == best_distance[:, None]).sum(axis=1)
+
+            assigned[start:start + len(batch)] = np.where(
+                within.any(axis=1) & (n_best == 1), best, -1
+            )
+        return assigned
@@ -1,48 +1,87 @@
+import gzip
+import os
 import struct
+from abc import ABC, abstractmethod
 
-from .utils import type_to_num_bytes
-# import gzip
+import numpy as np
+
+from .utils import type_to_num_bytes, type_to_dtype, iter_line_chunks
+from .config import READ_CHUNK_SIZE, STREAM_CHUNK_SIZE, WRITE_BUFFER_SIZE
+from .BGZFFile import (
+    BGZFReader, BGZFWriter, GZIP_MAGIC, block_index, replace_first_block
+)
 
 compression = (None, 'gzip', 'bgzip')
 
 
-class BinaryFile(object):
+class BinaryFile(ABC):
+    """
+    A binary file of a header followed by fixed size records, both described
+    by struct formats. Subclasses define the values of their header with
+    header_values.
+    """
 
-    def __init__(self, path, header_fmt, record_fmt, compression=None):
+    def __init__(
+        self, path, header_fmt, record_fmt, compression=None, threads=1
+    ):
         self.path = path
         self.header_fmt = header_fmt
         self.record_fmt = record_fmt
 
         self.header_len = type_to_num_bytes(self.header_fmt)
         self.record_len = type_to_num_bytes(self.record_fmt)
+        self.record_dtype = type_to_dtype(self.record_fmt)
 
         self.compression = compression
+        # number of threads compressing blocks on write
+        self.threads = threads
 
         self.file = None
 
+    def __getstate__(self):
+        # open file handles can not be sent to other processes
+        state = self.__dict__.copy()
+        state['file'] = None
+        return state
+
     def isopen(self):
         if self.file is None:
             return False
         else:
             return not self.file.closed
 
+    def is_compressed(self):
+        """
+        Whether the file is read through a decompressor. Existing files that
+        do not start with the gzip magic number are read as raw files even
+        if a compression is set.
+        """
+        if self.compression is None:
+            return False
+        if not os.path.exists(self.path):
+            return True
+        with open(self.path, 'rb') as f:
+            return f.read(2) == GZIP_MAGIC
+
     def open(self, mode):
         # read = 'rb', write append = 'ab', seek write = 'r+b'
         write = True if '+' in mode or 'w' in mode or 'a' in mode else False
         if not self.isopen():
             if self.compression is None:
                 self.file = open(self.path, mode)
-            elif self.compression == 'gzip':
-                # TODO fix this
-                # self.file = gzip.open(self.path, mode)
+            elif write:
+                if '+' in mode:
+                    raise ValueError(
+                        f'Can not open compressed file {self.path} in {mode}'
+                    )
+                # bgzf files are valid gzip files, so gzip is written as bgzf
+                self.file = BGZFWriter(self.path, mode, threads=self.threads)
+            elif not self.is_compressed():
                 self.file = open(self.path, mode)
+            elif self.compression == 'gzip':
+                self.file = gzip.open(self.path, mode)
             elif self.compression == 'bgzip':
-                if write:
-                    self.file = open(self.path, mode)
-                else:
-                    # TODO fix this
-                    # self.file = gzip.open(self.path, mode)
-                    self.file = open(self.path, mode)
+                self.file = BGZFReader(self.path)
         return
 
     def close(self):
@@ -56,35 +95,178 @@ class BinaryFile(object):
 
         return header
 
-    def read_record(self, skip_header=True):
-        self.open('rb')
+    def n_records(self):
+        """Number of complete records stored after the header"""
+        if not self.is_compressed():
+            n_bytes = os.path.getsize(self.path) - self.header_len
+        elif self.compression == 'bgzip':
+            _, data_offsets = block_index(self.path)
+            n_bytes = data_offsets[-1] - self.header_len
+        else:
+            return len(self.read_buffer()) // self.record_len
+        return max(n_bytes, 0) // self.record_len
 
-        if skip_header:
-            self.file.seek(self.header_len)
+    def save_block_index(self):
+        """Save the block index of a bgzf file next to it (see block_index),
+        done by the commands that write bgzf files"""
+        if self.compression == 'bgzip' and self.is_compressed():
+            block_index(self.path, save=True)
+
+    def memmap(self):
+        """
+        Memory-map the records of the file as a structured array with one
+        field (f0, f1, ...) per value of the record format. Nothing is read
+        until the array is indexed, so slicing a cluster range is O(1).
+        """
+        n_records = self.n_records()
+        if n_records == 0:
+            # mmap can not map zero bytes
+            return np.empty(0, dtype=self.record_dtype)
+
+        return np.memmap(
+            self.path,
+            dtype=self.record_dtype,
+            mode='r',
+            offset=self.header_len,
+            shape=(n_records,)
+        )
+
+    def read_array(self, start=None, stop=None, step=None, indices=None):
+        """
+        Read a range of records as a structured array. Uncompressed files are
+        memory-mapped and returned as a zero copy view, a range of a bgzf file
+        only inflates the blocks holding it (see BGZFReader.seek_uncompressed).
+        indices selects single records instead of a range.
+        """
+        if indices is not None:
+            return self.read_indices(indices)
+
+        if not self.is_compressed():
+            records = self.memmap()
+        elif (self.compression == 'bgzip' and (step is None or step > 0)
+              and (start is not None or stop is not None)):
+            return self.read_range(start, stop)[::step]
         else:
-            self.read_header()
+            records = np.frombuffer(self.read_buffer(), dtype=self.record_dtype)
+        return records[start:stop:step]
+
+    def read_range(self, start, stop):
+        """Read the records start to stop (python slice bounds) of a bgzf
+        file, seeking to them with its block index"""
+        with BGZFReader(self.path) as reader:
+            n_records = max(reader.size() - self.header_len, 0)
+            n_records //= self.record_len
+            start, stop, _ = slice(start, stop).indices(n_records)
+            stop = max(start, stop)
+
+            reader.seek_uncompressed(self.header_len + start * self.record_len)
+            buffer = reader.read((stop - start) * self.record_len)
+        return np.frombuffer(buffer, dtype=self.record_dtype)
+
+    def read_indices(self, indices):
+        """
+        Read the records at the given indices, negative indices count from the
+        end of the file. Only the records between the first and the last
+        index are read.
+        """
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        if len(indices) == 0:
+            return np.empty(0, dtype=self.record_dtype)
 
-        itr = struct.iter_unpack(self.record_fmt, self.file.read())
-        for idx, record in enumerate(itr):
-            yield record
+        n_records = self.n_records()
+        if indices.min() < -n_records or indices.max() >= n_records:
+            raise IndexError(
+                f'Record index out of range for {self.path} with '
+                f'{n_records} records'
+            )
+        indices = indices % n_records
 
-        # this may be unnecessary
+        if not self.is_compressed():
+            return self.memmap()[indices]
+        first = int(indices.min())
+        records = self.read_array(first, int(indices.max()) + 1)
+        return records[indices - first]
+
+    def read_record(
+        self, skip_header=True, start=None, stop=None, step=None, indices=None
+    ):
+        records = self.read_array(start, stop, step, indices)
+
+        # convert to python tuples a chunk at a time to keep memory flat
+        for start in range(0, len(records), READ_CHUNK_SIZE):
+            for record in records[start:start + READ_CHUNK_SIZE].tolist():
+                yield record
+
+    def format_text(self, records):
+        """
+        Format an array of records as tab separated lines, the text of a
+        value is str() of the python value, as written by utils.clean_pipe.
+        The whole batch is formatted with a single % operation.
+        """
+        n_fields = len(self.record_dtype.names)
+        line = '\t'.join(['%s'] * n_fields) + '\n'
+        values = [value for record in records.tolist() for value in record]
+        return ((line * len(records)) % tuple(values)).encode('ascii')
+
+    def columns(self, records):
+        """Split an array of records into named columns, see export"""
+        return {name: records[name] for name in self.record_dtype.names}
+
+    def read_columns(self, start=None, stop=None, step=None, indices=None):
+        """Read a selection of records (see read_array) as named columns"""
+        return self.columns(self.read_array(start, stop, step, indices))
+
+    def read_text(
+        self,
+        start=None,
+        stop=None,
+        step=None,
+        indices=None,
+        chunk_size=READ_CHUNK_SIZE
+    ):
+        """
+        Read a selection of records (see read_array) and yield them as blocks
+        of text, chunk_size records at a time, see utils.pipe_text.
+        """
+        records = self.read_array(start, stop, step, indices)
+        for chunk_start in range(0, len(records), chunk_size):
+            yield self.format_text(
+                records[chunk_start:chunk_start + chunk_size]
+            )
+
+    def read_buffer(self):
+        """Read every record after the header as a single bytes object"""
+        self.open('rb')
+
+        # read the header instead of seeking, offsets in compressed files are
+        # not byte offsets
+        self.file.read(self.header_len)
+        buffer = self.file.read()
         self.close()
 
+        return buffer
+
     def write_header(self, *header_values):
         self.open('wb')
 
         header = struct.pack(self.header_fmt, *header_values)
 
-        self.file.write(header)
+        if self.compression is None:
+            self.file.write(header)
+        else:
+            # the header gets its own block so it can be patched in place
+            self.file.write_stored_block(header)
 
         self.close()
 
     def change_header(self, *header_values):
-        self.open('r+b')
-
         header = struct.pack(self.header_fmt, *header_values)
 
+        if self.compression is not None:
+            return replace_first_block(self.path, header)
+
+        self.open('r+b')
+
         self.file.seek(0)
         self.file.write(header)
         self.close()
@@ -98,10 +280,145 @@ class BinaryFile(object):
             return self.close()
         return
 
-    def write_from_stream(self, stream):
-        # assume the stream is open already
-        for line in stream:
-            data = line.strip().split()
-            yield data
+    @abstractmethod
+    def header_values(self, n_records):
+        """Header values of a file holding n_records records"""
+
+    def writer(self, buffer_size=WRITE_BUFFER_SIZE, keep_open=True):
+        """
+        Return a RecordWriter that (re)creates the file, buffers records and
+        patches the record count in the header once it is closed.
+        """
+        return RecordWriter(self, buffer_size=buffer_size, keep_open=keep_open)
+
+    def parse_text(self, text):
+        """
+        Parse lines of whitespace separated values (bytes) into an array of
+        records, one record per line. Numbers are parsed as doubles or 64-bit
+        ints and cast to the record types on write.
+        """
+        tokens = text.split()
+        n_fields = len(self.record_dtype.names)
+        if len(tokens) % n_fields:
+            raise ValueError(
+                f'Expected {n_fields} values per line to write {self.path}'
+            )
+
+        kind = self.record_dtype.fields['f0'][0].kind
+        value_type = np.float64 if kind == 'f' else np.int64
+        values = np.array(tokens, dtype=bytes).astype(value_type)
+        return values.reshape(-1, n_fields)
+
+    def write_from_stream(self, stream, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Parse an open stream of text lines chunk_size bytes at a time, see
+        parse_text. Yields arrays of records to be written with a
+        RecordWriter.
+        """
+        stream = getattr(stream, 'buffer', stream)
+        for text in iter_line_chunks(stream, chunk_size):
+            yield self.parse_text(text)
+
+
+class RecordWriter(object):
+    """
+    Buffered writer for a BinaryFile.
 
+    Records are packed into a preallocated buffer and written to disk in
+    chunks of buffer_size bytes. The header is written when the writer is
+    opened and patched with the final record count when it is closed.
+    With keep_open=False the file is only opened while a chunk is flushed,
+    so many writers can be active without running out of file handles.
+    """
+
+    def __init__(
+        self, binary_file, buffer_size=WRITE_BUFFER_SIZE, keep_open=True
+    ):
+        self.binary_file = binary_file
+        self.keep_open = keep_open
+
+        record_len = binary_file.record_len
+        n_buffer_records = max(buffer_size // record_len, 1)
+        self.buffer = bytearray(n_buffer_records * record_len)
+        self.buffer_array = np.frombuffer(self.buffer, dtype=np.uint8)
+        self.offset = 0
+
+        self.record = struct.Struct(binary_file.record_fmt)
+        self.n_records = 0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
         self.close()
+
+    def open(self):
+        self.binary_file.write_header(*self.binary_file.header_values(0))
+        if not self.keep_open:
+            return
+
+        if self.binary_file.compression is None:
+            self.binary_file.open('r+b')
+            self.binary_file.file.seek(0, os.SEEK_END)
+        else:
+            self.binary_file.open('ab')
+
+    def write_record(self, *record_values):
+        self.record.pack_into(self.buffer, self.offset, *record_values)
+        self.offset += self.record.size
+        self.n_records += 1
+
+        if self.offset == len(self.buffer):
+            self.flush()
+
+    def write_array(self, records):
+        """
+        Write an array of records. Structured arrays must match the record
+        dtype of the file, plain arrays are cast to the type of the record
+        values (all values of a record are assumed to share one type).
+        """
+        dtype = self.binary_file.record_dtype
+        records = np.asarray(records)
+        if records.dtype != dtype:
+            value_dtype = dtype.fields['f0'][0]
+            records = np.ascontiguousarray(records, dtype=value_dtype)
+            records = records.reshape(-1).view(dtype)
+
+        data = np.ascontiguousarray(records).view(np.uint8).reshape(-1)
+        self.n_records += len(records)
+
+        if self.offset + len(data) <= len(self.buffer):
+            self.buffer_array[self.offset:self.offset + len(data)] = data
+            self.offset += len(data)
+        else:
+            # large arrays skip the buffer and go to disk in a single write
+            self.flush()
+            self._write(data)
+
+    def flush(self):
+        if self.offset:
+            self._write(memoryview(self.buffer)[:self.offset])
+            self.offset = 0
+
+    def close(self):
+        self.flush()
+
+        header_values = self.binary_file.header_values(self.n_records)
+        if self.binary_file.isopen() and self.binary_file.compression is None:
+            header = struct.pack(self.binary_file.header_fmt, *header_values)
+            self.binary_file.file.seek(0)
+            self.binary_file.file.write(header)
+            self.binary_file.close()
+        else:
+            if self.binary_file.isopen():
+                self.binary_file.close()
+            self.binary_file.change_header(*header_values)
+
+    def _write(self, data):
+        if self.keep_open:
+            self.binary_file.file.write(data)
+        else:
+            self.binary_file.open('ab')
+            self.binary_file.file.write(data)
+            self.binary_file.close()
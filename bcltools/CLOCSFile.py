@@ -0,0 +1,199 @@
+import struct
+from itertools import accumulate, chain, repeat
+
+import numpy as np
+
+from .config import CLOCS_BLOCK_SIZE, CLOCS_IMAGE_WIDTH, READ_CHUNK_SIZE
+
+
+class CLOCSFile(object):
+    """
+    The clocs file format stores the cluster positions of a tile binned in
+    squares of block_size pixels, the bins are numbered row by row with
+    ceil(image_width / block_size) bins per row:
+    byte 1       : unsigned char version number (1)
+    bytes 2-5    : unsigned int numBins
+    then for every bin:
+    byte 1       : unsigned char numClusters of the bin
+    then for every cluster of the bin:
+    byte 1       : unsigned char dx, in tenths of a pixel from the bin corner
+    byte 2       : unsigned char dy, in tenths of a pixel from the bin corner
+
+    Clusters take 2 bytes instead of the 8 of a locs file, positions are
+    rounded to 0.1 pixel. The clusters of a clocs file are in bin order, so
+    the records of the bcl and filter files of the tile must be in the same
+    order, see sort_order.
+    """
+
+    def __init__(
+        self, path, image_width=CLOCS_IMAGE_WIDTH, block_size=CLOCS_BLOCK_SIZE
+    ):
+        self.path = path
+        self.image_width = image_width
+        self.block_size = block_size
+        self.blocks_per_line = -(-image_width // block_size)
+
+        self.header_fmt = '<BI'
+        self.header_len = struct.calcsize(self.header_fmt)
+        self.version_num = 1
+
+    def read_header_clocs(self):
+        with open(self.path, 'rb') as f:
+            version_num, n_bins = struct.unpack(
+                self.header_fmt, f.read(self.header_len)
+            )
+        return ((version_num, n_bins),)
+
+    def bins(self, coords):
+        """Return the bin of each of the (N, 2) x, y coordinates"""
+        coords = np.asarray(coords, dtype=np.float32).reshape(-1, 2)
+        x, y = coords[:, 0], coords[:, 1]
+        # the last bin of a row may extend past the edge of the image
+        width = self.blocks_per_line * self.block_size
+        outside = ~((x >= 0) & (x < width) & (y >= 0))
+        if outside.any():
+            x_bad, y_bad = coords[np.argmax(outside)]
+            raise ValueError(
+                f'Cluster at ({x_bad}, {y_bad}) is outside of an image '
+                f'{self.image_width} pixels wide, see --image-width'
+            )
+
+        columns = (x // self.block_size).astype(np.int64)
+        rows = (y // self.block_size).astype(np.int64)
+        return rows * self.blocks_per_line + columns
+
+    def sort_order(self, coords):
+        """Return the (stable) order that sorts coordinates in bin order"""
+        return np.argsort(self.bins(coords), kind='stable')
+
+    def decode(self, data):
+        """
+        Decode the bytes of a clocs file into (N, 2) float32 coordinates.
+        Only the offsets of the bins are found one bin at a time, as each
+        depends on the size of the previous bin, the clusters are decoded
+        with array operations.
+        """
+        body = np.frombuffer(data, dtype=np.uint8, offset=self.header_len)
+        _, n_bins = struct.unpack_from(self.header_fmt, data)
+        if n_bins == 0:
+            return np.empty((0, 2), dtype=np.float32)
+
+        sizes = data[self.header_len:]
+        offsets = np.fromiter(
+            accumulate(
+                chain([0], repeat(None, n_bins - 1)),
+                lambda offset, _: offset + 1 + 2 * sizes[offset]
+            ),
+            dtype=np.int64,
+            count=n_bins
+        )
+        counts = body[offsets].astype(np.int64)
+
+        bins = np.repeat(np.arange(n_bins), counts)
+        # rank of every cluster within its bin
+        firsts = np.cumsum(counts) - counts
+        ranks = np.arange(len(bins)) - np.repeat(firsts, counts)
+        positions = np.repeat(offsets + 1, counts) + 2 * ranks
+
+        coords = np.empty((len(bins), 2), dtype=np.float32)
+        coords[:, 0] = (bins % self.blocks_per_line) * self.block_size
+        coords[:, 1] = (bins // self.blocks_per_line) * self.block_size
+        coords[:, 0] += body[positions] / np.float32(10)
+        coords[:, 1] += body[positions + 1] / np.float32(10)
+        return coords
+
+    def encode(self, coords):
+        """Encode (N, 2) coordinates, already in bin order, as the bytes of a
+        clocs file"""
+        coords = np.asarray(coords, dtype=np.float32).reshape(-1, 2)
+        bins = self.bins(coords)
+        if np.any(bins[1:] < bins[:-1]):
+            raise ValueError(
+                'Clusters of a clocs file must be in bin order, see sort_order'
+            )
+
+        n_bins = int(bins[-1]) + 1 if len(bins) else 0
+        counts = np.bincount(bins, minlength=n_bins)
+        if len(counts) and counts.max() > 255:
+            raise ValueError(
+                f'Bin {np.argmax(counts)} of {self.path} holds '
+                f'{counts.max()} clusters, a clocs bin holds at most 255'
+            )
+
+        # each bin takes 1 byte for its count and 2 per cluster
+        offsets = np.arange(n_bins) + 2 * (np.cumsum(counts) - counts)
+        firsts = np.cumsum(counts) - counts
+        ranks = np.arange(len(bins)) - firsts[bins]
+        positions = offsets[bins] + 1 + 2 * ranks
+
+        corners = np.column_stack(
+            ((bins % self.blocks_per_line) * self.block_size,
+             (bins // self.blocks_per_line) * self.block_size)
+        )
+        # clusters rounded up to the edge of their bin stay inside it, so a
+        # decoded file encodes back to the same bins
+        deltas = np.rint((coords - corners) * 10)
+        deltas = np.clip(deltas, 0, 10 * self.block_size - 1).astype(np.uint8)
+
+        body = np.empty(n_bins + 2 * len(bins), dtype=np.uint8)
+        body[offsets] = counts
+        body[positions] = deltas[:, 0]
+        body[positions + 1] = deltas[:, 1]
+
+        header = struct.pack(self.header_fmt, self.version_num, n_bins)
+        return header + body.tobytes()
+
+    def read_coords(self, start=None, stop=None, step=None, indices=None):
+        """
+        Read the coordinates of a selection of clusters (see
+        BinaryFile.read_array) as a float32 (N, 2) array of x, y, like
+        LOCSFile.read_coords. The whole file is decoded.
+        """
+        with open(self.path, 'rb') as f:
+            coords = self.decode(f.read())
+        if indices is not None:
+            return coords[np.asarray(indices, dtype=np.int64)]
+        return coords[start:stop:step]
+
+    def n_clusters(self):
+        return len(self.read_coords())
+
+    def write_coords(self, coords):
+        """Write a whole clocs file from (N, 2) x, y coordinates in bin
+        order"""
+        data = self.encode(coords)
+        with open(self.path, 'wb') as f:
+            f.write(data)
+
+    def read_record_clocs(self, start=None, stop=None, step=None, indices=None):
+        coords = self.read_coords(start, stop, step, indices)
+        for chunk_start in range(0, len(coords), READ_CHUNK_SIZE):
+            chunk_stop = chunk_start + READ_CHUNK_SIZE
+            for x, y in coords[chunk_start:chunk_stop].tolist():
+                yield (x, y)
+
+    def read_text(
+        self,
+        start=None,
+        stop=None,
+        step=None,
+        indices=None,
+        chunk_size=READ_CHUNK_SIZE
+    ):
+        """Yield the selected clusters as blocks of "x\ty" lines, see
+        LOCSFile.format_text"""
+        coords = self.read_coords(start, stop, step, indices)
+        for chunk_start in range(0, len(coords), chunk_size):
+            chunk = coords[chunk_start:chunk_start + chunk_size]
+            values = tuple(chunk.ravel().tolist())
+            yield (('%.9g\t%.9g\n' * len(chunk)) % values).encode('ascii')
+
+    def read_columns(self, start=None, stop=None, step=None, indices=None):
+        coords = self.read_coords(start, stop, step, indices)
+        return {'x': coords[:, 0], 'y': coords[:, 1]}
+
+    def write_from_stream_clocs(self, infile):
+        """Write lines of "x y" coordinates, in bin order, to a clocs file"""
+        lines = infile.read().split()
+        coords = np.array(lines, dtype=np.float32).reshape(-1, 2)
+        self.write_coords(coords)
@@ -1,4 +1,15 @@
 import gzip
+import logging
+from contextlib import contextmanager
+from itertools import islice
+
+import numpy as np
+
+from .FASTQIndex import FASTQIndex
+from .config import CONVERT_BLOCK_SIZE, PREFETCH_BLOCKS
+from .utils import background_iter
+
+logger = logging.getLogger(__name__)
 
 
 class FASTQFile(object):
@@ -6,18 +17,125 @@ class FASTQFile(object):
     def __init__(self, path):
 
         self.path = path
+        self._index = None
+
+    def index(self, build=True):
+        """Return the FASTQIndex of the file. The index is loaded from its
+        sidecar file, or built with a single pass over the file and saved next
+        to it if there is none (or it is out of date)"""
+        if self._index is None:
+            self._index = FASTQIndex.load(self.path)
+        if self._index is None and build:
+            logger.debug(f'Indexing {self.path}')
+            self._index = FASTQIndex.build(self.path)
+            try:
+                self._index.save()
+            except OSError:
+                logger.warning(f'Could not save the index of {self.path}')
+        return self._index
 
     def n_reads(self):
         """Count the number of lines in a FASTQ file and divide by 4.
-        Returns the number of reads"""
-        with gzip.open(self.path, 'rb') as f:
-            for lidx, l in enumerate(f, 1):
-                pass
-            return lidx // 4
+        Returns the number of reads, which is cached in the index sidecar"""
+        return self.index().n_reads
 
     def read_len(self):
         """Get the length of a single FASTQ record"""
+        index = self.index(build=False)
+        if index is not None:
+            return index.read_len
         with gzip.open(self.path, 'rb') as f:
             next(f)
             seq = f.readline().strip()
             return len(seq)
+
+    @contextmanager
+    def open_at(self, read_number=0):
+        """Open the decompressed FASTQ file positioned at the start of read
+        read_number, decompression starts at the closest checkpoint of the
+        index"""
+        if read_number == 0:
+            with gzip.open(self.path, 'rb') as f:
+                yield f
+            return
+
+        checkpoint_read, member_offset, within = self.index(
+        ).checkpoint(read_number)
+        with open(self.path, 'rb') as raw:
+            raw.seek(member_offset)
+            with gzip.GzipFile(fileobj=raw, mode='rb') as f:
+                f.seek(within)
+                for _ in range(4 * (read_number - checkpoint_read)):
+                    f.readline()
+                yield f
+
+    def read_blocks(self, block_size=CONVERT_BLOCK_SIZE, start=0, stop=None):
+        """Read the reads [start, stop) of the FASTQ file block_size reads at
+        a time. Yields the header lines of a block together with its sequences
+        and quality strings as (reads x read length) uint8 matrices of ascii
+        codes"""
+        with self.open_at(start) as f:
+            read_number = start
+            while True:
+                n_block = block_size
+                if stop is not None:
+                    n_block = min(block_size, stop - read_number)
+                if n_block <= 0:
+                    return
+
+                lines = list(islice(f, 4 * n_block))
+                if not lines:
+                    return
+                read_number += len(lines) // 4
+                if len(lines) % 4:
+                    raise ValueError(f'{self.path} is truncated')
+
+                headers = lines[0::4]
+                seqs = lines_to_matrix(lines[1::4], self.path)
+                quals = lines_to_matrix(lines[3::4], self.path)
+
+                yield headers, seqs, quals
+
+    def prefetch_blocks(
+        self,
+        block_size=CONVERT_BLOCK_SIZE,
+        start=0,
+        stop=None,
+        n_blocks=PREFETCH_BLOCKS
+    ):
+        """Same as read_blocks, but the file is decompressed and parsed in a
+        background thread that stays up to n_blocks blocks ahead. zlib
+        releases the GIL, so several FASTQ files inflate in parallel"""
+        return background_iter(
+            self.read_blocks(block_size, start, stop), n_blocks
+        )
+
+
+def lines_to_matrix(lines, path):
+    """
+    Stack equal length lines into a uint8 matrix without their line endings.
+    Lines may end with \\n or \\r\\n, and the last line of a file may have no
+    line ending at all.
+    """
+    n_lines = len(lines)
+    line_len = len(lines[0])
+    buffer = b''.join(lines)
+    if len(buffer) == n_lines * line_len:
+        matrix = np.frombuffer(buffer, dtype=np.uint8)
+        matrix = matrix.reshape(n_lines, line_len)
+        if (matrix[:, -1] == ord('\n')).all():
+            end = line_len - 1
+            if end and (matrix[:, end - 1] == ord('\r')).all():
+                end -= 1
+            return matrix[:, :end]
+
+    # the last line of the file, or lines with mixed line endings
+    lines = [line.rstrip(b'\r\n') for line in lines]
+    lengths = set(len(line) for line in lines)
+    if len(lengths) > 1:
+        raise ValueError(
+            f'Reads in {path} do not all have the same length, '
+            f'found reads of {min(lengths)} to {max(lengths)} bases'
+        )
+    matrix = np.frombuffer(b''.join(lines), dtype=np.uint8)
+    return matrix.reshape(n_lines, lengths.pop())
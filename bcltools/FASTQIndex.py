@@ -0,0 +1,146 @@
+import bisect
+import json
+import os
+
+import numpy as np
+
+from .BGZFFile import is_bgzf, iter_bgzf_blocks, iter_gzip_members
+from .config import (
+    FASTQ_INDEX_EXTENSION, FASTQ_INDEX_INTERVAL, READ_BUFFER_SIZE
+)
+
+INDEX_VERSION = 1
+
+
+class FASTQIndex(object):
+    """
+    Sidecar index of a gzipped FASTQ file, stored as json next to it.
+
+    Holds the read count and read length of the file and checkpoints of
+    (read number, offset of a gzip member, offset of the read within the
+    uncompressed data of that member). Decompression can restart at any
+    gzip member, so bgzf and other multi-member files get a checkpoint every
+    interval reads. A single-member gzip file only has the checkpoint of its
+    first read.
+    """
+
+    def __init__(
+        self, path, n_reads, read_len, checkpoints, size=None, mtime=None
+    ):
+        self.path = path
+        self.n_reads = n_reads
+        self.read_len = read_len
+        self.checkpoints = checkpoints
+
+        # identify the version of the FASTQ file the index was built from
+        self.size = size
+        self.mtime = mtime
+
+        self.checkpoint_reads = [c[0] for c in checkpoints]
+
+    @staticmethod
+    def index_path(path):
+        return path + FASTQ_INDEX_EXTENSION
+
+    @classmethod
+    def build(cls, path, interval=FASTQ_INDEX_INTERVAL):
+        """Build the index with a single pass over the FASTQ file"""
+        checkpoints = [(0, 0, 0)]
+        next_read = interval
+
+        n_lines = 0
+        read_len = 0
+
+        member_offset = None
+        member_start = 0
+        uoffset = 0
+        with open(path, 'rb') as f:
+            if is_bgzf(path):
+                chunks = iter_bgzf_blocks(f)
+            else:
+                chunks = iter_gzip_members(f, READ_BUFFER_SIZE)
+
+            for offset, data in chunks:
+                if offset != member_offset:
+                    member_offset = offset
+                    member_start = uoffset
+
+                if not read_len and n_lines == 0:
+                    lines = data.split(b'\n', 2)
+                    if len(lines) == 3:
+                        read_len = len(lines[1].rstrip(b'\r'))
+
+                n_chunk_lines = data.count(b'\n')
+                newlines = None
+                while 4 * next_read <= n_lines + n_chunk_lines:
+                    if newlines is None:
+                        newlines = np.flatnonzero(
+                            np.frombuffer(data, dtype=np.uint8) == ord('\n')
+                        )
+                    # the read starts after the (4 * next_read)th newline
+                    position = newlines[4 * next_read - n_lines - 1] + 1
+                    within = int(uoffset + position - member_start)
+
+                    # only members past the previous checkpoint save work
+                    if member_offset != checkpoints[-1][1]:
+                        checkpoints.append((next_read, member_offset, within))
+                    next_read += interval
+
+                n_lines += n_chunk_lines
+                uoffset += len(data)
+
+        stat = os.stat(path)
+        return cls(
+            path,
+            n_lines // 4,
+            read_len,
+            checkpoints,
+            size=stat.st_size,
+            mtime=stat.st_mtime
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load the index of the FASTQ file at path. Returns None if there is no
+        index or if the FASTQ file changed since it was built.
+        """
+        index_path = cls.index_path(path)
+        if not os.path.exists(index_path):
+            return None
+
+        with open(index_path, 'r') as f:
+            data = json.load(f)
+
+        stat = os.stat(path)
+        if (data.get('version') != INDEX_VERSION or data['size'] != stat.st_size
+                or data['mtime'] != stat.st_mtime):
+            return None
+
+        return cls(
+            path,
+            data['n_reads'],
+            data['read_len'], [tuple(c) for c in data['checkpoints']],
+            size=data['size'],
+            mtime=data['mtime']
+        )
+
+    def save(self):
+        data = {
+            'version': INDEX_VERSION,
+            'size': self.size,
+            'mtime': self.mtime,
+            'n_reads': self.n_reads,
+            'read_len': self.read_len,
+            'checkpoints': self.checkpoints,
+        }
+        with open(self.index_path(self.path), 'w') as f:
+            json.dump(data, f)
+
+    def checkpoint(self, read_number):
+        """
+        Return the last checkpoint at or before read_number as
+        (read number, member offset, offset within the member).
+        """
+        idx = bisect.bisect_right(self.checkpoint_reads, read_number) - 1
+        return self.checkpoints[idx]
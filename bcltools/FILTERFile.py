@@ -1,5 +1,20 @@
+import struct
+
+import numpy as np
+
 from .BinaryFile import BinaryFile
-from .utils import filter2num, num2filter
+from .utils import filter2num, NUM2FILTER
+from .config import READ_CHUNK_SIZE
+
+
+def pack_mask(pass_filter):
+    """Pack a boolean pass filter mask into 8 clusters per byte"""
+    return np.packbits(np.asarray(pass_filter, dtype=bool))
+
+
+def unpack_mask(packed, n_clusters):
+    """Unpack the first n_clusters flags of a mask packed with pack_mask"""
+    return np.unpackbits(packed, count=n_clusters).view(bool)
 
 
 class FILTERFile(BinaryFile):
@@ -22,20 +37,65 @@ class FILTERFile(BinaryFile):
         magic_num, version_num, n_reads = self.read_header()
         return ((magic_num, version_num, n_reads),)
 
-    def read_record_filter(self, skip_header=True):
-        for record in self.read_record(skip_header=skip_header):
-            r, = record
-            value = r & 1
-            pass_filter = num2filter(value)
+    def read_record_filter(
+        self, skip_header=True, start=None, stop=None, step=None, indices=None
+    ):
+        pass_filter = self.read_mask(start, stop, step, indices)
+        flags = NUM2FILTER[1], NUM2FILTER[0]
+        for chunk_start in range(0, len(pass_filter), READ_CHUNK_SIZE):
+            chunk_stop = chunk_start + READ_CHUNK_SIZE
+            chunk = pass_filter[chunk_start:chunk_stop].tolist()
+            for kept in chunk:
+                yield (flags[not kept],)
+
+    def read_mask(
+        self, start=None, stop=None, step=None, indices=None, packed=False
+    ):
+        """
+        Read a selection of clusters (see read_array) as a boolean mask that
+        is True for the clusters passing filter, or bit-packed with
+        pack_mask if packed is set.
+        """
+        records = self.read_array(start, stop, step, indices)['f0']
+        pass_filter = (records & 1).view(bool)
+        return pack_mask(pass_filter) if packed else pass_filter
+
+    def write_mask(self, pass_filter, n_clusters=None):
+        """
+        Write a whole filter file from a boolean mask with a single write.
+        A bit-packed mask (see pack_mask) needs the number of clusters.
+        """
+        pass_filter = np.asarray(pass_filter)
+        if n_clusters is not None:
+            pass_filter = unpack_mask(pass_filter, n_clusters)
+        pass_filter = np.ascontiguousarray(pass_filter, dtype=bool)
+
+        header = struct.pack(
+            self.header_fmt, *self.header_values(len(pass_filter))
+        )
+        with open(self.path, 'wb') as f:
+            f.write(header)
+            pass_filter.view(np.uint8).tofile(f)
+
+    def format_text(self, records):
+        """Format records as Y (filtered out) or N (kept) lines"""
+        lines = np.empty((len(records), 2), dtype=np.uint8)
+        lines[:, 0] = np.where(records['f0'] & 1, ord('N'), ord('Y'))
+        lines[:, 1] = ord('\n')
+        return lines.tobytes()
 
-            yield (pass_filter,)
+    def columns(self, records):
+        return {'pass_filter': (records['f0'] & 1).view(bool)}
+
+    def header_values(self, n_reads):
+        return (self.magic_num, self.version_num, n_reads)
 
     def write_header_filter(self, n_reads):
-        header_values = (self.magic_num, self.version_num, n_reads)
+        header_values = self.header_values(n_reads)
         return self.write_header(*header_values)
 
     def change_header_filter(self, n_reads):
-        header_values = (self.magic_num, self.version_num, n_reads)
+        header_values = self.header_values(n_reads)
         return self.change_header(*header_values)
 
     def write_record_filter(self, pass_filter, keep_open=False):
@@ -44,12 +104,17 @@ class FILTERFile(BinaryFile):
         record_values = (pass_filter_value,)
         return self.write_record(*record_values, keep_open=keep_open)
 
-    def write_from_stream_filter(self, infile):
-        for idx, data in enumerate(self.write_from_stream(infile), 1):
-            pass_filter, = data
-            self.write_record_filter(pass_filter, keep_open=True)
-
-        self.close()
+    def parse_text(self, text):
+        """Parse Y (filtered out) or N (kept) lines, see parse_text"""
+        tokens = text.split()
+        chars = np.frombuffer(b''.join(tokens), dtype=np.uint8)
+        is_kept = chars == ord('N')
+        is_valid = is_kept | (chars == ord('Y'))
+        if len(chars) != len(tokens) or not is_valid.all():
+            raise ValueError(f'Expected Y or N per line to write {self.path}')
+        return is_kept.astype(np.uint8)
 
-        n_reads = idx
-        self.change_header_filter(n_reads)
+    def write_from_stream_filter(self, infile):
+        with self.writer() as writer:
+            for records in self.write_from_stream(infile):
+                writer.write_array(records)
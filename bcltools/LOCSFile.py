@@ -1,4 +1,18 @@
+import struct
+
+import numpy as np
+
 from .BinaryFile import BinaryFile
+from .config import READ_CHUNK_SIZE
+
+
+def bounding_box(coords):
+    """Return the (min x, min y, max x, max y) of (N, 2) coordinates"""
+    coords = np.asarray(coords, dtype=np.float32).reshape(-1, 2)
+    if len(coords) == 0:
+        raise ValueError('The bounding box of no clusters is undefined')
+    (x_min, y_min), (x_max, y_max) = coords.min(axis=0), coords.max(axis=0)
+    return float(x_min), float(y_min), float(x_max), float(y_max)
 
 
 class LOCSFile(BinaryFile):
@@ -27,18 +41,78 @@ class LOCSFile(BinaryFile):
         )  # vnum=1, magic_num=1.0
         return ((version_num, magic_num, n_reads),)
 
-    def read_record_locs(self, skip_header=True):
-        for record in self.read_record(skip_header=skip_header):
-            x, y = record
-
-            yield (x, y)
+    def read_record_locs(
+        self, skip_header=True, start=None, stop=None, step=None, indices=None
+    ):
+        coords = self.read_coords(start, stop, step, indices)
+        for chunk_start in range(0, len(coords), READ_CHUNK_SIZE):
+            chunk_stop = chunk_start + READ_CHUNK_SIZE
+            for x, y in coords[chunk_start:chunk_stop].tolist():
+                yield (x, y)
+
+    def read_coords(self, start=None, stop=None, step=None, indices=None):
+        """
+        Read the coordinates of a selection of clusters (see read_array) as
+        a float32 (N, 2) array of x, y. A contiguous range of an uncompressed
+        file is a view of its memory map, nothing is read until it is used.
+        """
+        records = self.read_array(start, stop, step, indices)
+        if records.strides == (self.record_len,):
+            return records.view(np.float32).reshape(-1, 2)
+        return np.column_stack((records['f0'], records['f1']))
+
+    def read_bounding_box(self, start=None, stop=None):
+        """Return the (min x, min y, max x, max y) of a range of clusters,
+        e.g. the clusters of one tile"""
+        return bounding_box(self.read_coords(start, stop))
+
+    def clusters_in_box(self, box, start=None, stop=None):
+        """
+        Select the clusters of a range (e.g. a tile) inside the box
+        (min x, min y, max x, max y), bounds included. Returns the indices of
+        the clusters relative to start and their (N, 2) coordinates.
+        """
+        x_min, y_min, x_max, y_max = box
+        coords = self.read_coords(start, stop)
+        x, y = coords[:, 0], coords[:, 1]
+        in_x = (x >= x_min) & (x <= x_max)
+        in_y = (y >= y_min) & (y <= y_max)
+        inside = np.flatnonzero(in_x & in_y)
+        return inside, coords[inside]
+
+    def write_coords(self, coords):
+        """Write a whole locs file from (N, 2) x, y coordinates with a single
+        write"""
+        coords = np.ascontiguousarray(coords, dtype=np.float32)
+        coords = coords.reshape(-1, 2)
+
+        header = struct.pack(self.header_fmt, *self.header_values(len(coords)))
+        with open(self.path, 'wb') as f:
+            f.write(header)
+            coords.tofile(f)
+
+    def format_text(self, records):
+        """
+        Format records as "x\ty" lines. 9 significant digits are enough to
+        read every 32-bit float back exactly and format much faster than the
+        shortest repr of the float.
+        """
+        values = np.column_stack((records['f0'], records['f1'])).ravel()
+        lines = ('%.9g\t%.9g\n' * len(records)) % tuple(values.tolist())
+        return lines.encode('ascii')
+
+    def columns(self, records):
+        return {'x': records['f0'], 'y': records['f1']}
+
+    def header_values(self, n_reads):
+        return (self.version_num, self.magic_num, n_reads)
 
     def write_header_locs(self, n_reads):
-        header_values = (self.version_num, self.magic_num, n_reads)
+        header_values = self.header_values(n_reads)
         return self.write_header(*header_values)
 
     def change_header_locs(self, n_reads):
-        header_values = (self.version_num, self.magic_num, n_reads)
+        header_values = self.header_values(n_reads)
         return self.change_header(*header_values)
 
     def write_record_locs(self, x, y, keep_open=False):
@@ -47,12 +121,6 @@ class LOCSFile(BinaryFile):
 
     def write_from_stream_locs(self, infile):
 
-        for idx, data in enumerate(self.write_from_stream(infile), 1):
-            x, y = map(float, data)
-
-            self.write_record_locs(x, y, keep_open=True)
-
-        self.close()
-
-        n_reads = idx
-        self.change_header_locs(n_reads)
+        with self.writer() as writer:
+            for records in self.write_from_stream(infile):
+                writer.write_array(records)
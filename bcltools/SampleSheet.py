@@ -0,0 +1,95 @@
+import csv
+import re
+
+from .config import BASES
+
+INDEX_COLUMNS = ('index', 'index2')
+
+
+class SampleSheet(object):
+    """
+    Illumina (IEM) sample sheet. The file is split into [Section] blocks,
+    [Data] holds one row per sample with at least a Sample_ID column and
+    the index and index2 barcodes of the sample, an optional Lane column
+    restricts a sample to one lane.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        self.sections = {}
+        self.samples = []
+        self.read()
+
+    def read(self):
+        section = None
+        with open(self.path, newline='') as f:
+            for row in csv.reader(f):
+                # trailing empty cells are padding added by spreadsheets
+                while row and not row[-1].strip():
+                    row.pop()
+                if not row:
+                    continue
+
+                match = re.fullmatch(r'\[(.+)\]', row[0].strip())
+                if match:
+                    section = match.group(1)
+                    self.sections[section] = []
+                elif section is not None:
+                    self.sections[section].append([c.strip() for c in row])
+
+        if 'Data' not in self.sections or not self.sections['Data']:
+            raise ValueError(f'{self.path} has no [Data] section')
+
+        columns, *rows = self.sections['Data']
+        if 'Sample_ID' not in columns:
+            raise ValueError(f'{self.path} has no Sample_ID column')
+
+        self.index_columns = [c for c in INDEX_COLUMNS if c in columns]
+        for row in rows:
+            sample = dict(zip(columns, row))
+            sample.setdefault('Sample_Name', '')
+            sample['Sample_Name'] = (
+                sample['Sample_Name'] or sample['Sample_ID']
+            )
+
+            for column in self.index_columns:
+                barcode = sample.get(column, '').upper()
+                if not barcode or set(barcode) - set(BASES):
+                    raise ValueError(
+                        f'Invalid {column} "{barcode}" for sample '
+                        f'{sample["Sample_ID"]} in {self.path}'
+                    )
+                sample[column] = barcode
+            self.samples.append(sample)
+
+    def sample_numbers(self):
+        """
+        Number the samples from 1 in the order they are listed, a sample
+        listed in several lanes keeps the same number.
+        """
+        numbers = {}
+        for sample in self.samples:
+            numbers.setdefault(sample['Sample_ID'], len(numbers) + 1)
+        return numbers
+
+    def lanes(self):
+        """Lanes listed in the Lane column, None if there is no such column"""
+        if not self.samples or 'Lane' not in self.samples[0]:
+            return None
+        return sorted({int(sample['Lane']) for sample in self.samples})
+
+    def barcodes(self, lane=None):
+        """
+        Return the samples of a lane (all samples without a Lane column)
+        and their barcodes, as a list of (sample, (index, index2, ...)).
+        """
+        barcodes = []
+        for sample in self.samples:
+            if lane is not None and 'Lane' in sample:
+                if int(sample['Lane']) != lane:
+                    continue
+            barcodes.append(
+                (sample, tuple(sample[c] for c in self.index_columns))
+            )
+        return barcodes
@@ -0,0 +1,134 @@
+import os
+import tempfile
+
+import numpy as np
+
+from .config import SPATIAL_INDEX_CELL_SIZE
+
+
+class SpatialIndex(object):
+    """
+    Grid index of the cluster coordinates of a tile.
+
+    The clusters are bucketed into square cells of cell_size pixels, counted
+    from the corner of their bounding box, and stored sorted by cell: the
+    clusters of cell c are order[offsets[c]:offsets[c + 1]] and their
+    coordinates coords[offsets[c]:offsets[c + 1]]. The cells of a row are
+    consecutive, so a rectangle only reads one contiguous range per row of
+    cells it overlaps. The cells are made larger for sparse tiles, so that
+    there are never many more cells than clusters. shape is the number of
+    (columns, rows) of cells.
+    """
+
+    def __init__(self, coords, cell_size=SPATIAL_INDEX_CELL_SIZE):
+        coords = np.asarray(coords, dtype=np.float32).reshape(-1, 2)
+        n_clusters = len(coords)
+
+        self.origin = extent = np.zeros(2)
+        if n_clusters:
+            self.origin = coords.min(axis=0).astype(np.float64)
+            extent = coords.max(axis=0) - self.origin
+        area = (extent[0] + 1) * (extent[1] + 1)
+        self.cell_size = max(
+            float(cell_size), np.sqrt(area / max(n_clusters, 1))
+        )
+        self.shape = tuple(
+            int(n) + 1 for n in np.floor(extent / self.cell_size)
+        )
+
+        cells = self.cells(coords)
+        self.order = np.argsort(cells, kind='stable')
+        self.coords = coords[self.order]
+        n_cells = self.shape[0] * self.shape[1]
+        self.offsets = np.zeros(n_cells + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=n_cells), out=self.offsets[1:])
+
+    def __len__(self):
+        return len(self.order)
+
+    def cell_positions(self, coords):
+        """Return the (column, row) of the cells of (N, 2) coordinates,
+        outside of the grid if the coordinates are"""
+        cells = np.floor((coords - self.origin) / self.cell_size)
+        return cells.astype(np.int64)
+
+    def cells(self, coords):
+        columns, rows = self.cell_positions(coords).T
+        return rows * self.shape[0] + columns
+
+    def box_positions(self, box):
+        """Return the positions, in the cell-sorted order, of the clusters
+        inside the box"""
+        x_min, y_min, x_max, y_max = box
+        (c_min, r_min), (c_max, r_max) = self.cell_positions(
+            np.array([[x_min, y_min], [x_max, y_max]], dtype=np.float64)
+        )
+        c_min, r_min = max(c_min, 0), max(r_min, 0)
+        c_max = min(c_max, self.shape[0] - 1)
+        r_max = min(r_max, self.shape[1] - 1)
+        if c_min > c_max or r_min > r_max:
+            return np.empty(0, dtype=np.int64)
+
+        rows = np.arange(r_min, r_max + 1) * self.shape[0]
+        starts = self.offsets[rows + c_min]
+        stops = self.offsets[rows + c_max + 1]
+        candidates = np.concatenate([
+            np.arange(start, stop) for start, stop in zip(starts, stops)
+        ])
+
+        x, y = self.coords[candidates].T
+        inside = (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+        return candidates[inside]
+
+    def query_box(self, box):
+        """
+        Return the indices, in increasing order, of the clusters inside the
+        box (min x, min y, max x, max y), bounds included.
+        """
+        return np.sort(self.order[self.box_positions(box)])
+
+    def query_radius(self, x, y, radius):
+        """Return the indices, in increasing order, of the clusters at most
+        radius pixels from (x, y)"""
+        box = (x - radius, y - radius, x + radius, y + radius)
+        positions = self.box_positions(box)
+        dx, dy = (self.coords[positions] - np.array([x, y])).T
+        inside = dx * dx + dy * dy <= radius * radius
+        return np.sort(self.order[positions[inside]])
+
+    def save(self, path):
+        """Save the index as a .npz file, the file is replaced atomically so
+        that concurrent readers never see a partial index"""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(
+                    f,
+                    cell_size=self.cell_size,
+                    origin=self.origin,
+                    shape=self.shape,
+                    order=self.order,
+                    coords=self.coords,
+                    offsets=self.offsets
+                )
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with save"""
+        index = cls.__new__(cls)
+        with np.load(path) as data:
+            index.cell_size = float(data['cell_size'])
+            index.origin = data['origin']
+            index.shape = tuple(int(n) for n in data['shape'])
+            index.order = data['order']
+            index.coords = data['coords']
+            index.offsets = data['offsets']
+
+        if len(index.offsets) != index.shape[0] * index.shape[1] + 1:
+            raise ValueError(f'{path} is not a valid spatial index')
+        return index
@@ -1,84 +1,161 @@
 from .BCLFolderStructure import BCLFolderStructure
+from .BCLRunFolder import BCLRunFolder, demux_tile, fastq_reads, index_cycles
+from .BarcodeMatcher import BarcodeMatcher
+from .SampleSheet import SampleSheet
 from .FASTQFile import FASTQFile
 from .BCLFile import BCLFile
 from .BCIFile import BCIFile
 from .LOCSFile import LOCSFile
+from .CLOCSFile import CLOCSFile
 from .FILTERFile import FILTERFile
-from .utils import (clean_pipe, split_reads)
-from .config import COMPRESSION
+from .export import export_records, export_tile, import_pyarrow
+from .utils import (clean_pipe, pipe_text, parse_read_structure, ordered_map)
+from .config import (
+    COMPRESSION, CONVERT_BLOCK_SIZE, DEMUX_COMPRESSION_LEVEL, CLOCS_IMAGE_WIDTH,
+    READ_CHUNK_SIZE
+)
 
 from collections import defaultdict
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+import gzip
 import logging
+import os
+import re
+import shutil
+import sys
+
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
 
-def bclwrite(bcl_path, infile):
-    # gzipped = GZIPPED.get(technology.lower(), False)
-    # gzipped doesnt do anything for now but it should
-    # affect whether the bcl file is gzipped
-    out_bcl = BCLFile(bcl_path)
-    out_bcl.write_header_bcl(0)
+def bclwrite(bcl_path, infile, threads=1):
+    # compressed output is written as bgzf, which is also valid gzip, its
+    # blocks are compressed by threads threads
+    compression = None
+    if bcl_path.endswith(('.bgzf', '.gz')):
+        compression = 'bgzip'
+    out_bcl = BCLFile(bcl_path, compression=compression, threads=threads)
     out_bcl.write_from_stream_bcl(infile)
     infile.close()
+    out_bcl.save_block_index()
 
     return
 
 
-def bclread(bcl_path, technology, head=False):
+def bclread(
+    bcl_path,
+    technology,
+    head=False,
+    out_format='text',
+    out_path=None,
+    **selection
+):
+    """selection holds the start, stop, step or indices of the clusters to
+    read, see BinaryFile.read_array. Formats other than text are written
+    as columns to out_path (or stdout), see export.export_records"""
     bcl = BCLFile(bcl_path, compression=COMPRESSION[technology])
 
     if head:
         return clean_pipe(bcl.read_header_bcl)
+    elif out_format != 'text':
+        return export_records(bcl, out_format, out_path, **selection)
     elif not head:
-        return clean_pipe(bcl.read_record_bcl)
+        return pipe_text(bcl.read_text, **selection)
 
 
-def locsread(locs_path, head=False):
+def locsread(
+    locs_path, head=False, out_format='text', out_path=None, **selection
+):
     locs_file = LOCSFile(locs_path)
 
     if head:
         clean_pipe(locs_file.read_header_locs)
+    elif out_format != 'text':
+        export_records(locs_file, out_format, out_path, **selection)
     elif not head:
-        clean_pipe(locs_file.read_record_locs)
+        pipe_text(locs_file.read_text, **selection)
 
 
 def locswrite(locs_path, infile):
     locs = LOCSFile(locs_path)
-    locs.write_header_locs(0)
     locs.write_from_stream_locs(infile)
     infile.close()
     return
 
 
-def filterread(filter_path, head=False):
+def clocsread(
+    clocs_path, head=False, out_format='text', out_path=None, **selection
+):
+    clocs_file = CLOCSFile(clocs_path)
+
+    if head:
+        clean_pipe(clocs_file.read_header_clocs)
+    elif out_format != 'text':
+        export_records(clocs_file, out_format, out_path, **selection)
+    elif not head:
+        pipe_text(clocs_file.read_text, **selection)
+
+
+def clocswrite(clocs_path, infile):
+    clocs = CLOCSFile(clocs_path)
+    clocs.write_from_stream_clocs(infile)
+    infile.close()
+    return
+
+
+def filterread(
+    filter_path, head=False, out_format='text', out_path=None, **selection
+):
     filter_file = FILTERFile(filter_path)
 
     if head:
         clean_pipe(filter_file.read_header_filter)
+    elif out_format != 'text':
+        export_records(filter_file, out_format, out_path, **selection)
     elif not head:
-        clean_pipe(filter_file.read_record_filter)
+        pipe_text(filter_file.read_text, **selection)
 
 
 def filterwrite(filter_path, infile):
     filter_file = FILTERFile(filter_path)
-
-    filter_file.write_header_filter(0)
     filter_file.write_from_stream_filter(infile)
     infile.close()
     return
 
 
-def bciread(bci_path, head=False):
+def bciread(
+    bci_path, head=False, out_format='text', out_path=None, **selection
+):
     bci_file = BCIFile(bci_path)
 
     if head:
         clean_pipe(bci_file.read_header_bci)
+    elif out_format != 'text':
+        export_records(bci_file, out_format, out_path, **selection)
     elif not head:
-        clean_pipe(bci_file.read_record_bci)
-
-
-def bclconvert(n_lanes, machine_type, base_path, fastqs):
+        pipe_text(bci_file.read_text, **selection)
+
+
+def bclconvert(
+    n_lanes,
+    machine_type,
+    base_path,
+    fastqs,
+    block_size=CONVERT_BLOCK_SIZE,
+    processes=1,
+    locs_format='locs',
+    image_width=CLOCS_IMAGE_WIDTH
+):
+    """
+    Convert FASTQ files to a run folder. Reads are written to the lane and
+    tile of their FASTQ header, reads without an Illumina header are spread
+    over n_lanes lanes. With locs_format 'clocs' the cluster positions are
+    written to a binned clocs file per tile, see CLOCSFile, the positions
+    must fit in an image of image_width pixels.
+    """
 
     fastq_objects = [FASTQFile(path) for path in fastqs]
     logger.info(f"Number of FASTQ Files {len(fastq_objects)}")
@@ -86,55 +163,264 @@ def bclconvert(n_lanes, machine_type, base_path, fastqs):
     logger.info("Counting number of cycles")
     n_cycles = sum([fastq.read_len() for fastq in fastq_objects])
 
-    logger.info("Counting number of reads")
-    n_reads = fastq_objects[0].n_reads()
+    folder_structure = BCLFolderStructure(
+        n_lanes,
+        n_cycles,
+        machine_type,
+        base_path,
+        locs_format=locs_format,
+        image_width=image_width
+    )
+
+    # the reads are bucketed in a single pass into a spill file per lane and
+    # tile of their FASTQ headers, then every tile is written in one go
+    logger.info('Spilling reads by lane and tile')
+    folder_structure.make_spill_files()
+    try:
+        folder_structure.fastq2bcl(
+            fastq_objects, block_size=block_size, processes=processes
+        )
+
+        logger.info("Writing LOCS, BCL and FILTER files")
+        folder_structure.spill2bcl(processes=processes, block_size=block_size)
+    except BaseException:
+        # the run folder is incomplete, it was created by make_spill_files
+        shutil.rmtree(folder_structure.intensities_path, ignore_errors=True)
+        raise
+    finally:
+        # the spill files hold an uncompressed copy of every read
+        folder_structure.remove_spill_files()
 
-    reads_per_lane = split_reads(n_reads, n_lanes)
-    n_tiles = 28
-    reads_per_tile = defaultdict(list)
+    return
 
-    for lane, rpl in enumerate(reads_per_lane, 1):
-        rpt = split_reads(rpl, n_tiles)
-        reads_per_tile[lane] = rpt
 
-    folder_structure = BCLFolderStructure(
-        n_lanes, n_cycles, reads_per_lane, machine_type, base_path
+def bcldemux(
+    base_path,
+    out_path,
+    machine_type=None,
+    read_structure=None,
+    sample_sheet=None,
+    mismatches=1,
+    allow_collisions=False,
+    include_non_pf=False,
+    compression_level=DEMUX_COMPRESSION_LEVEL,
+    image_width=CLOCS_IMAGE_WIDTH,
+    processes=1
+):
+    """
+    Write the reads of a run folder to gzipped FASTQ files, one file per
+    sample, lane and read of the read structure. Without a sample sheet
+    every read is undetermined. Tiles are read and formatted in parallel
+    with processes > 1 and written in order.
+    """
+    run_folder = BCLRunFolder(
+        base_path, machine_type=machine_type, image_width=image_width
+    )
+    run_info = run_folder.run_info()
+    logger.info(
+        f'Found {len(run_folder.lanes)} lanes and {run_folder.n_cycles} '
+        f'cycles of a {run_folder.machine_type} run'
     )
 
-    # initialize the BaseCalls/L00X folders
-    logger.info("Initializing BCL Folder structure")
-    lanes_bcls = folder_structure.make_base_calls_lane_folders()
-    lanes_locs = folder_structure.make_intensities_lane_folders()
-
-    # initialize locs and bcl files
-    # TODO fix the pluralization of words, its confusing
-    logger.info("Initializing LOCS and BCL files")
-    for idx, (lane_locs, lane_bcl) in enumerate(zip(lanes_locs, lanes_bcls)):
-        if machine_type == 'nextseq':
-            folder_structure.initialize_locs_files(
-                lane_locs, reads_per_lane[idx]
-            )
-            folder_structure.initialize_bcl_files(lane_bcl, reads_per_lane[idx])
-            # filter is in same folder as bcl
-            folder_structure.initialize_filter_files(
-                lane_bcl, reads_per_lane[idx]
+    if read_structure is None:
+        read_structure = run_info['read_structure']
+    if read_structure is None:
+        read_structure = f'{run_folder.n_cycles}T'
+    segments = parse_read_structure(read_structure)
+    if sum(length for length, _ in segments) != run_folder.n_cycles:
+        sys.exit(
+            f'Read structure {read_structure} does not match the '
+            f'{run_folder.n_cycles} cycles of the run'
+        )
+    reads = fastq_reads(segments)
+
+    # sample number -> name, 0 is undetermined
+    sample_names = {0: 'Undetermined'}
+    samples = None
+    if sample_sheet is not None:
+        sheet = SampleSheet(sample_sheet)
+        sample_numbers = sheet.sample_numbers()
+        for sample in sheet.samples:
+            number = sample_numbers[sample['Sample_ID']]
+            sample_names[number] = re.sub(
+                r'[^\w.-]', '_', sample['Sample_Name']
             )
-        elif machine_type == 'miseq':
-            folder_structure.initialize_locs_files(
-                lane_locs, reads_per_tile[idx + 1]
-            )
-            folder_structure.initialize_bcl_files(
-                lane_bcl, reads_per_tile[idx + 1]
+
+        samples = {}
+        for lane in run_folder.lanes:
+            barcodes = sheet.barcodes(lane)
+            if not barcodes:
+                continue
+            lengths = [len(index) for index in barcodes[0][1]]
+            # collisions are reported with the samples they belong to
+            matcher = BarcodeMatcher([barcode for _, barcode in barcodes],
+                                     mismatches=mismatches,
+                                     allow_collisions=True)
+            collisions = [
+                f'{barcodes[a][0]["Sample_ID"]} '
+                f'({"+".join(barcodes[a][1])}) and '
+                f'{barcodes[b][0]["Sample_ID"]} ({"+".join(barcodes[b][1])})'
+                for a, b in matcher.collisions
+            ]
+            if collisions and not allow_collisions:
+                sys.exit(
+                    f'Lane {lane}: reads can match both samples of '
+                    f'{len(collisions)} barcode pairs with {mismatches} '
+                    f'mismatches: {", ".join(collisions)}. Lower '
+                    f'--barcode-mismatches or pass --allow-collisions to '
+                    f'leave their reads undetermined'
+                )
+            for collision in collisions:
+                logger.warning(f'Lane {lane}: barcodes of {collision} collide')
+            numbers = np.array([
+                sample_numbers[sample['Sample_ID']] for sample, _ in barcodes
+            ])
+            samples[lane] = (matcher, index_cycles(segments, lengths), numbers)
+        logger.info(f'Read {len(sheet.samples)} samples from {sample_sheet}')
+
+    os.makedirs(out_path, exist_ok=True)
+
+    # gzip members of consecutive tiles are appended to each file, which
+    # starts as an empty member, so files without reads are valid gzip
+    paths = {}
+    for lane in run_folder.lanes:
+        for number, sample_name in sample_names.items():
+            for name, _, _, _ in reads:
+                paths[lane, number, name] = os.path.join(
+                    out_path, f'{sample_name}_S{number}_'
+                    f'{run_folder.lane_name(lane)}_{name}_001.fastq.gz'
+                )
+    for path in paths.values():
+        with open(path, 'wb') as f:
+            f.write(gzip.compress(b''))
+
+    kwargs = {
+        'reads': reads,
+        'run_info': run_info,
+        'samples': samples,
+        'include_non_pf': include_non_pf,
+        'compression_level': compression_level,
+    }
+    tasks = [(run_folder, lane, tile, kwargs)
+             for lane, tile in run_folder.tile_keys()]
+
+    with ExitStack() as stack:
+        if processes > 1:
+            executor = stack.enter_context(
+                ProcessPoolExecutor(max_workers=processes)
             )
-            # filter is in same folder as bcl
-            folder_structure.initialize_filter_files(
-                lane_bcl, reads_per_tile[idx + 1]
+            results = ordered_map(
+                executor, demux_tile, tasks, window=2 * processes
             )
-    # Do the transpose
-    logger.info('Writing records to LOCS and BCL files')
-    # print(folder_structure.bcl_files)]
-    print(len(reads_per_tile[1]))
-    print(reads_per_tile[1])
-    folder_structure.fastq2bcl(fastq_objects, reads_per_tile[1])
+        else:
+            results = map(demux_tile, tasks)
+
+        n_clusters = n_pf = 0
+        n_sample_clusters = defaultdict(int)
+        for (_, lane, tile, _), result in zip(tasks, results):
+            tile_outputs, n_tile_clusters, n_tile_pf, sample_counts = result
+            for (number, name), data in tile_outputs.items():
+                with open(paths[lane, number, name], 'ab') as f:
+                    f.write(data)
+
+            n_clusters += n_tile_clusters
+            n_pf += n_tile_pf
+            for number, count in sample_counts.items():
+                n_sample_clusters[number] += count
+            logger.debug(f'Wrote lane {lane} tile {tile}')
+
+    logger.info(f'Wrote {n_clusters} clusters, {n_pf} passing filter')
+    if samples is not None:
+        n_written = sum(n_sample_clusters.values())
+        logger.info(
+            f'{n_written - n_sample_clusters[0]} clusters assigned to samples, '
+            f'{n_sample_clusters[0]} undetermined'
+        )
+    return
+
 
+def bclexport(
+    base_path,
+    out_path,
+    out_format='npy',
+    machine_type=None,
+    lanes=None,
+    tiles=None,
+    image_width=CLOCS_IMAGE_WIDTH,
+    processes=1
+):
+    """
+    Export a run folder to columnar files, see export.export_tile. Tiles are
+    exported in parallel with processes > 1.
+    """
+    if out_format != 'npy':
+        import_pyarrow()
+
+    run_folder = BCLRunFolder(
+        base_path, machine_type=machine_type, image_width=image_width
+    )
+    logger.info(
+        f'Found {len(run_folder.lanes)} lanes and {run_folder.n_cycles} '
+        f'cycles of a {run_folder.machine_type} run'
+    )
+
+    export = partial(export_tile, out_path=out_path, out_format=out_format)
+    n_tiles = n_clusters = 0
+    results = run_folder.map_tiles(
+        export, lanes=lanes, tiles=tiles, processes=processes
+    )
+    for lane, tile, n_tile_clusters in results:
+        n_tiles += 1
+        n_clusters += n_tile_clusters
+        logger.debug(f'Exported lane {lane} tile {tile}')
+
+    logger.info(f'Exported {n_clusters} clusters of {n_tiles} tiles')
     return
+
+
+def format_clusters(indices, clusters, chunk_size=READ_CHUNK_SIZE):
+    """Yield clusters (a Tile) as blocks of tab separated lines of their
+    index, x, y, filter flag, bases and quality scores"""
+    n_cycles = clusters.bases.shape[1]
+    bases = np.ascontiguousarray(clusters.bases).view(f'S{n_cycles}').ravel()
+    quals = np.ascontiguousarray(clusters.quals).view(f'S{n_cycles}').ravel()
+    # Y means the cluster is filtered out, see filter2num
+    flags = np.where(clusters.pass_filter, b'N', b'Y')
+
+    for start in range(0, len(indices), chunk_size):
+        stop = start + chunk_size
+        rows = zip(
+            indices[start:stop].tolist(), clusters.x[start:stop].tolist(),
+            clusters.y[start:stop].tolist(), flags[start:stop].tolist(),
+            bases[start:stop].tolist(), quals[start:stop].tolist()
+        )
+        yield b''.join(b'%d\t%.9g\t%.9g\t%s\t%s\t%s\n' % row for row in rows)
+
+
+def bclquery(
+    base_path,
+    lane,
+    tile,
+    box=None,
+    circle=None,
+    machine_type=None,
+    image_width=CLOCS_IMAGE_WIDTH
+):
+    """
+    Write the clusters of a tile inside a box (min x, min y, max x, max y)
+    or a circle (x, y, radius) as text, see format_clusters. The clusters
+    are found with the spatial index of the tile, see
+    BCLRunFolder.tile_index, and only they are read from the bcl files.
+    """
+    run_folder = BCLRunFolder(
+        base_path, machine_type=machine_type, image_width=image_width
+    )
+    index = run_folder.tile_index(lane, tile)
+    if box is not None:
+        indices = index.query_box(box)
+    else:
+        indices = index.query_radius(*circle)
+    logger.info(f'Found {len(indices)} of {len(index)} clusters')
+
+    clusters = run_folder.load_clusters(lane, tile, indices)
+    pipe_text(format_clusters, indices=indices, clusters=clusters)
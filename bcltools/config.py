@@ -4,7 +4,11 @@ MACHINE_TYPES = (
     'novaseq',
 )
 
-FILE_TYPES = ('bcl', 'bci', 'locs', 'filter')
+FILE_TYPES = ('bcl', 'bci', 'locs', 'clocs', 'filter')
+
+# binary formats records can be exported to, parquet and arrow need pyarrow
+EXPORT_FORMATS = ('npy', 'parquet', 'arrow')
+EXPORT_EXTENSIONS = {'npy': '.npy', 'parquet': '.parquet', 'arrow': '.arrow'}
 
 COMPRESSION = {'nextseq': 'bgzip', 'miseq': None, 'novaseq': None}
 
@@ -25,4 +29,77 @@ TYPE_LEN = {
     'd': 8,  # double (float)
 }
 
+# numpy equivalents of the struct format characters above
+TYPE_DTYPE = {
+    'c': 'S1',
+    'b': 'i1',
+    'B': 'u1',
+    '?': '?',
+    'h': 'i2',
+    'H': 'u2',
+    'i': 'i4',
+    'I': 'u4',
+    'l': 'i4',
+    'L': 'u4',
+    'q': 'i8',
+    'Q': 'u8',
+    'f': 'f4',
+    'd': 'f8',
+}
+
 CHAR_ORDER = set('@=<>!')
+
+# number of records converted to python objects at a time when iterating
+READ_CHUNK_SIZE = 1 << 16
+
+# size in bytes of the record buffer of a RecordWriter
+WRITE_BUFFER_SIZE = 1 << 16
+
+# size in bytes of the chunks of text parsed at a time by bcltools write
+STREAM_CHUNK_SIZE = 1 << 22
+
+# number of reads transposed at a time when converting FASTQ files to bcl files
+CONVERT_BLOCK_SIZE = 1 << 16
+
+# number of blocks each FASTQ reader thread decompresses ahead of the transpose
+PREFETCH_BLOCKS = 2
+
+# size in bytes of the chunks a FASTQ file is decompressed in when scanning it
+READ_BUFFER_SIZE = 1 << 20
+
+# extension of the FASTQ index sidecar and the number of reads between its
+# checkpoints
+FASTQ_INDEX_EXTENSION = '.fqi'
+FASTQ_INDEX_INTERVAL = 1 << 16
+
+# extension of the block index sidecar of bgzf files, same format as bgzip
+BGZF_INDEX_EXTENSION = '.gzi'
+
+# clocs files bin the clusters of a tile in squares of CLOCS_BLOCK_SIZE pixels
+# numbered row by row over an image CLOCS_IMAGE_WIDTH pixels wide
+CLOCS_BLOCK_SIZE = 25
+CLOCS_IMAGE_WIDTH = 2048
+
+# extension of the spatial index sidecar of the tiles of a run folder and the
+# smallest size in pixels of its cells
+SPATIAL_INDEX_EXTENSION = '.sidx.npz'
+SPATIAL_INDEX_CELL_SIZE = 64
+
+# segment types of a read structure: template, barcode (index) and skip
+READ_TYPES = ('T', 'B', 'S')
+
+# gzip level of the FASTQ files written by demux, same default as bcl2fastq
+DEMUX_COMPRESSION_LEVEL = 4
+
+# number of reads formatted into FASTQ text at a time by demux
+DEMUX_BLOCK_SIZE = 1 << 13
+
+# bases in the order of their 2-bit code in bcl files
+BASES = 'ACGT'
+
+# barcodes of up to this many bits (2 per base) are assigned with a direct
+# lookup table, longer ones by binary search in the sorted barcode variants
+BARCODE_LOOKUP_BITS = 20
+
+# number of reads assigned to samples at a time
+BARCODE_BATCH_SIZE = 1 << 18
@@ -0,0 +1,134 @@
+import os
+import sys
+
+import numpy as np
+
+from .config import EXPORT_EXTENSIONS
+
+
+def import_pyarrow():
+    """Import pyarrow, which is only needed to write parquet and arrow"""
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise ImportError(
+            'Writing parquet and arrow files needs pyarrow, install it with '
+            '"pip install pyarrow"'
+        )
+    return pyarrow
+
+
+def columns2array(columns):
+    """Pack a dict of equal length columns into a structured array"""
+    dtype = [(name, column.dtype) for name, column in columns.items()]
+    n_rows = len(next(iter(columns.values()))) if columns else 0
+
+    array = np.empty(n_rows, dtype=dtype)
+    for name, column in columns.items():
+        array[name] = column
+    return array
+
+
+def columns2table(columns):
+    """Convert a dict of columns to a pyarrow table, byte string columns
+    (bases) become string columns"""
+    pa = import_pyarrow()
+    arrays = {}
+    for name, column in columns.items():
+        if column.dtype.kind == 'S':
+            column = column.astype(str)
+        arrays[name] = pa.array(column)
+    return pa.table(arrays)
+
+
+def write_columns(columns, out, out_format):
+    """
+    Write a dict of columns to out (a path or a binary file object) as a
+    .npy structured array, a parquet file or an arrow IPC file.
+    """
+    if out_format == 'npy':
+        np.save(out, columns2array(columns))
+        return
+
+    pa = import_pyarrow()
+    table = columns2table(columns)
+    if out_format == 'parquet':
+        pa.parquet.write_table(table, out)
+    elif out_format == 'arrow':
+        with pa.ipc.new_file(out, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        raise ValueError(f'Unknown export format {out_format}')
+
+
+def export_records(binary_file, out_format, out_path=None, **selection):
+    """
+    Write a selection of the records of a file (see BinaryFile.read_array)
+    as named columns (see BinaryFile.columns) to out_path, or to the binary
+    stdout if it is None.
+    """
+    columns = binary_file.read_columns(**selection)
+    if out_path is None:
+        write_columns(columns, sys.stdout.buffer, out_format)
+        sys.stdout.buffer.flush()
+    else:
+        write_columns(columns, out_path, out_format)
+
+
+def partition_path(out_path, dataset, out_format, **keys):
+    """
+    Path of one partition of a dataset, with a key=value folder per
+    partition key (hive style), so that pyarrow and pandas can read the
+    dataset folder and filter on the keys.
+    """
+    folders = [f'{key}={value}' for key, value in keys.items()]
+    path = os.path.join(out_path, dataset, *folders)
+    os.makedirs(path, exist_ok=True)
+    return os.path.join(path, f'part-0{EXPORT_EXTENSIONS[out_format]}')
+
+
+def export_tile(tile, out_path, out_format):
+    """
+    Export a Tile of a run (see BCLRunFolder.load_tile) to two datasets:
+    clusters (cluster, x, y, pass_filter) partitioned by lane and tile, and
+    bcl (cluster, base, qual) partitioned by lane, tile and cycle. Cycles
+    are numbered from 1 like the cycle folders of the run. Returns the
+    number of clusters of the tile.
+    """
+    n_clusters = len(tile.bases)
+    cluster = np.arange(n_clusters, dtype=np.uint32)
+
+    clusters = {
+        'cluster': cluster,
+        'x': tile.x,
+        'y': tile.y,
+        'pass_filter': tile.pass_filter,
+    }
+    write_columns(
+        clusters,
+        partition_path(
+            out_path, 'clusters', out_format, lane=tile.lane, tile=tile.tile
+        ), out_format
+    )
+
+    # quality scores as numbers, no-calls are base N with quality 0
+    quals = tile.quals - np.uint8(33)
+    for cycle in range(tile.bases.shape[1]):
+        bcl = {
+            'cluster': cluster,
+            'base': np.ascontiguousarray(tile.bases[:, cycle]).view('S1'),
+            'qual': np.ascontiguousarray(quals[:, cycle]),
+        }
+        write_columns(
+            bcl,
+            partition_path(
+                out_path,
+                'bcl',
+                out_format,
+                lane=tile.lane,
+                tile=tile.tile,
+                cycle=cycle + 1
+            ), out_format
+        )
+    return n_clusters
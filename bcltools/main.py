@@ -6,11 +6,17 @@ import logging
 import os
 
 from .bcltools import (
-    bclconvert, bclread, bclwrite, bciread, locsread, locswrite, filterread,
-    filterwrite
+    bclconvert, bcldemux, bclexport, bclread, bclwrite, bciread, locsread,
+    locswrite, clocsread, clocswrite, filterread, filterwrite, bclquery
+)
+from .type_checkers import (
+    check_gz_file, check_index_list, check_lane_lim, check_positive,
+    check_float_list
+)
+from .config import (
+    MACHINE_TYPES, FILE_TYPES, CONVERT_BLOCK_SIZE, DEMUX_COMPRESSION_LEVEL,
+    EXPORT_FORMATS, CLOCS_IMAGE_WIDTH
 )
-from .type_checkers import (check_gz_file, check_lane_lim)
-from .config import (MACHINE_TYPES, FILE_TYPES)
 
 logger = logging.getLogger(__name__)
 
@@ -20,14 +26,30 @@ def parse_read(args):
     if args.f not in base_name:
         logger.warning(f'Specified "{args.f}" but reading "{base_name}"')
 
+    ranged = (args.start, args.end, args.stride) != (None, None, None)
+    if args.clusters is not None and ranged:
+        sys.exit('--clusters can not be combined with --start/--end/--stride')
+    if args.head and args.O != 'text':
+        sys.exit('--head is only written as text')
+    selection = {
+        'start': args.start,
+        'stop': args.end,
+        'step': args.stride,
+        'indices': args.clusters,
+        'out_format': args.O,
+        'out_path': args.o
+    }
+
     if args.f == 'bcl':
-        bclread(args.file, args.x, args.head)
+        bclread(args.file, args.x, args.head, **selection)
     elif args.f == 'bci':
-        bciread(args.file, args.head)
+        bciread(args.file, args.head, **selection)
     elif args.f == 'locs':
-        locsread(args.file, args.head)
+        locsread(args.file, args.head, **selection)
+    elif args.f == 'clocs':
+        clocsread(args.file, args.head, **selection)
     elif args.f == 'filter':
-        filterread(args.file, args.head)
+        filterread(args.file, args.head, **selection)
     return
 
 
@@ -41,9 +63,11 @@ def parse_write(args):
                 sys.exit('Please provide an output file or pipe')
             else:
                 if args.f == 'bcl':
-                    bclwrite(args.o, args.file)
+                    bclwrite(args.o, args.file, threads=args.t)
                 elif args.f == 'locs':
                     locswrite(args.o, args.file)
+                elif args.f == 'clocs':
+                    clocswrite(args.o, args.file)
                 elif args.f == 'filter':
                     filterwrite(args.o, args.file)
 
@@ -51,7 +75,70 @@ def parse_write(args):
 def parse_convert(args):
     # TODO check if -o exists or not, make path accordingly
 
-    bclconvert(args.n, args.x, args.o, args.fastqs)
+    bclconvert(
+        args.n,
+        args.x,
+        args.o,
+        args.fastqs,
+        block_size=args.b,
+        processes=args.t,
+        locs_format='clocs' if args.clocs else 'locs',
+        image_width=args.image_width
+    )
+
+    return
+
+
+def parse_demux(args):
+    bcldemux(
+        args.run_folder,
+        args.o,
+        machine_type=args.x,
+        read_structure=args.r,
+        sample_sheet=args.s,
+        mismatches=args.barcode_mismatches,
+        allow_collisions=args.allow_collisions,
+        include_non_pf=args.include_non_pf,
+        compression_level=args.l,
+        image_width=args.image_width,
+        processes=args.t
+    )
+
+    return
+
+
+def parse_export(args):
+    bclexport(
+        args.run_folder,
+        args.o,
+        out_format=args.O,
+        machine_type=args.x,
+        lanes=args.lanes,
+        tiles=args.tiles,
+        image_width=args.image_width,
+        processes=args.t
+    )
+
+    return
+
+
+def parse_query(args):
+    if (args.box is None) == (args.radius is None):
+        sys.exit('Please provide either --box or --radius')
+    if args.box is not None and len(args.box) != 4:
+        sys.exit('--box takes 4 values: min x, min y, max x, max y')
+    if args.radius is not None and len(args.radius) != 3:
+        sys.exit('--radius takes 3 values: x, y, radius')
+
+    bclquery(
+        args.run_folder,
+        args.lane,
+        args.tile,
+        box=args.box,
+        circle=args.radius,
+        machine_type=args.x,
+        image_width=args.image_width
+    )
 
     return
 
@@ -87,7 +174,25 @@ def setup_read_args(parser, parent):
     )
 
     optional_read.add_argument(
-        '-o', metavar='OUT FILE', help='output file', type=str, required=False
+        '-o',
+        metavar='OUT FILE',
+        help='output file of binary formats (default: stdout)',
+        type=str,
+        required=False
+    )
+
+    optional_read.add_argument(
+        '-O',
+        '--output-format',
+        dest='O',
+        help=(
+            'Write tab separated text, or the records as typed columns in a '
+            'numpy .npy, parquet or arrow file (default: text)'
+        ),
+        choices=('text',) + EXPORT_FORMATS,
+        type=str.lower,
+        required=False,
+        default='text'
     )
 
     # fix to make -n take in a number
@@ -99,6 +204,40 @@ def setup_read_args(parser, parent):
         required=False
     )
 
+    optional_read.add_argument(
+        '--start',
+        metavar='N',
+        help='First record to read, negative counts from the end (default: 0)',
+        type=int,
+        required=False
+    )
+
+    optional_read.add_argument(
+        '--end',
+        metavar='N',
+        help='Record to stop before, negative counts from the end '
+        '(default: end of the file)',
+        type=int,
+        required=False
+    )
+
+    optional_read.add_argument(
+        '--stride',
+        metavar='N',
+        help='Read every N-th record from start to end (default: 1)',
+        type=check_positive,
+        required=False
+    )
+
+    optional_read.add_argument(
+        '-c',
+        '--clusters',
+        metavar='I,J,...',
+        help='Comma separated indices of the records to read, in that order',
+        type=check_index_list,
+        required=False
+    )
+
     optional_read.add_argument(
         "-h", "--help", action="help", help="show this help message and exit"
     )
@@ -110,7 +249,6 @@ def setup_read_args(parser, parent):
     # currently takes only one, add support for more than one
     parser_read.add_argument('file')
 
-    # TODO add slicing functionality for the read
     # TODO add option for the type of machine
 
     return parser_read
@@ -158,6 +296,20 @@ def setup_write_args(parser, parent):
         '-p', metavar='PIPE', help='Pipe file out', type=str, required=False
     )
 
+    optional_write.add_argument(
+        '-t',
+        '--threads',
+        dest='t',
+        metavar='N',
+        help=(
+            'Number of threads compressing the blocks of bgzf bcl files '
+            '(default: 1)'
+        ),
+        type=check_positive,
+        required=False,
+        default=1
+    )
+
     optional_write.add_argument(
         "-h", "--help", action="help", help="show this help message and exit"
     )
@@ -193,10 +345,6 @@ def setup_convert_args(parser, parent):
         required=True
     )
 
-    required_convert.add_argument(
-        '-n', help="Number of lanes", type=check_lane_lim, required=True
-    )
-
     required_convert.add_argument(
         '-o',
         metavar='OUT FOLDER',
@@ -207,6 +355,67 @@ def setup_convert_args(parser, parent):
 
     optional_convert = parser_convert.add_argument_group('optional arguments')
 
+    optional_convert.add_argument(
+        '-n',
+        help=(
+            'Number of lanes to spread reads without an Illumina header over, '
+            'other reads go to the lane and tile of their header (default: 1)'
+        ),
+        type=check_lane_lim,
+        required=False,
+        default=1
+    )
+
+    optional_convert.add_argument(
+        '-b',
+        '--block-size',
+        dest='b',
+        metavar='READS',
+        help=(
+            'Number of reads transposed at a time, bounds peak memory '
+            f'(default: {CONVERT_BLOCK_SIZE})'
+        ),
+        type=check_positive,
+        required=False,
+        default=CONVERT_BLOCK_SIZE
+    )
+
+    optional_convert.add_argument(
+        '-t',
+        '--threads',
+        '--processes',
+        dest='t',
+        metavar='N',
+        help=(
+            'Number of processes writing tiles, and reading bgzf FASTQ '
+            'files (default: 1)'
+        ),
+        type=check_positive,
+        required=False,
+        default=1
+    )
+
+    optional_convert.add_argument(
+        '--clocs',
+        help=(
+            'Write the cluster positions as clocs files, binned and rounded '
+            'to 0.1 pixel, instead of locs files'
+        ),
+        action='store_true'
+    )
+
+    optional_convert.add_argument(
+        '--image-width',
+        metavar='PIXELS',
+        help=(
+            'Width of the tile images the clocs positions are binned over '
+            f'(default: {CLOCS_IMAGE_WIDTH})'
+        ),
+        type=check_positive,
+        required=False,
+        default=CLOCS_IMAGE_WIDTH
+    )
+
     optional_convert.add_argument(
         "-h", "--help", action="help", help="show this help message and exit"
     )
@@ -221,10 +430,307 @@ def setup_convert_args(parser, parent):
     return parser_convert
 
 
+def setup_demux_args(parser, parent):
+    parser_demux = parser.add_parser(
+        'demux',
+        description='Convert a bcl run folder to fastq files',
+        help='Convert a bcl run folder to fastq files',
+        parents=[parent],
+        add_help=False
+    )
+
+    required_demux = parser_demux.add_argument_group('required arguments')
+
+    required_demux.add_argument(
+        '-o',
+        metavar='OUT FOLDER',
+        help='output folder',
+        type=str,
+        required=True
+    )
+
+    optional_demux = parser_demux.add_argument_group('optional arguments')
+
+    optional_demux.add_argument(
+        '-x',
+        help="Type of machine (default: detected from the run folder)",
+        choices=MACHINE_TYPES,
+        type=str.lower,
+        required=False
+    )
+
+    optional_demux.add_argument(
+        '-r',
+        '--read-structure',
+        dest='r',
+        metavar='STRUCTURE',
+        help=(
+            'Cycles of every read, T for template, B for barcode and S for '
+            'skipped cycles, e.g. 26T8B8T (default: from RunInfo.xml, or '
+            'all cycles as one read)'
+        ),
+        type=str,
+        required=False
+    )
+
+    optional_demux.add_argument(
+        '-s',
+        '--sample-sheet',
+        dest='s',
+        metavar='CSV',
+        help=(
+            'Illumina sample sheet, reads are written per sample by their '
+            'index barcodes (default: all reads undetermined)'
+        ),
+        type=str,
+        required=False
+    )
+
+    optional_demux.add_argument(
+        '--barcode-mismatches',
+        metavar='N',
+        help='Mismatches allowed in every index barcode (default: 1)',
+        type=int,
+        choices=range(4),
+        required=False,
+        default=1
+    )
+
+    optional_demux.add_argument(
+        '--allow-collisions',
+        help=(
+            'Allow barcodes within twice the mismatches of each other, '
+            'ambiguous reads are undetermined'
+        ),
+        action='store_true'
+    )
+
+    optional_demux.add_argument(
+        '--include-non-pf',
+        help='Write the clusters that do not pass filter',
+        action='store_true'
+    )
+
+    optional_demux.add_argument(
+        '-l',
+        '--compression-level',
+        dest='l',
+        metavar='LEVEL',
+        help=f'gzip level of the fastq files (default: '
+        f'{DEMUX_COMPRESSION_LEVEL})',
+        type=int,
+        choices=range(10),
+        required=False,
+        default=DEMUX_COMPRESSION_LEVEL
+    )
+
+    optional_demux.add_argument(
+        '--image-width',
+        metavar='PIXELS',
+        help=(
+            'Width of the tile images the clocs positions are binned over '
+            f'(default: {CLOCS_IMAGE_WIDTH})'
+        ),
+        type=check_positive,
+        required=False,
+        default=CLOCS_IMAGE_WIDTH
+    )
+
+    optional_demux.add_argument(
+        '-t',
+        '--threads',
+        '--processes',
+        dest='t',
+        metavar='N',
+        help='Number of processes demultiplexing tiles (default: 1)',
+        type=check_positive,
+        required=False,
+        default=1
+    )
+
+    optional_demux.add_argument(
+        "-h", "--help", action="help", help="show this help message and exit"
+    )
+
+    optional_demux.add_argument(
+        '--verbose', help='Print debugging information', action='store_true'
+    )
+
+    parser_demux.add_argument('run_folder')
+
+    return parser_demux
+
+
+def setup_export_args(parser, parent):
+    parser_export = parser.add_parser(
+        'export',
+        description='Export a bcl run folder to columnar files',
+        help='Export a bcl run folder to columnar files',
+        parents=[parent],
+        add_help=False
+    )
+
+    required_export = parser_export.add_argument_group('required arguments')
+
+    required_export.add_argument(
+        '-o',
+        metavar='OUT FOLDER',
+        help='output folder',
+        type=str,
+        required=True
+    )
+
+    optional_export = parser_export.add_argument_group('optional arguments')
+
+    optional_export.add_argument(
+        '-O',
+        '--output-format',
+        dest='O',
+        help='File format, parquet and arrow need pyarrow (default: npy)',
+        choices=EXPORT_FORMATS,
+        type=str.lower,
+        required=False,
+        default='npy'
+    )
+
+    optional_export.add_argument(
+        '-x',
+        help="Type of machine (default: detected from the run folder)",
+        choices=MACHINE_TYPES,
+        type=str.lower,
+        required=False
+    )
+
+    optional_export.add_argument(
+        '--lanes',
+        metavar='L,M,...',
+        help='Comma separated lanes to export (default: all)',
+        type=check_index_list,
+        required=False
+    )
+
+    optional_export.add_argument(
+        '--tiles',
+        metavar='T,U,...',
+        help='Comma separated tile numbers to export (default: all)',
+        type=check_index_list,
+        required=False
+    )
+
+    optional_export.add_argument(
+        '--image-width',
+        metavar='PIXELS',
+        help=(
+            'Width of the tile images the clocs positions are binned over '
+            f'(default: {CLOCS_IMAGE_WIDTH})'
+        ),
+        type=check_positive,
+        required=False,
+        default=CLOCS_IMAGE_WIDTH
+    )
+
+    optional_export.add_argument(
+        '-t',
+        '--threads',
+        '--processes',
+        dest='t',
+        metavar='N',
+        help='Number of processes exporting tiles (default: 1)',
+        type=check_positive,
+        required=False,
+        default=1
+    )
+
+    optional_export.add_argument(
+        "-h", "--help", action="help", help="show this help message and exit"
+    )
+
+    optional_export.add_argument(
+        '--verbose', help='Print debugging information', action='store_true'
+    )
+
+    parser_export.add_argument('run_folder')
+
+    return parser_export
+
+
+def setup_query_args(parser, parent):
+    parser_query = parser.add_parser(
+        'query',
+        description='Read the clusters of a region of a tile',
+        help='Read the clusters of a region of a tile',
+        parents=[parent],
+        add_help=False
+    )
+
+    required_query = parser_query.add_argument_group('required arguments')
+
+    required_query.add_argument(
+        '--lane', metavar='L', help='Lane of the tile', type=int, required=True
+    )
+
+    required_query.add_argument(
+        '--tile', metavar='T', help='Tile number', type=int, required=True
+    )
+
+    optional_query = parser_query.add_argument_group('optional arguments')
+
+    optional_query.add_argument(
+        '--box',
+        metavar='X0,Y0,X1,Y1',
+        help='Clusters inside the rectangle, bounds included',
+        type=check_float_list,
+        required=False
+    )
+
+    optional_query.add_argument(
+        '--radius',
+        metavar='X,Y,R',
+        help='Clusters at most R pixels from X, Y',
+        type=check_float_list,
+        required=False
+    )
+
+    optional_query.add_argument(
+        '-x',
+        help="Type of machine (default: detected from the run folder)",
+        choices=MACHINE_TYPES,
+        type=str.lower,
+        required=False
+    )
+
+    optional_query.add_argument(
+        '--image-width',
+        metavar='PIXELS',
+        help=(
+            'Width of the tile images the clocs positions are binned over '
+            f'(default: {CLOCS_IMAGE_WIDTH})'
+        ),
+        type=check_positive,
+        required=False,
+        default=CLOCS_IMAGE_WIDTH
+    )
+
+    optional_query.add_argument(
+        "-h", "--help", action="help", help="show this help message and exit"
+    )
+
+    optional_query.add_argument(
+        '--verbose', help='Print debugging information', action='store_true'
+    )
+
+    parser_query.add_argument('run_folder')
+
+    return parser_query
+
+
 COMMAND_TO_FUNCTION = {
     'write': parse_write,
     'read': parse_read,
-    'convert': parse_convert
+    'convert': parse_convert,
+    'demux': parse_demux,
+    'export': parse_export,
+    'query': parse_query
 }
 
 
@@ -242,11 +748,17 @@ def main():
     parser_read = setup_read_args(subparsers, parent)
     parser_write = setup_write_args(subparsers, parent)
     parser_convert = setup_convert_args(subparsers, parent)
+    parser_demux = setup_demux_args(subparsers, parent)
+    parser_export = setup_export_args(subparsers, parent)
+    parser_query = setup_query_args(subparsers, parent)
 
     command_to_parser = {
         'write': parser_write,
         'read': parser_read,
-        'convert': parser_convert
+        'convert': parser_convert,
+        'demux': parser_demux,
+        'export': parser_export,
+        'query': parser_query
     }
 
     # Show help when no arguments are given
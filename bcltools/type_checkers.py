@@ -28,3 +28,27 @@ def check_positive(value):
             f"{value} is an invalid positive int value"
         )
     return ivalue
+
+
+def check_index_list(value):
+    try:
+        indices = [int(index) for index in value.split(',') if index.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"{value} is not a comma separated list of int values"
+        )
+    if not indices:
+        raise argparse.ArgumentTypeError(f"{value} lists no int values")
+    return indices
+
+
+def check_float_list(value):
+    try:
+        values = [float(v) for v in value.split(',') if v.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"{value} is not a comma separated list of numbers"
+        )
+    if not values:
+        raise argparse.ArgumentTypeError(f"{value} lists no numbers")
+    return values
@@ -1,8 +1,14 @@
 import os
+import re
 import sys
+import queue
 import struct
+import threading
+from collections import deque
 
-from .config import TYPE_LEN, CHAR_ORDER
+import numpy as np
+
+from .config import TYPE_LEN, TYPE_DTYPE, CHAR_ORDER, READ_TYPES
 
 
 def prepend_zeros_to_number(len_name, number):
@@ -44,8 +50,16 @@ def num2qual(num):
 # in binary, 1 means the read is kept == N
 # in binary, 0 means the read is filtered out == Y
 
-filter2num = lambda x: {'N': 1, 'Y': 0}.get(x, None)
-num2filter = lambda x: {1: 'N', 0: 'Y'}.get(x, None)
+FILTER2NUM = {'N': 1, 'Y': 0}
+NUM2FILTER = {1: 'N', 0: 'Y'}
+
+
+def filter2num(x):
+    return FILTER2NUM.get(x)
+
+
+def num2filter(x):
+    return NUM2FILTER.get(x)
 
 
 def clean_pipe(f, **args):
@@ -64,6 +78,43 @@ def clean_pipe(f, **args):
         sys.exit(1)  # Python exits with error code 1 on EPIPE
 
 
+def pipe_text(f, **args):
+    """
+    Write the blocks of bytes yielded by f to the binary stdout, see
+    BinaryFile.read_text. A closed pipe (e.g. | head) exits like clean_pipe.
+    """
+    try:
+        out = sys.stdout.buffer
+        for chunk in f(**args):
+            out.write(chunk)
+        out.flush()
+
+    except BrokenPipeError:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(1)
+
+
+def iter_line_chunks(stream, chunk_size):
+    """
+    Read a binary stream in chunks of about chunk_size bytes that end at a
+    line break, so that every chunk holds complete lines.
+    """
+    rest = b''
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            break
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            rest += data
+            continue
+        yield rest + data[:end]
+        rest = data[end:]
+    if rest.strip():
+        yield rest
+
+
 def parse_fastq_header(line):
     h = {}
     # @<instrument>:<run number>:<flowcell ID>:<lane>:<tile>:<x-pos>:<y-pos> \
@@ -90,6 +141,178 @@ def parse_fastq_header(line):
     return h
 
 
+# lane, tile, x, y and the optional filter flag and index of CASAVA 1.8+
+# headers, @<instrument>:<run>:<flowcell>:<lane>:<tile>:<x>:<y>[:<umi>]
+# <read>:<is filtered>:<control number>:<index or sample number>
+FASTQ_HEADER = re.compile(
+    rb'@[^\s:]*:[^\s:]*:[^\s:]*:(\d+):(\d+):(-?\d+):(-?\d+)(?::\S*)?'
+    rb'(?:[ \t]+\d+:([YN]):\d+:(\S*))?\s*$'
+)
+# headers of older pipelines, @<instrument>:<lane>:<tile>:<x>:<y>#<index>/<read>
+LEGACY_FASTQ_HEADER = re.compile(
+    rb'@[^\s:]*:(\d+):(\d+):(-?\d+):(-?\d+)()(?:#([^\s/]*))?(?:/\d)?\s*$'
+)
+
+
+def parse_digits(data, starts, stops):
+    """
+    Parse the unsigned decimal numbers data[starts[i]:stops[i]] of a uint8
+    array all at once. Returns None if a field is empty, too long or not
+    all digits.
+    """
+    lengths = stops - starts
+    numbers = np.zeros(len(lengths), dtype=np.int64)
+    if len(lengths) == 0:
+        return numbers
+    if lengths.min() < 1 or lengths.max() > 18:
+        return None
+
+    # one digit of every number at a time, most significant first
+    for offset in range(lengths.max()):
+        inside = offset < lengths
+        positions = np.minimum(starts + offset, len(data) - 1)
+        digits = data[positions].astype(np.int64) - ord('0')
+        if np.any(inside & ((digits < 0) | (digits > 9))):
+            return None
+        numbers = np.where(inside, numbers * 10 + digits, numbers)
+    return numbers
+
+
+def scan_fastq_headers(block, n_headers, index=False):
+    """
+    Parse a block of n_headers CASAVA 1.8+ header lines by scanning the
+    positions of their separators with numpy, see parse_fastq_headers.
+    Returns None if a line does not have the layout of such a header.
+    """
+    data = np.frombuffer(block, dtype=np.uint8)
+    if np.any(data == ord('\t')):
+        return None
+    # carriage returns only end lines
+    returns = np.flatnonzero(data == ord('\r'))
+    if np.any(data[returns + 1] != ord('\n')):
+        return None
+    ends = np.flatnonzero(data == ord('\n'))
+    if len(ends) != n_headers:
+        return None
+    if n_headers == 0:
+        return {
+            'lane': np.empty(0, dtype=np.int64),
+            'tile': np.empty(0, dtype=np.int64),
+            'x': np.empty(0, dtype=np.int64),
+            'y': np.empty(0, dtype=np.int64),
+            'pass_filter': np.empty(0, dtype=bool),
+            'index': np.empty(0, dtype=bytes),
+        }
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    if np.any(data[starts] != ord('@')):
+        return None
+
+    # a single space splits the name of every read from its comment
+    spaces = np.flatnonzero(data == ord(' '))
+    if len(spaces) != n_headers:
+        return None
+    if np.any((spaces < starts) | (spaces > ends)):
+        return None
+
+    colons = np.flatnonzero(data == ord(':'))
+    firsts = np.searchsorted(colons, starts)
+    n_colons = np.searchsorted(colons, ends) - firsts
+    n_name = np.searchsorted(colons, spaces) - firsts
+    if np.any(n_colons - n_name != 3):
+        return None
+    if np.any((n_name != 6) & (n_name != 7)):
+        return None
+
+    def colon(k):
+        return colons[firsts + k]
+
+    # the y field ends at the space, or at the colon of an umi
+    y_stops = np.where(n_name == 7, colon(6), spaces)
+    numbers = [
+        parse_digits(data,
+                     colon(2) + 1, colon(3)),
+        parse_digits(data,
+                     colon(3) + 1, colon(4)),
+        parse_digits(data,
+                     colon(4) + 1, colon(5)),
+        parse_digits(data,
+                     colon(5) + 1, y_stops),
+    ]
+    if any(number is None for number in numbers):
+        return None
+
+    # <read>:<is filtered>:<control number>:
+    comment = firsts + n_name
+    flags = colons[comment] + 1
+    if np.any(colons[comment + 1] != flags + 1):
+        return None
+    if parse_digits(data, spaces + 1, colons[comment]) is None:
+        return None
+    if parse_digits(data, flags + 2, colons[comment + 2]) is None:
+        return None
+    flags = data[flags]
+    if np.any((flags != ord('Y')) & (flags != ord('N'))):
+        return None
+
+    parsed = dict(zip(('lane', 'tile', 'x', 'y'), numbers))
+    # Y means the read is filtered out, see filter2num
+    parsed['pass_filter'] = flags != ord('Y')
+    if index:
+        stops = ends - (data[ends - 1] == ord('\r'))
+        index_starts = colons[comment + 2] + 1
+        parsed['index'] = np.array([
+            block[start:stop]
+            for start, stop in zip(index_starts.tolist(), stops.tolist())
+        ],
+                                   dtype=bytes)
+    return parsed
+
+
+def parse_fastq_headers(headers, index=False):
+    """
+    Parse the lane, tile, x, y and filter flag of a block of FASTQ header
+    lines (bytes) into arrays, the batch version of parse_fastq_header.
+    Returns a dict of int64 lane, tile, x and y arrays, a boolean
+    pass_filter array, a boolean valid array marking the headers that were
+    parsed and, if index is set, a bytes array of the index sequences.
+
+    Blocks of Illumina headers are parsed all at once, see
+    scan_fastq_headers. Otherwise the headers are matched one at a time,
+    headers of older pipelines are understood, others get zeros and pass
+    filter.
+    """
+    n_headers = len(headers)
+    block = b''.join(headers)
+    if not block.endswith(b'\n'):
+        block += b'\n'
+
+    parsed = scan_fastq_headers(block, n_headers, index=index)
+    if parsed is not None:
+        parsed['valid'] = np.ones(n_headers, dtype=bool)
+        return parsed
+
+    fields = []
+    valid = np.ones(n_headers, dtype=bool)
+    for idx, line in enumerate(headers):
+        match = FASTQ_HEADER.match(line) or LEGACY_FASTQ_HEADER.match(line)
+        if match:
+            fields.append(match.groups(b''))
+        else:
+            fields.append((b'0', b'0', b'0', b'0', b'', b''))
+            valid[idx] = False
+
+    columns = np.array(fields, dtype=bytes).reshape(n_headers, 6)
+    parsed = {
+        name: columns[:, idx].astype(np.int64)
+        for idx, name in enumerate(('lane', 'tile', 'x', 'y'))
+    }
+    parsed['pass_filter'] = columns[:, 4] != b'Y'
+    parsed['valid'] = valid
+    if index:
+        parsed['index'] = columns[:, 5]
+    return parsed
+
+
 # def touch(file):
 #     if not os.path.exists(file):
 #         with open(file, 'w'): pass
@@ -119,3 +342,96 @@ def type_to_num_bytes(s):
     s_types = ''.join(c for c in s if c not in CHAR_ORDER)
     s_len = sum([TYPE_LEN.get(i, 0) for i in s_types])
     return s_len
+
+
+def type_to_dtype(s):
+    """
+    Convert a struct format string into a numpy structured dtype with one
+    field (f0, f1, ...) per value. Formats are assumed to be little endian
+    unless they specify big endian.
+    """
+    byte_order = '>' if s[:1] in ('>', '!') else '<'
+    s_types = ''.join(c for c in s if c not in CHAR_ORDER)
+    return np.dtype([(f'f{idx}', byte_order + TYPE_DTYPE[c])
+                     for idx, c in enumerate(s_types)])
+
+
+class _IteratorError(object):
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def background_iter(iterable, maxsize=2):
+    """
+    Iterate over iterable in a background thread. Items are handed over
+    through a queue holding at most maxsize of them, exceptions raised while
+    iterating are re-raised in the consuming thread.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    done = object()
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                return items.put(item, timeout=0.1)
+            except queue.Full:
+                pass
+
+    def produce():
+        try:
+            for item in iterable:
+                put(item)
+                if stop.is_set():
+                    return
+            put(done)
+        except BaseException as e:
+            put(_IteratorError(e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, _IteratorError):
+                raise item.exception
+            yield item
+    finally:
+        # let the producer exit if the consumer stopped early
+        stop.set()
+        thread.join()
+
+
+def parse_read_structure(read_structure):
+    """
+    Parse a read structure such as 26T8B8B26T into a list of (length, type)
+    segments. Types are T (template), B (barcode / index) and S (skipped).
+    """
+    read_structure = read_structure.upper()
+    if not re.fullmatch(r'(\d+[A-Z])+', read_structure):
+        raise ValueError(f'Invalid read structure {read_structure}')
+
+    parsed = []
+    for length, kind in re.findall(r'(\d+)([A-Z])', read_structure):
+        if kind not in READ_TYPES or int(length) == 0:
+            raise ValueError(f'Invalid read structure {read_structure}')
+        parsed.append((int(length), kind))
+    return parsed
+
+
+def ordered_map(executor, func, iterable, window):
+    """
+    Like executor.map, but with at most window tasks submitted ahead of the
+    result being consumed, so results of fast tasks do not pile up in memory
+    behind a slow one.
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the read, write and convert hot paths of bcltools.
+
+Generates synthetic bcl, locs, filter, bci and gzipped FASTQ files at the
+requested scale in a temporary folder, times each operation and prints the
+results as json (or writes them to -o) so runs can be compared across
+versions.
+
+    $ python benchmarks/benchmark.py --clusters 1000000 --cycles 50 -o out.json
+"""
+
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from bcltools import __version__  # noqa: E402
+from bcltools.BCIFile import BCIFile  # noqa: E402
+from bcltools.BCLFile import BCLFile  # noqa: E402
+from bcltools.FASTQFile import FASTQFile  # noqa: E402
+from bcltools.FASTQIndex import FASTQIndex  # noqa: E402
+from bcltools.FILTERFile import FILTERFile  # noqa: E402
+from bcltools.LOCSFile import LOCSFile  # noqa: E402
+from bcltools.bcltools import bclconvert  # noqa: E402
+from bcltools.config import CONVERT_BLOCK_SIZE  # noqa: E402
+from bcltools.utils import parse_fastq_headers  # noqa: E402
+
+BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+
+
+def synthetic_records(n_clusters, seed=0):
+    """Random bcl bytes with about 1% no-calls"""
+    rng = np.random.default_rng(seed)
+    records = rng.integers(1, 256, size=n_clusters, dtype=np.uint8)
+    records[rng.random(n_clusters) < 0.01] = 0
+    return records
+
+
+def make_binary_files(path, n_clusters, n_tiles):
+    rng = np.random.default_rng(1)
+    files = {}
+
+    bcl = BCLFile(os.path.join(path, 'bench.bcl'))
+    with bcl.writer() as writer:
+        writer.write_array(synthetic_records(n_clusters))
+    files['bcl'] = bcl
+
+    bgzf = BCLFile(os.path.join(path, 'bench.bcl.bgzf'), compression='bgzip')
+    with bgzf.writer() as writer:
+        writer.write_array(synthetic_records(n_clusters))
+    files['bcl.bgzf'] = bgzf
+
+    locs = LOCSFile(os.path.join(path, 'bench.locs'))
+    with locs.writer() as writer:
+        coords = rng.random((n_clusters, 2), dtype=np.float32) * 2048
+        writer.write_array(coords)
+    files['locs'] = locs
+
+    filter_file = FILTERFile(os.path.join(path, 'bench.filter'))
+    with filter_file.writer() as writer:
+        writer.write_array(rng.integers(0, 2, n_clusters, dtype=np.uint8))
+    files['filter'] = filter_file
+
+    bci = BCIFile(os.path.join(path, 'bench.bci'))
+    tiles = np.arange(1101, 1101 + n_tiles)
+    counts = np.full(n_tiles, n_clusters // n_tiles)
+    counts[:n_clusters % n_tiles] += 1
+    with bci.writer() as writer:
+        writer.write_array(np.stack([tiles, counts], axis=1))
+    files['bci'] = bci
+
+    return files
+
+
+def make_fastq(path, n_clusters, n_cycles, n_lanes, n_tiles, chunk=100000):
+    """Write a gzipped FASTQ file with Illumina headers"""
+    rng = np.random.default_rng(2)
+    with gzip.open(path, 'wb', compresslevel=1) as f:
+        for start in range(0, n_clusters, chunk):
+            n = min(chunk, n_clusters - start)
+            idx = np.arange(start, start + n)
+            lanes = idx * n_lanes // n_clusters + 1
+            tiles = 1101 + idx % n_tiles
+            xs = rng.integers(1000, 30000, n)
+            ys = rng.integers(1000, 30000, n)
+
+            seqs = BASES[rng.integers(0, 4, (n, n_cycles))]
+            quals = rng.integers(35, 74, (n, n_cycles), dtype=np.uint8)
+
+            lines = []
+            for i in range(n):
+                lines.append(
+                    f'@SIM:1:FLOWCELL:{lanes[i]}:{tiles[i]}:{xs[i]}:{ys[i]} '
+                    '1:N:0:0\n'.encode()
+                )
+                lines.append(seqs[i].tobytes() + b'\n+\n')
+                lines.append(quals[i].tobytes() + b'\n')
+            f.write(b''.join(lines))
+
+
+def timed(func, repeat):
+    """Run func repeat times, return the best wall time in seconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def consume(iterator):
+    for _ in iterator:
+        pass
+
+
+def result(name, seconds, n_clusters, n_bytes):
+    return {
+        'name': name,
+        'seconds': seconds,
+        'clusters': n_clusters,
+        'bytes': n_bytes,
+        'clusters_per_s': n_clusters / seconds,
+        'mb_per_s': n_bytes / seconds / 1e6,
+    }
+
+
+def run(args, path):
+    n = args.clusters
+    results = []
+
+    files = make_binary_files(path, n, args.tiles)
+
+    def add(name, func, n_clusters, n_bytes):
+        seconds = timed(func, args.repeat)
+        results.append(result(name, seconds, n_clusters, n_bytes))
+        print(
+            f'{name:<32} {seconds:9.3f} s '
+            f'{n_clusters / seconds:14.0f} clusters/s '
+            f'{n_bytes / seconds / 1e6:9.1f} MB/s',
+            file=sys.stderr
+        )
+
+    size = os.path.getsize
+    bcl, bgzf = files['bcl'], files['bcl.bgzf']
+    locs, filter_file, bci = files['locs'], files['filter'], files['bci']
+
+    add(
+        'BCLFile.read_record_bcl', lambda: consume(bcl.read_record_bcl()), n,
+        size(bcl.path)
+    )
+    add('BCLFile.read_decoded_bcl', bcl.read_decoded_bcl, n, size(bcl.path))
+    add(
+        'BCLFile.read_decoded_bcl (bgzf)', bgzf.read_decoded_bcl, n,
+        size(bgzf.path)
+    )
+    add(
+        'LOCSFile.read_record_locs', lambda: consume(locs.read_record_locs()),
+        n, size(locs.path)
+    )
+    add(
+        'FILTERFile.read_record_filter',
+        lambda: consume(filter_file.read_record_filter()), n,
+        size(filter_file.path)
+    )
+    add(
+        'BCIFile.read_record_bci', lambda: consume(bci.read_record_bci()),
+        args.tiles, size(bci.path)
+    )
+
+    add(
+        'BCLFile.read_text', lambda: consume(bcl.read_text()), n,
+        size(bcl.path)
+    )
+    add(
+        'LOCSFile.read_text', lambda: consume(locs.read_text()), n,
+        size(locs.path)
+    )
+    add(
+        'FILTERFile.read_text', lambda: consume(filter_file.read_text()), n,
+        size(filter_file.path)
+    )
+
+    records = synthetic_records(n).tolist()
+    out = BCLFile(os.path.join(path, 'out.bcl'))
+
+    def write_record():
+        out.write_header_bcl(0)
+        for r in records:
+            out.write_record(r, keep_open=True)
+        out.close()
+        out.change_header_bcl(len(records))
+
+    add('BinaryFile.write_record', write_record, n, n + out.header_len)
+
+    def writer_record():
+        with out.writer() as writer:
+            for r in records:
+                writer.write_record(r)
+
+    add('RecordWriter.write_record', writer_record, n, n + out.header_len)
+
+    array = synthetic_records(n)
+
+    def writer_array():
+        with out.writer() as writer:
+            writer.write_array(array)
+
+    add('RecordWriter.write_array', writer_array, n, n + out.header_len)
+
+    text = b''.join(bcl.read_text())
+
+    def write_from_stream():
+        out.write_from_stream_bcl(io.BytesIO(text))
+
+    add('BCLFile.write_from_stream_bcl', write_from_stream, n, len(text))
+
+    fastq_path = os.path.join(path, 'bench_R1.fastq.gz')
+    make_fastq(fastq_path, n, args.cycles, args.lanes, args.tiles)
+    fastq_size = size(fastq_path)
+
+    def n_reads():
+        index_path = FASTQIndex.index_path(fastq_path)
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        FASTQFile(fastq_path).n_reads()
+
+    add('FASTQFile.n_reads', n_reads, n, fastq_size)
+
+    with gzip.open(fastq_path, 'rb') as f:
+        headers = [line for idx, line in enumerate(f) if idx % 4 == 0]
+    headers_size = sum(map(len, headers))
+
+    def parse_headers():
+        for start in range(0, len(headers), CONVERT_BLOCK_SIZE):
+            parse_fastq_headers(headers[start:start + CONVERT_BLOCK_SIZE])
+
+    add('parse_fastq_headers', parse_headers, n, headers_size)
+
+    def convert():
+        out_path = os.path.join(path, 'run')
+        shutil.rmtree(out_path, ignore_errors=True)
+        # keep stdout clean for the json report
+        with contextlib.redirect_stdout(sys.stderr):
+            bclconvert(
+                args.lanes,
+                args.machine,
+                out_path, [fastq_path],
+                processes=args.processes
+            )
+
+    add('bclconvert', convert, n, fastq_size)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--clusters', type=int, default=1000000, help='Number of clusters'
+    )
+    parser.add_argument(
+        '--cycles', type=int, default=50, help='Number of cycles'
+    )
+    parser.add_argument('--lanes', type=int, default=1, help='Number of lanes')
+    parser.add_argument('--tiles', type=int, default=28, help='Number of tiles')
+    parser.add_argument(
+        '--machine',
+        default='miseq',
+        choices=('miseq', 'nextseq'),
+        help='Machine type of the converted run'
+    )
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=1,
+        help='Number of processes of bclconvert'
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=1, help='Keep the best of N runs'
+    )
+    parser.add_argument('--tmp', help='Folder to generate the files in')
+    parser.add_argument('-o', help='Write the json results to this file')
+    args = parser.parse_args()
+
+    path = tempfile.mkdtemp(prefix='bcltools_bench', dir=args.tmp)
+    try:
+        results = run(args, path)
+    finally:
+        shutil.rmtree(path)
+
+    report = {
+        'bcltools_version': __version__,
+        'python_version': platform.python_version(),
+        'numpy_version': np.__version__,
+        'platform': platform.platform(),
+        'parameters': vars(args),
+        'results': results,
+    }
+    if args.o:
+        with open(args.o, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
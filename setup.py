@@ -26,6 +26,9 @@ setup(
     zip_safe=False,
     include_package_data=True,
     install_requires=read('requirements.txt').strip().split('\n'),
+    extras_require={
+        'arrow': ['pyarrow'],
+    },
     entry_points={
         'console_scripts': ['bcltools=bcltools.main:main'],
     },
@@ -0,0 +1,80 @@
+import gzip
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+class TestMixin(object):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.base_dir = os.path.dirname(os.path.abspath(__file__))
+        cls.examples_dir = os.path.join(
+            os.path.dirname(cls.base_dir), 'examples'
+        )
+
+        cls.r1_path = os.path.join(cls.examples_dir, 'r1.gz')
+        cls.r2_path = os.path.join(cls.examples_dir, 'r2.gz')
+        cls.i1_path = os.path.join(cls.examples_dir, 'i1.gz')
+        cls.swabseq_paths = [
+            os.path.join(cls.examples_dir, f'swabseq_{read}.fastq.gz')
+            for read in ('r1', 'r2', 'i1')
+        ]
+        cls.swabseq_sample_sheet = os.path.join(
+            cls.examples_dir, 'swabseq_samplesheet.csv'
+        )
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+def make_reads(
+    n_reads, read_len, lanes=(1,), tiles=(1101,), seed=0, filtered=0.2
+):
+    """Random reads with Illumina headers spread over lanes and tiles.
+    Returns the header, sequence and quality lines of every read, as bytes
+    without newlines"""
+    rng = np.random.RandomState(seed)
+    read_lanes = rng.choice(lanes, n_reads)
+    read_tiles = rng.choice(tiles, n_reads)
+    xs = rng.randint(0, 2000, n_reads)
+    ys = rng.randint(0, 20000, n_reads)
+    flags = np.where(rng.rand(n_reads) < filtered, 'Y', 'N')
+
+    seqs = np.frombuffer(
+        b'ACGTN', dtype=np.uint8
+    )[rng.randint(0, 5, (n_reads, read_len))]
+    quals = rng.randint(35, 74, (n_reads, read_len)).astype(np.uint8)
+    # no-calls get the lowest quality score, as in bcl files
+    quals[seqs == ord('N')] = ord('#')
+
+    return [(
+        b'@SIM:1:FC:%d:%d:%d:%d 1:%s:0:ACGT' %
+        (read_lanes[i], read_tiles[i], xs[i], ys[i], flags[i].encode()),
+        seqs[i].tobytes(), quals[i].tobytes()
+    ) for i in range(n_reads)]
+
+
+def write_fastq(path, reads, newline=b'\n', final_newline=True):
+    """Write (header, sequence, quality) reads to a gzipped FASTQ file"""
+    lines = []
+    for header, seq, qual in reads:
+        lines.extend((header, seq, b'+', qual))
+    data = newline.join(lines)
+    if final_newline:
+        data += newline
+    with gzip.open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def read_fastq(path):
+    """Read a gzipped FASTQ file as a list of (header, sequence, quality)"""
+    with gzip.open(path, 'rb') as f:
+        lines = f.read().splitlines()
+    return list(zip(lines[0::4], lines[1::4], lines[3::4]))
@@ -0,0 +1,66 @@
+import os
+from unittest import TestCase
+
+import numpy as np
+
+import bcltools.BCLFile as BCLFile
+from tests.mixins import TestMixin
+
+
+class TestBCLTables(TestCase):
+
+    def test_decode_bcl(self):
+        records = np.array([0, 0b100, 0b1001, 0b11111110, 0xff], np.uint8)
+        bases, quals = BCLFile.decode_bcl(records)
+        self.assertEqual(bases.tobytes(), b'NACGT')
+        self.assertEqual(quals.tobytes(), bytes([33, 34, 35, 96, 96]))
+
+    def test_decode_bcl_every_byte(self):
+        records = np.arange(256, dtype=np.uint8)
+        bases, quals = BCLFile.decode_bcl(records)
+        for byte in range(1, 256):
+            self.assertEqual(chr(bases[byte]), BCLFile.num2base[byte & 3])
+            self.assertEqual(quals[byte], (byte >> 2) + 33)
+        fields = BCLFile.unpack_bcl(records)
+        np.testing.assert_array_equal(fields[0], records & 3)
+        np.testing.assert_array_equal(fields[1], records >> 2)
+
+    def test_encode_bcl(self):
+        self.assertEqual(BCLFile.encode_bcl('G', '#'), 0b1010)
+        self.assertEqual(BCLFile.encode_bcl('T', '`'), 0xff)
+        # a no-call whatever its quality score
+        self.assertEqual(BCLFile.encode_bcl('N', 'F'), 0)
+
+    def test_encode_decode(self):
+        # every byte but the no-calls of quality 0 decode and encode back
+        records = np.arange(1, 256, dtype=np.uint8)
+        bases, quals = BCLFile.decode_bcl(records)
+        np.testing.assert_array_equal(
+            BCLFile.encode_bcl_array(bases, quals), records
+        )
+        encoded = BCLFile.encode_bcl_array(
+            bases.reshape(3, -1), quals.reshape(3, -1)
+        )
+        self.assertEqual(encoded.shape, (3, 85))
+
+
+class TestBCLFile(TestMixin, TestCase):
+
+    def test_read_record_bcl(self):
+        bcl = BCLFile.BCLFile(os.path.join(self.examples_dir, 'bcl.bcl'))
+        bases, quals = bcl.read_decoded_bcl()
+        records = list(bcl.read_record_bcl(start=0))
+        self.assertEqual(
+            ''.join(base for base, _ in records),
+            bases.tobytes().decode()
+        )
+        self.assertEqual(
+            ''.join(q for _, q in records),
+            quals.tobytes().decode()
+        )
+
+        bases, quals = bcl.read_decoded_bcl(indices=[4, 1])
+        records = list(bcl.read_record_bcl(indices=[4, 1]))
+        self.assertEqual(
+            records, [(chr(b), chr(q)) for b, q in zip(bases, quals)]
+        )
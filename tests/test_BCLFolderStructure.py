@@ -0,0 +1,274 @@
+import os
+from unittest import TestCase
+
+import numpy as np
+
+import bcltools.BCLFolderStructure as BCLFolderStructure
+from bcltools.BCLFile import BCLFile
+from bcltools.BGZFFile import BGZFWriter, MAX_BLOCK_DATA, build_block_index
+from bcltools.CLOCSFile import CLOCSFile
+from bcltools.FASTQFile import FASTQFile
+from bcltools.FASTQIndex import FASTQIndex
+from bcltools.FILTERFile import FILTERFile
+from bcltools.LOCSFile import LOCSFile
+from tests.mixins import TestMixin
+
+
+class TestWriteTiles(TestMixin, TestCase):
+
+    def write_spill(self, name, n_reads, n_cycles, seed=0):
+        rng = np.random.RandomState(seed)
+        records = np.empty(
+            n_reads, dtype=BCLFolderStructure.spill_dtype(n_cycles)
+        )
+        records['bcl'] = rng.randint(0, 256, (n_reads, n_cycles))
+        records['x'] = rng.uniform(0, 2000, n_reads)
+        records['y'] = rng.uniform(0, 2000, n_reads)
+        records['pass_filter'] = rng.randint(0, 2, n_reads)
+        path = os.path.join(self.temp_dir, name)
+        records.tofile(path)
+        return path, records
+
+    def test_write_tiles(self):
+        n_cycles = 3
+        spills = [
+            self.write_spill('1_1101.spill', 1000, n_cycles, seed=1),
+            self.write_spill('1_1102.spill', 500, n_cycles, seed=2),
+        ]
+        bcls = [
+            BCLFile(os.path.join(self.temp_dir, f'{cycle}.bcl'))
+            for cycle in range(n_cycles)
+        ]
+        locs = LOCSFile(os.path.join(self.temp_dir, 's_1.locs'))
+        filter_file = FILTERFile(os.path.join(self.temp_dir, 's_1.filter'))
+
+        tiles = [([path], None) for path, _ in spills]
+        dtype = spills[0][1].dtype
+        BCLFolderStructure.write_tiles(
+            (tiles, dtype, 0, bcls, locs, filter_file, 300)
+        )
+
+        records = np.concatenate([records for _, records in spills])
+        for cycle, bcl in enumerate(bcls):
+            np.testing.assert_array_equal(
+                bcl.read_array()['f0'], records['bcl'][:, cycle]
+            )
+        np.testing.assert_array_equal(
+            locs.read_coords(), np.column_stack((records['x'], records['y']))
+        )
+        np.testing.assert_array_equal(
+            filter_file.read_mask(), records['pass_filter'].astype(bool)
+        )
+
+    def test_write_tiles_cycle_group(self):
+        # a task writing cycles 2 and 3 of the tiles only
+        path, records = self.write_spill('1_1101.spill', 100, 4)
+        bcls = [
+            BCLFile(os.path.join(self.temp_dir, f'{cycle}.bcl'))
+            for cycle in (2, 3)
+        ]
+        BCLFolderStructure.write_tiles(
+            ([([path], None)], records.dtype, 2, bcls, None, None, 30)
+        )
+        for cycle, bcl in zip((2, 3), bcls):
+            np.testing.assert_array_equal(
+                bcl.read_array()['f0'], records['bcl'][:, cycle]
+            )
+
+    def test_write_tiles_full_bgzf_blocks(self):
+        # blocks are only cut when full, whatever the number of reads written
+        # at a time
+        path, records = self.write_spill('1_1101.spill', 300000, 1)
+        bcl = BCLFile(
+            os.path.join(self.temp_dir, '0001.bcl.bgzf'), compression='bgzip'
+        )
+        BCLFolderStructure.write_tiles(
+            ([([path], None)], records.dtype, 0, [bcl], None, None, 1000)
+        )
+
+        _, data_offsets = build_block_index(bcl.path)
+        sizes = np.diff(data_offsets)
+        # the header block, full blocks, the last block and the end of file
+        # marker
+        self.assertEqual(sizes[0], 4)
+        self.assertTrue(np.all(sizes[1:-2] == MAX_BLOCK_DATA))
+        self.assertEqual(sizes[-1], 0)
+        np.testing.assert_array_equal(
+            bcl.read_array()['f0'], records['bcl'][:, 0]
+        )
+
+    def test_write_tiles_shards(self):
+        # the reads of a tile spilled to a file per shard are written as one
+        # tile, in bin order with a clocs file
+        _, records = self.write_spill('1_1101.spill', 1000, 3)
+        paths = []
+        for shard, rows in enumerate(
+            (slice(0, 100), slice(100, 700), slice(700, 1000))):
+            paths.append(os.path.join(self.temp_dir, f'{shard}_1_1101.spill'))
+            records[rows].tofile(paths[-1])
+
+        clocs = CLOCSFile(os.path.join(self.temp_dir, 's_1_1101.clocs'))
+        coords = np.column_stack((records['x'], records['y']))
+        for tile_clocs, order in ((None, slice(None)),
+                                  (clocs, clocs.sort_order(coords))):
+            bcl = BCLFile(os.path.join(self.temp_dir, '2.bcl'))
+            filter_file = FILTERFile(os.path.join(self.temp_dir, 's.filter'))
+            BCLFolderStructure.write_tiles(([
+                (paths, tile_clocs)
+            ], records.dtype, 2, [bcl], None, filter_file, 128))
+            np.testing.assert_array_equal(
+                bcl.read_array()['f0'], records['bcl'][order, 2]
+            )
+        # positions are stored to 0.1 pixel in clocs files
+        np.testing.assert_allclose(clocs.read_coords(), coords[order], atol=0.1)
+
+
+class TestBCLFolderStructure(TestMixin, TestCase):
+
+    def folder_structure(self, machine_type, locs_format='locs'):
+        folder_structure = BCLFolderStructure.BCLFolderStructure(
+            1,
+            4,
+            machine_type,
+            os.path.join(self.temp_dir, 'run'),
+            locs_format=locs_format
+        )
+        folder_structure.lane_tiles = {1: [1101, 1102]}
+        folder_structure.make_base_calls_lane_folders()
+        folder_structure.make_intensities_lane_folders()
+        for lane in folder_structure.lane_tiles:
+            folder_structure.initialize_locs_files(lane)
+            folder_structure.initialize_bcl_files(lane)
+            folder_structure.initialize_filter_files(lane)
+        return folder_structure
+
+    def test_tile_files_miseq(self):
+        folder_structure = self.folder_structure('miseq')
+        bcls, locs, filter_file = folder_structure.tile_files(1, 1102)
+        self.assertEqual(len(bcls), 4)
+        self.assertTrue(bcls[0].path.endswith('C1.1/s_1_1102.bcl'))
+        self.assertTrue(locs.path.endswith('L001/s_1_1102.locs'))
+        self.assertTrue(filter_file.path.endswith('L001/s_1_1102.filter'))
+
+    def test_tile_files_nextseq(self):
+        folder_structure = self.folder_structure('nextseq')
+        bcls, locs, filter_file = folder_structure.tile_files(1, 1102)
+        self.assertTrue(bcls[3].path.endswith('L001/0004.bcl.bgzf'))
+        self.assertTrue(locs.path.endswith('L001/s_1.locs'))
+        self.assertTrue(filter_file.path.endswith('L001/s_1.filter'))
+
+    def test_tile_files_nextseq_clocs(self):
+        folder_structure = self.folder_structure('nextseq', 'clocs')
+        for tile in (1101, 1102):
+            _, clocs, _ = folder_structure.tile_files(1, tile)
+            self.assertTrue(clocs.path.endswith(f'L001/s_1_{tile}.clocs'))
+        # looking up the files of a tile does not add tiles
+        self.assertEqual(sorted(folder_structure.locs_files[1]), [1101, 1102])
+
+    def test_write_tasks(self):
+        # (machine type, processes, tasks, cycle files)
+        cases = [('miseq', 3, 2, 8), ('nextseq', 3, 3, 4), ('nextseq', 8, 4, 4)]
+        for machine_type, processes, n_tasks, n_bcls in cases:
+            with self.subTest(machine_type=machine_type, processes=processes):
+                folder_structure = BCLFolderStructure.BCLFolderStructure(
+                    1, 4, machine_type,
+                    os.path.join(self.temp_dir, f'{machine_type}{processes}')
+                )
+                folder_structure.make_spill_files()
+                folder_structure.lane_tiles = {1: [1101, 1102]}
+                folder_structure.spill_counts = {(1, 1101): 0, (1, 1102): 0}
+                tasks = folder_structure.write_tasks(processes)
+                self.assertEqual(len(tasks), n_tasks)
+
+                # every file is written by a single task
+                paths = []
+                for _, _, _, bcls, locs, filter_file, _ in tasks:
+                    paths.extend(bcl.path for bcl in bcls)
+                    if filter_file is not None:
+                        paths.extend((locs.path, filter_file.path))
+                self.assertEqual(len(paths), len(set(paths)))
+                self.assertEqual(len(paths), n_bcls + 2 * (n_bcls // 4))
+
+
+class TestFastq2bcl(TestMixin, TestCase):
+
+    def write_fastq(self, name, n_reads, read_len):
+        """A bgzf FASTQ file with reads over 2 lanes and 3 tiles, about
+        one read in ten has no Illumina header"""
+        rng = np.random.RandomState(0)
+        path = os.path.join(self.temp_dir, name)
+        with BGZFWriter(path) as writer:
+            for i in range(n_reads):
+                if rng.rand() < 0.1:
+                    header = f'@read{i}'
+                else:
+                    lane, tile = 1 + i % 2, 1101 + i % 3
+                    header = f'@M:1:FC:{lane}:{tile}:{i}:{i} 1:N:0:1'
+                seq = ''.join(rng.choice(list('ACGT'), read_len))
+                writer.write(f'{header}\n{seq}\n+\n{"F" * read_len}\n'.encode())
+        return path
+
+    def spilled(self, fastqs, processes):
+        fastq_objects = [FASTQFile(path) for path in fastqs]
+        n_cycles = sum(fastq.read_len() for fastq in fastq_objects)
+        folder_structure = BCLFolderStructure.BCLFolderStructure(
+            2, n_cycles, 'miseq',
+            os.path.join(self.temp_dir, f'run{processes}')
+        )
+        folder_structure.make_spill_files()
+        n_reads = folder_structure.fastq2bcl(
+            fastq_objects, block_size=300, processes=processes
+        )
+        spills = {}
+        for key, paths in folder_structure.spill_files.items():
+            parts = [
+                np.fromfile(path, dtype=folder_structure.spill_dtype)
+                for path in paths
+            ]
+            spills[key] = np.concatenate(parts)
+        return folder_structure, n_reads, spills
+
+    def test_read_shards(self):
+        path = self.write_fastq('r1.fastq.gz', 3000, 6)
+        folder_structure = BCLFolderStructure.BCLFolderStructure(
+            1, 6, 'miseq', os.path.join(self.temp_dir, 'run')
+        )
+        # bgzf files are indexed, with a checkpoint every 1 << 16 reads
+        shards = folder_structure.read_shards([FASTQFile(path)], 3)
+        self.assertEqual(shards, [(0, None)])
+        self.assertTrue(os.path.exists(path + '.fqi'))
+
+        FASTQIndex.build(path, interval=100).save()
+        shards = folder_structure.read_shards([FASTQFile(path)], 3)
+        self.assertEqual(shards, [(0, 1000), (1000, 2000), (2000, 3000)])
+        shards = folder_structure.read_shards([FASTQFile(path)], 1)
+        self.assertEqual(shards, [(0, None)])
+
+        short_path = self.write_fastq('i1.fastq.gz', 2000, 6)
+        FASTQIndex.build(short_path, interval=100).save()
+        with self.assertRaisesRegex(ValueError, 'different number'):
+            folder_structure.read_shards([
+                FASTQFile(path), FASTQFile(short_path)
+            ], 3)
+
+    def test_fastq2bcl_shards(self):
+        fastqs = [
+            self.write_fastq('r1.fastq.gz', 3000, 6),
+            self.write_fastq('i1.fastq.gz', 3000, 4),
+        ]
+        for path in fastqs:
+            FASTQIndex.build(path, interval=100).save()
+
+        # the reads of every tile are spilled in the same order whether they
+        # are read in one pass or in parallel shards
+        _, n_reads, spills = self.spilled(fastqs, 1)
+        folder_structure, n_sharded, sharded = self.spilled(fastqs, 3)
+        self.assertEqual(n_reads, 3000)
+        self.assertEqual(n_sharded, 3000)
+        self.assertEqual(sorted(sharded), sorted(spills))
+        # reads without a header are dealt over the tiles of the machine
+        self.assertGreater(len(spills), 6)
+        for key in spills:
+            np.testing.assert_array_equal(sharded[key], spills[key])
+        # a spill file per shard holding reads of the tile
+        self.assertEqual(len(folder_structure.spill_files[1, 1101]), 3)
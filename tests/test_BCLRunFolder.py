@@ -0,0 +1,39 @@
+from unittest import TestCase
+
+import numpy as np
+
+import bcltools.BCLRunFolder as BCLRunFolder
+from bcltools.BCLFile import encode_bcl_array
+from bcltools.utils import parse_read_structure
+
+
+class TestFastqReads(TestCase):
+
+    def test_fastq_reads(self):
+        reads = BCLRunFolder.fastq_reads(parse_read_structure('26T8B4S8B20T'))
+        # reads are numbered in read structure order, skipped cycles are not
+        # written
+        self.assertEqual(
+            reads, [
+                ('R1', 1, 0, 26),
+                ('I1', 2, 26, 34),
+                ('I2', 3, 38, 46),
+                ('R2', 4, 46, 66),
+            ]
+        )
+
+    def test_index_bases(self):
+        reads = BCLRunFolder.fastq_reads(parse_read_structure('2T3B2B'))
+        sequences = [b'GGACGTA', b'TTNNNCC']
+        bases = np.array([list(seq) for seq in sequences], dtype=np.uint8)
+        quals = np.full(bases.shape, ord('F'), dtype=np.uint8)
+        records = encode_bcl_array(bases, quals)
+
+        index = BCLRunFolder.index_bases(records, reads)
+        self.assertEqual(index.tobytes(), b'ACG+TA'
+                         b'NNN+CC')
+
+    def test_index_bases_without_index_reads(self):
+        reads = BCLRunFolder.fastq_reads(parse_read_structure('4T'))
+        records = np.zeros((3, 4), dtype=np.uint8)
+        self.assertIsNone(BCLRunFolder.index_bases(records, reads))
@@ -0,0 +1,98 @@
+import gzip
+import os
+from unittest import TestCase
+
+import numpy as np
+
+import bcltools.BGZFFile as BGZFFile
+from bcltools.config import BGZF_INDEX_EXTENSION
+from tests.mixins import TestMixin
+
+
+class TestBGZFFile(TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        rng = np.random.RandomState(0)
+        # about 4 blocks of compressible data
+        self.data = rng.randint(0, 4, 4 * BGZFFile.MAX_BLOCK_DATA + 1234)
+        self.data = self.data.astype(np.uint8).tobytes()
+        self.path = os.path.join(self.temp_dir, 'data.bgzf')
+        with BGZFFile.BGZFWriter(self.path) as writer:
+            writer.write(self.data)
+
+    def test_virtual_offset(self):
+        virtual_offset = BGZFFile.make_virtual_offset(123456, 789)
+        self.assertEqual(
+            BGZFFile.split_virtual_offset(virtual_offset), (123456, 789)
+        )
+        with self.assertRaises(ValueError):
+            BGZFFile.make_virtual_offset(0, 1 << 16)
+
+    def test_valid_gzip(self):
+        self.assertTrue(BGZFFile.is_bgzf(self.path))
+        with gzip.open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_seek_virtual_offset(self):
+        # remember the virtual offset of positions inside and across blocks
+        positions = [0, 1, 1000, BGZFFile.MAX_BLOCK_DATA - 1]
+        positions += [BGZFFile.MAX_BLOCK_DATA, 3 * BGZFFile.MAX_BLOCK_DATA + 7]
+        offsets = {}
+        with BGZFFile.BGZFReader(self.path) as reader:
+            read = 0
+            for position in positions:
+                reader.read(position - read)
+                read = position
+                offsets[position] = reader.tell()
+
+        with BGZFFile.BGZFReader(self.path) as reader:
+            for position in reversed(positions):
+                reader.seek(offsets[position])
+                self.assertEqual(
+                    reader.read(100), self.data[position:position + 100]
+                )
+
+    def test_seek_uncompressed(self):
+        with BGZFFile.BGZFReader(self.path) as reader:
+            self.assertEqual(reader.size(), len(self.data))
+            for offset in (len(self.data) - 10, 0, 70000,
+                           2 * BGZFFile.MAX_BLOCK_DATA):
+                reader.seek_uncompressed(offset)
+                self.assertEqual(
+                    reader.read(5000), self.data[offset:offset + 5000]
+                )
+            reader.seek_uncompressed(len(self.data))
+            self.assertEqual(reader.read(), b'')
+            with self.assertRaises(ValueError):
+                reader.seek_uncompressed(len(self.data) + 1)
+
+    def test_block_index(self):
+        block_offsets, data_offsets = BGZFFile.block_index(self.path)
+        self.assertEqual(block_offsets[-1], os.path.getsize(self.path))
+        self.assertEqual(data_offsets[-1], len(self.data))
+        # reading does not write next to the file
+        self.assertFalse(os.path.exists(self.path + BGZF_INDEX_EXTENSION))
+
+    def test_block_index_save(self):
+        index = BGZFFile.block_index(self.path, save=True)
+        gzi_path = self.path + BGZF_INDEX_EXTENSION
+        self.assertTrue(os.path.exists(gzi_path))
+        self.assertEqual(BGZFFile.read_gzi(gzi_path, self.path), index)
+
+    def test_threads(self):
+        path = os.path.join(self.temp_dir, 'threads.bgzf')
+        with BGZFFile.BGZFWriter(path, threads=4) as writer:
+            for start in range(0, len(self.data), 10000):
+                writer.write(self.data[start:start + 10000])
+        with open(path, 'rb') as f, open(self.path, 'rb') as g:
+            self.assertEqual(f.read(), g.read())
+
+    def test_append(self):
+        with BGZFFile.BGZFWriter(self.path, mode='ab') as writer:
+            writer.write(b'appended')
+        with gzip.open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), self.data + b'appended')
+        with BGZFFile.BGZFReader(self.path) as reader:
+            reader.seek_uncompressed(len(self.data))
+            self.assertEqual(reader.read(), b'appended')
@@ -0,0 +1,92 @@
+from unittest import TestCase
+
+import numpy as np
+
+import bcltools.BarcodeMatcher as BarcodeMatcher
+from bcltools.BCLFile import encode_bcl_array
+
+
+def bcl_records(sequences):
+    """Raw bcl bytes of index sequences, N is a no-call"""
+    bases = np.array([list(seq.encode()) for seq in sequences], dtype=np.uint8)
+    quals = np.where(bases == ord('N'), ord('#'), ord('F')).astype(np.uint8)
+    return encode_bcl_array(bases, quals)
+
+
+class TestBarcodeMatcher(TestCase):
+
+    def test_encode_barcode(self):
+        self.assertEqual(BarcodeMatcher.encode_barcode('ACGT'), 0b00011011)
+
+    def test_barcode_variants(self):
+        variants = dict(BarcodeMatcher.barcode_variants('AC', 1))
+        # the barcode and 3 other bases at each of its 2 positions
+        self.assertEqual(len(variants), 7)
+        self.assertEqual(variants[BarcodeMatcher.encode_barcode('AC')], 0)
+        self.assertEqual(variants[BarcodeMatcher.encode_barcode('TC')], 1)
+        self.assertNotIn(BarcodeMatcher.encode_barcode('TT'), variants)
+
+    def test_collision(self):
+        # 2 mismatches apart, a read can be 1 mismatch from both
+        barcodes = [('AAAAAAAA',), ('AAAAAACC',)]
+        with self.assertRaisesRegex(ValueError, '1 barcode collisions'):
+            BarcodeMatcher.BarcodeMatcher(barcodes, mismatches=1)
+
+        matcher = BarcodeMatcher.BarcodeMatcher(barcodes, mismatches=0)
+        self.assertEqual(matcher.collisions, [])
+
+    def test_collision_two_indexes(self):
+        # the samples only collide if every index read is close
+        barcodes = [('AAAA', 'CCCC'), ('AAAT', 'CCCG'), ('AAAT', 'GGGG')]
+        matcher = BarcodeMatcher.BarcodeMatcher(
+            barcodes, mismatches=1, allow_collisions=True
+        )
+        self.assertEqual(matcher.collisions, [(0, 1)])
+
+    def test_allow_collisions(self):
+        barcodes = [('AAAAAAAA',), ('AAAAAACC',)]
+        matcher = BarcodeMatcher.BarcodeMatcher(
+            barcodes, mismatches=1, allow_collisions=True
+        )
+        self.assertEqual(matcher.collisions, [(0, 1)])
+        assigned = matcher.assign(
+            bcl_records(['AAAAAAAA', 'AAAAAACC', 'AAAAAAAC', 'AAAAAAAG'])
+        )
+        # a read as close to both samples is undetermined
+        np.testing.assert_array_equal(assigned, [0, 1, -1, 0])
+
+    def test_assign(self):
+        barcodes = [('ACGTACGT', 'TTTTAAAA'), ('GGGGCCCC', 'CATGCATG')]
+        matcher = BarcodeMatcher.BarcodeMatcher(barcodes, mismatches=1)
+        sequences = [
+            'ACGTACGTTTTTAAAA',  # exact
+            'ACGTACGATTTTAAAT',  # 1 mismatch in each index
+            'ACGTACAATTTTAAAA',  # 2 mismatches in the first index
+            'GGGGCCCCCATGCATG',
+            'GGGGCCCNCATGCATG',  # a no-call counts as a mismatch
+            'NNGGCCCCCATGCATG',
+        ]
+        np.testing.assert_array_equal(
+            matcher.assign(bcl_records(sequences)), [0, 0, -1, 1, 1, -1]
+        )
+
+    def test_assign_long_barcodes(self):
+        # too long for a direct lookup table
+        barcodes = [('ACGTACGTACGT', 'TTTTAAAACCCC'),
+                    ('GGGGCCCCAAAA', 'CATGCATGCATG')]
+        matcher = BarcodeMatcher.BarcodeMatcher(barcodes, mismatches=1)
+        sequences = [
+            'GGGGCCCCAAAACATGCATGCATG',
+            'ACGTACGTACGTTTTTAAAACCCA',
+            'ACGTACGTACGATTTTAAAACCCA',
+            'ACGTACGTACAATTTTAAAACCCC',
+        ]
+        np.testing.assert_array_equal(
+            matcher.assign(bcl_records(sequences)), [1, 0, 0, -1]
+        )
+
+    def test_invalid_barcodes(self):
+        with self.assertRaises(ValueError):
+            BarcodeMatcher.BarcodeMatcher([])
+        with self.assertRaises(ValueError):
+            BarcodeMatcher.BarcodeMatcher([('ACGT',), ('ACG',)])
@@ -0,0 +1,232 @@
+import io
+import os
+import struct
+from unittest import TestCase
+
+import numpy as np
+
+from bcltools.BinaryFile import BinaryFile
+from bcltools.BCIFile import BCIFile
+from bcltools.BCLFile import BCLFile
+from bcltools.FILTERFile import FILTERFile
+from bcltools.LOCSFile import LOCSFile
+from tests.mixins import TestMixin
+
+
+class TestBinaryFile(TestCase):
+
+    def test_header_values_required(self):
+
+        class NoHeaderFile(BinaryFile):
+            pass
+
+        with self.assertRaises(TypeError):
+            NoHeaderFile('unused', '<I', '<I')
+
+
+class TestRecordWriter(TestMixin, TestCase):
+
+    def bci(self, compression=None):
+        path = os.path.join(self.temp_dir, 's_1.bci')
+        bci = BCIFile(path)
+        bci.compression = compression
+        return bci
+
+    def assert_written(self, bci, records):
+        self.assertEqual(bci.read_header(), (0, len(records)))
+        written = bci.read_array()
+        np.testing.assert_array_equal(
+            np.column_stack((written['f0'], written['f1'])),
+            np.asarray(records).reshape(-1, 2)
+        )
+
+    def test_write_record(self):
+        # a buffer of 2 records is flushed several times
+        for keep_open in (True, False):
+            bci = self.bci()
+            records = [(1101 + tile, tile * 10) for tile in range(5)]
+            with bci.writer(buffer_size=16, keep_open=keep_open) as writer:
+                for record in records:
+                    writer.write_record(*record)
+            self.assert_written(bci, records)
+
+    def test_write_array(self):
+        bci = self.bci()
+        records = np.arange(40).reshape(20, 2)
+        with bci.writer(buffer_size=64) as writer:
+            # small arrays are buffered, large ones bypass the buffer
+            writer.write_array(records[:2])
+            writer.write_array(records[2:18])
+            structured = records[18:].astype(np.uint32).reshape(-1)
+            writer.write_array(structured.view(bci.record_dtype))
+        self.assert_written(bci, records)
+
+    def test_write_compressed(self):
+        bci = self.bci('bgzip')
+        records = np.arange(10).reshape(5, 2)
+        with bci.writer(buffer_size=8) as writer:
+            writer.write_array(records)
+        self.assertTrue(bci.is_compressed())
+        self.assert_written(bci, records)
+
+    def test_empty(self):
+        bci = self.bci()
+        with bci.writer():
+            pass
+        with open(bci.path, 'rb') as f:
+            self.assertEqual(f.read(), struct.pack('<II', 0, 0))
+
+
+class TestReadArray(TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.records = np.arange(2000).reshape(1000, 2)
+        self.bcis = []
+        for compression in (None, 'gzip', 'bgzip'):
+            bci = BCIFile(os.path.join(self.temp_dir, f'{compression}.bci'))
+            bci.compression = compression
+            with bci.writer(buffer_size=64) as writer:
+                writer.write_array(self.records)
+            self.bcis.append(bci)
+
+    def assert_records(self, records, expected):
+        np.testing.assert_array_equal(
+            np.column_stack((records['f0'], records['f1'])), expected
+        )
+
+    def test_memmap(self):
+        bci = self.bcis[0]
+        records = bci.memmap()
+        self.assertIsInstance(records, np.memmap)
+        self.assertEqual(records.dtype, bci.record_dtype)
+        self.assert_records(records, self.records)
+        # slices are views of the file
+        self.assertIsInstance(bci.read_array(10, 20), np.memmap)
+
+    def test_memmap_empty(self):
+        bci = BCIFile(os.path.join(self.temp_dir, 'empty.bci'))
+        with bci.writer():
+            pass
+        self.assertEqual(len(bci.memmap()), 0)
+        self.assertEqual(len(bci.read_array()), 0)
+
+    def test_read_array(self):
+        selections = [
+            (None, None, None),
+            (10, 20, None),
+            (-5, None, None),
+            (100, 900, 7),
+            (None, None, -3),
+            (990, 2000, None),
+            (500, 400, None),
+        ]
+        for bci in self.bcis:
+            self.assertEqual(bci.n_records(), len(self.records))
+            for start, stop, step in selections:
+                with self.subTest(compression=bci.compression, start=start):
+                    self.assert_records(
+                        bci.read_array(start, stop, step),
+                        self.records[start:stop:step]
+                    )
+
+    def test_read_indices(self):
+        indices = [5, 0, -1, 500, 5]
+        for bci in self.bcis:
+            self.assert_records(
+                bci.read_array(indices=indices), self.records[indices]
+            )
+            with self.assertRaises(IndexError):
+                bci.read_array(indices=[1000])
+
+
+class TestReadText(TestMixin, TestCase):
+
+    def legacy_text(self, records):
+        """The text of the records as formatted one at a time by clean_pipe"""
+        return ''.join(
+            '\t'.join(map(str, record)) + '\n' for record in records
+        ).encode()
+
+    def test_read_text(self):
+        bcl = BCLFile(os.path.join(self.examples_dir, 'bcl.bcl'))
+        filter_file = FILTERFile(
+            os.path.join(self.examples_dir, 'filter.filter')
+        )
+        bci = BCIFile(os.path.join(self.temp_dir, 's_1.bci'))
+        with bci.writer() as writer:
+            writer.write_array([[1101, 5], [1102, 70000]])
+
+        files = [
+            (bcl, bcl.read_record_bcl()),
+            (filter_file, filter_file.read_record_filter()),
+            (bci, bci.read_record_bci()),
+        ]
+        for binary_file, records in files:
+            with self.subTest(path=binary_file.path):
+                text = b''.join(binary_file.read_text(chunk_size=3))
+                self.assertEqual(text, self.legacy_text(records))
+
+    def test_read_text_selection(self):
+        bcl = BCLFile(os.path.join(self.examples_dir, 'bcl.bcl'))
+        lines = b''.join(bcl.read_text()).splitlines(keepends=True)
+        self.assertEqual(
+            b''.join(bcl.read_text(start=1, stop=8, step=2)),
+            b''.join(lines[1:8:2])
+        )
+        self.assertEqual(
+            b''.join(bcl.read_text(indices=[4, 0])), lines[4] + lines[0]
+        )
+
+    def test_read_text_locs(self):
+        # coordinates are written with 9 significant digits, which read back
+        # to the same 32-bit floats
+        locs = LOCSFile(os.path.join(self.examples_dir, 'locs.locs'))
+        text = b''.join(locs.read_text(chunk_size=7))
+        coords = np.array(text.split(), dtype=np.float64).reshape(-1, 2)
+        np.testing.assert_array_equal(
+            coords.astype(np.float32), locs.read_coords()
+        )
+
+
+class TestParseText(TestMixin, TestCase):
+
+    def test_parse_text_bcl(self):
+        bcl = BCLFile('unused.bcl')
+        # lines as written by read_text, and with other whitespace
+        for text in (b'A\tF\nN\t#\nT\t!\n', b'A F\r\nN\t#\n\nT !'):
+            with self.subTest(text=text):
+                records = bcl.parse_text(text)
+                self.assertEqual(records.tolist(), [148, 0, 3])
+        with self.assertRaises(ValueError):
+            bcl.parse_text(b'AF\tF\n')
+
+    def test_parse_text_filter(self):
+        filter_file = FILTERFile('unused.filter')
+        records = filter_file.parse_text(b'N\nY\r\nN')
+        self.assertEqual(records.tolist(), [1, 0, 1])
+        with self.assertRaises(ValueError):
+            filter_file.parse_text(b'N\nX\n')
+
+    def test_parse_text_numbers(self):
+        locs = LOCSFile('unused.locs')
+        values = locs.parse_text(b'1.5\t2e3\n-0.25 7\n')
+        np.testing.assert_array_equal(values, [[1.5, 2000], [-0.25, 7]])
+        with self.assertRaisesRegex(ValueError, '2 values per line'):
+            locs.parse_text(b'1.5\t2\n3\n')
+
+        bci = BCIFile('unused.bci')
+        self.assertEqual(bci.parse_text(b'1101 5\n').tolist(), [[1101, 5]])
+
+    def test_write_from_stream(self):
+        # the stream is parsed in chunks that end at a line break
+        locs = LOCSFile(os.path.join(self.temp_dir, 's_1.locs'))
+        coords = np.random.RandomState(0).uniform(0, 2000, (500, 2))
+        text = ''.join('%r\t%r\n' % (x, y) for x, y in coords.tolist())
+        text = text.encode()
+        with locs.writer() as writer:
+            for records in locs.write_from_stream(io.BytesIO(text), 100):
+                writer.write_array(records)
+        np.testing.assert_array_equal(
+            locs.read_coords(), coords.astype(np.float32)
+        )
@@ -0,0 +1,87 @@
+import os
+import struct
+from unittest import TestCase
+
+import numpy as np
+
+import bcltools.CLOCSFile as CLOCSFile
+from tests.mixins import TestMixin
+
+
+class TestCLOCSFile(TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.clocs = CLOCSFile.CLOCSFile(
+            os.path.join(self.temp_dir, 's_1_1101.clocs'),
+            image_width=100,
+            block_size=25
+        )
+
+    def test_encode(self):
+        # bins 0 and 5 (second row, second column), bins 1 to 4 are empty
+        coords = [[1.5, 2.0], [24.9, 0.0], [26.0, 30.3]]
+        data = self.clocs.encode(coords)
+        self.assertEqual(data[:5], struct.pack('<BI', 1, 6))
+        self.assertEqual(
+            data[5:], bytes([2, 15, 20, 249, 0, 0, 0, 0, 0, 1, 10, 53])
+        )
+        np.testing.assert_allclose(self.clocs.decode(data), coords, atol=0.05)
+
+    def test_encode_empty(self):
+        data = self.clocs.encode(np.empty((0, 2)))
+        self.assertEqual(data, struct.pack('<BI', 1, 0))
+        self.assertEqual(self.clocs.decode(data).shape, (0, 2))
+
+    def test_encode_decode(self):
+        # positions are rounded to 0.1 pixel, and clipped inside their bin,
+        # decoded coordinates encode back to the same bytes
+        rng = np.random.RandomState(0)
+        coords = rng.uniform(0, 100, (2000, 2)).astype(np.float32)
+        coords = coords[self.clocs.sort_order(coords)]
+        data = self.clocs.encode(coords)
+        decoded = self.clocs.decode(data)
+        np.testing.assert_allclose(decoded, coords, atol=0.1)
+        self.assertEqual(self.clocs.encode(decoded), data)
+
+    def test_encode_bin_edge(self):
+        # a cluster rounded up to the edge of its bin stays in the bin
+        decoded = self.clocs.decode(self.clocs.encode([[24.99, 1.0]]))
+        self.assertEqual(self.clocs.bins(decoded).tolist(), [0])
+
+    def test_encode_unsorted(self):
+        with self.assertRaisesRegex(ValueError, 'bin order'):
+            self.clocs.encode([[30, 0], [1, 0]])
+
+    def test_encode_full_bin(self):
+        with self.assertRaisesRegex(ValueError, 'at most 255'):
+            self.clocs.encode(np.ones((256, 2)))
+
+    def test_bins_outside_image(self):
+        # the last bin of a row extends past the edge of the image
+        clocs = CLOCSFile.CLOCSFile('s.clocs', image_width=90, block_size=25)
+        self.assertEqual(clocs.bins([[99, 0], [0, 30]]).tolist(), [3, 4])
+        with self.assertRaisesRegex(ValueError, 'outside'):
+            clocs.bins([[100, 0]])
+        with self.assertRaisesRegex(ValueError, 'outside'):
+            clocs.bins([[1, -1]])
+
+    def test_sort_order(self):
+        coords = [[60, 0], [1, 30], [2, 0], [70, 1]]
+        order = self.clocs.sort_order(coords)
+        # stable within a bin
+        self.assertEqual(order.tolist(), [2, 0, 3, 1])
+
+    def test_write_coords(self):
+        coords = np.array([[1, 2], [3, 4], [90, 90]], dtype=np.float32)
+        self.clocs.write_coords(coords)
+        self.assertEqual(self.clocs.read_header_clocs(), ((1, 16),))
+        self.assertEqual(self.clocs.n_clusters(), 3)
+        np.testing.assert_allclose(self.clocs.read_coords(), coords)
+        np.testing.assert_allclose(
+            self.clocs.read_coords(indices=[2, 0]), coords[[2, 0]]
+        )
+        np.testing.assert_allclose(self.clocs.read_coords(start=1), coords[1:])
+        self.assertEqual(
+            list(self.clocs.read_record_clocs(stop=1)), [(1.0, 2.0)]
+        )
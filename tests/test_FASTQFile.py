@@ -0,0 +1,71 @@
+import gzip
+import os
+from unittest import TestCase
+
+import numpy as np
+
+import bcltools.FASTQFile as FASTQFile
+from tests.mixins import TestMixin, make_reads, write_fastq
+
+
+class TestFASTQFile(TestMixin, TestCase):
+
+    def test_lines_to_matrix(self):
+        matrix = FASTQFile.lines_to_matrix([b'ACGT\n', b'TTGA\n'], 'f')
+        np.testing.assert_array_equal(
+            matrix,
+            np.frombuffer(b'ACGTTTGA', dtype=np.uint8).reshape(2, 4)
+        )
+
+    def test_lines_to_matrix_crlf(self):
+        matrix = FASTQFile.lines_to_matrix([b'ACGT\r\n', b'TTGA\r\n'], 'f')
+        self.assertEqual(matrix.shape, (2, 4))
+        self.assertEqual(matrix.tobytes(), b'ACGTTTGA')
+
+    def test_lines_to_matrix_missing_final_newline(self):
+        matrix = FASTQFile.lines_to_matrix([b'ACGT\n', b'TTGA'], 'f')
+        self.assertEqual(matrix.shape, (2, 4))
+        self.assertEqual(matrix.tobytes(), b'ACGTTTGA')
+
+    def test_lines_to_matrix_ragged(self):
+        with self.assertRaisesRegex(ValueError, '3 to 4 bases'):
+            FASTQFile.lines_to_matrix([b'ACGT\n', b'TTG\n'], 'f')
+
+    def test_read_blocks(self):
+        reads = make_reads(10, 6)
+        path = write_fastq(os.path.join(self.temp_dir, 'r1.fastq.gz'), reads)
+
+        blocks = list(FASTQFile.FASTQFile(path).read_blocks(block_size=4))
+        self.assertEqual([len(headers) for headers, _, _ in blocks], [4, 4, 2])
+        seqs = np.vstack([seq for _, seq, _ in blocks])
+        quals = np.vstack([qual for _, _, qual in blocks])
+        self.assertEqual(seqs.tobytes(), b''.join(seq for _, seq, _ in reads))
+        self.assertEqual(quals.tobytes(), b''.join(q for _, _, q in reads))
+
+    def test_read_blocks_missing_final_newline(self):
+        reads = make_reads(5, 6)
+        for newline in (b'\n', b'\r\n'):
+            path = write_fastq(
+                os.path.join(self.temp_dir, 'r1.fastq.gz'),
+                reads,
+                newline=newline,
+                final_newline=False
+            )
+            blocks = list(FASTQFile.FASTQFile(path).read_blocks(block_size=2))
+            seqs = np.vstack([seq for _, seq, _ in blocks])
+            quals = np.vstack([qual for _, _, qual in blocks])
+            self.assertEqual(seqs.shape, (5, 6))
+            self.assertEqual(quals.tobytes(), b''.join(q for _, _, q in reads))
+
+    def test_read_blocks_truncated(self):
+        path = write_fastq(
+            os.path.join(self.temp_dir, 'r1.fastq.gz'), make_reads(3, 6)
+        )
+        # drop the quality line of the last read
+        with gzip.open(path, 'rb') as f:
+            lines = f.readlines()
+        with gzip.open(path, 'wb') as f:
+            f.write(b''.join(lines[:-1]))
+
+        with self.assertRaisesRegex(ValueError, 'truncated'):
+            list(FASTQFile.FASTQFile(path).read_blocks(block_size=10))
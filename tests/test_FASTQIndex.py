@@ -0,0 +1,102 @@
+import gzip
+import os
+from unittest import TestCase
+
+from bcltools.BGZFFile import BGZFWriter
+from bcltools.FASTQFile import FASTQFile
+from bcltools.FASTQIndex import FASTQIndex
+from bcltools.config import FASTQ_INDEX_EXTENSION
+from tests.mixins import TestMixin
+
+N_READS = 5000
+READ_LEN = 12
+
+
+def fastq_text(start, stop):
+    """FASTQ records of reads start to stop, every read is different"""
+    lines = []
+    for i in range(start, stop):
+        seq = ''.join('ACGT'[(i >> (2 * j)) & 3] for j in range(READ_LEN))
+        lines.append(f'@M:1:FC:1:1101:{i}:{i} 1:N:0:1\n{seq}\n+\n')
+        lines.append('F' * READ_LEN + '\n')
+    return ''.join(lines).encode()
+
+
+def header(i):
+    return f'@M:1:FC:1:1101:{i}:{i} 1:N:0:1\n'.encode()
+
+
+class TestFASTQIndex(TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.bgzf_path = os.path.join(self.temp_dir, 'bgzf.fastq.gz')
+        with BGZFWriter(self.bgzf_path) as writer:
+            writer.write(fastq_text(0, N_READS))
+
+        # a gzip member every 1000 reads
+        self.members_path = os.path.join(self.temp_dir, 'members.fastq.gz')
+        with open(self.members_path, 'wb') as f:
+            for start in range(0, N_READS, 1000):
+                f.write(gzip.compress(fastq_text(start, start + 1000)))
+
+        self.gzip_path = os.path.join(self.temp_dir, 'gzip.fastq.gz')
+        with gzip.open(self.gzip_path, 'wb') as f:
+            f.write(fastq_text(0, N_READS))
+
+    def test_build(self):
+        for path in (self.bgzf_path, self.members_path, self.gzip_path):
+            index = FASTQIndex.build(path, interval=300)
+            self.assertEqual(index.n_reads, N_READS)
+            self.assertEqual(index.read_len, READ_LEN)
+            self.assertEqual(index.checkpoints[0], (0, 0, 0))
+
+        # a single gzip member can only be read from its start
+        self.assertEqual(len(index.checkpoints), 1)
+        # a checkpoint every interval reads, at most one per gzip member
+        index = FASTQIndex.build(self.members_path, interval=300)
+        reads = [read for read, _, _ in index.checkpoints]
+        offsets = [offset for _, offset, _ in index.checkpoints]
+        self.assertEqual(len(index.checkpoints), N_READS // 1000)
+        self.assertTrue(all(read % 300 == 0 for read in reads))
+        self.assertEqual(len(set(offsets)), len(offsets))
+
+    def test_checkpoint(self):
+        index = FASTQIndex.build(self.bgzf_path, interval=300)
+        self.assertGreater(len(index.checkpoints), 1)
+        for read_number in (0, 299, 300, 2500, N_READS - 1):
+            checkpoint = index.checkpoint(read_number)
+            self.assertLessEqual(checkpoint[0], read_number)
+            self.assertGreater(checkpoint[0], read_number - 600)
+
+    def test_save_load(self):
+        index = FASTQIndex.build(self.bgzf_path, interval=300)
+        index.save()
+        self.assertTrue(os.path.exists(self.bgzf_path + FASTQ_INDEX_EXTENSION))
+        loaded = FASTQIndex.load(self.bgzf_path)
+        self.assertEqual(loaded.n_reads, N_READS)
+        self.assertEqual(loaded.checkpoints, index.checkpoints)
+
+        # the index of a changed file is not used
+        with BGZFWriter(self.bgzf_path, mode='ab') as writer:
+            writer.write(fastq_text(N_READS, N_READS + 1))
+        self.assertIsNone(FASTQIndex.load(self.bgzf_path))
+
+    def test_open_at(self):
+        for path in (self.bgzf_path, self.members_path, self.gzip_path):
+            # the index saved next to the file is used
+            FASTQIndex.build(path, interval=300).save()
+            fastq = FASTQFile(path)
+            for read_number in (0, 1, 999, 1000, 2345, N_READS - 1):
+                with self.subTest(path=path, read_number=read_number):
+                    with fastq.open_at(read_number) as f:
+                        self.assertEqual(f.readline(), header(read_number))
+
+    def test_read_blocks_range(self):
+        FASTQIndex.build(self.bgzf_path, interval=300).save()
+        fastq = FASTQFile(self.bgzf_path)
+        blocks = list(fastq.read_blocks(block_size=400, start=1234, stop=2345))
+        self.assertEqual([len(headers) for headers, _, _ in blocks],
+                         [400, 400, 311])
+        headers = [line for block, _, _ in blocks for line in block]
+        self.assertEqual(headers, [header(i) for i in range(1234, 2345)])
@@ -0,0 +1,70 @@
+import os
+from unittest import TestCase
+
+import numpy as np
+
+import bcltools.FILTERFile as FILTERFile
+from tests.mixins import TestMixin
+
+
+class TestFILTERFile(TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.pass_filter = np.random.RandomState(0).rand(1003) < 0.8
+        self.filter_file = FILTERFile.FILTERFile(
+            os.path.join(self.temp_dir, 's_1_1101.filter')
+        )
+
+    def test_pack_mask(self):
+        packed = FILTERFile.pack_mask(self.pass_filter)
+        self.assertEqual(len(packed), 126)
+        np.testing.assert_array_equal(
+            FILTERFile.unpack_mask(packed, len(self.pass_filter)),
+            self.pass_filter
+        )
+
+    def test_write_mask(self):
+        self.filter_file.write_mask(self.pass_filter)
+        self.assertEqual(
+            self.filter_file.read_header_filter(), ((0, 3, 1003),)
+        )
+        np.testing.assert_array_equal(
+            self.filter_file.read_mask(), self.pass_filter
+        )
+        # one record per cluster, Y for the clusters filtered out
+        flags = [flag for flag, in self.filter_file.read_record_filter()]
+        self.assertEqual(
+            flags, ['N' if kept else 'Y' for kept in self.pass_filter]
+        )
+
+    def test_write_mask_packed(self):
+        packed = FILTERFile.pack_mask(self.pass_filter)
+        self.filter_file.write_mask(packed, n_clusters=len(self.pass_filter))
+        np.testing.assert_array_equal(
+            self.filter_file.read_mask(), self.pass_filter
+        )
+        np.testing.assert_array_equal(
+            self.filter_file.read_mask(packed=True), packed
+        )
+
+    def test_read_mask_selection(self):
+        self.filter_file.write_mask(self.pass_filter)
+        np.testing.assert_array_equal(
+            self.filter_file.read_mask(start=10, stop=500, step=7),
+            self.pass_filter[10:500:7]
+        )
+        np.testing.assert_array_equal(
+            self.filter_file.read_mask(indices=[1002, 0, 5]),
+            self.pass_filter[[1002, 0, 5]]
+        )
+
+    def test_read_mask_example(self):
+        # only bit 0 of the records is the pass filter flag
+        filter_file = FILTERFile.FILTERFile(
+            os.path.join(self.examples_dir, 'filter.filter')
+        )
+        records = filter_file.read_array()['f0']
+        np.testing.assert_array_equal(
+            filter_file.read_mask(), (records & 1).astype(bool)
+        )
@@ -0,0 +1,66 @@
+import os
+from unittest import TestCase
+
+import numpy as np
+
+import bcltools.LOCSFile as LOCSFile
+from tests.mixins import TestMixin
+
+
+class TestLOCSFile(TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        rng = np.random.RandomState(0)
+        self.coords = rng.uniform(0, 2000, (500, 2)).astype(np.float32)
+        self.locs = LOCSFile.LOCSFile(
+            os.path.join(self.temp_dir, 's_1_1101.locs')
+        )
+        self.locs.write_coords(self.coords)
+
+    def test_write_coords(self):
+        self.assertEqual(self.locs.read_header_locs(), ((1, 1.0, 500),))
+        np.testing.assert_array_equal(self.locs.read_coords(), self.coords)
+        records = list(self.locs.read_record_locs(start=3, stop=5))
+        self.assertEqual(records, [tuple(xy) for xy in self.coords[3:5]])
+
+    def test_read_coords_selection(self):
+        np.testing.assert_array_equal(
+            self.locs.read_coords(start=10, stop=100, step=3),
+            self.coords[10:100:3]
+        )
+        np.testing.assert_array_equal(
+            self.locs.read_coords(indices=[499, 2, 2]), self.coords[[499, 2, 2]]
+        )
+
+    def test_read_coords_example(self):
+        locs = LOCSFile.LOCSFile(os.path.join(self.examples_dir, 'locs.locs'))
+        coords = locs.read_coords()
+        self.assertEqual(coords.shape, (100, 2))
+        self.assertEqual(coords.dtype, np.float32)
+        self.assertEqual([tuple(xy) for xy in coords.tolist()],
+                         list(locs.read_record_locs()))
+
+    def test_bounding_box(self):
+        box = LOCSFile.bounding_box([[3, 4], [1, 9], [2, -1]])
+        self.assertEqual(box, (1, -1, 3, 9))
+        with self.assertRaisesRegex(ValueError, 'no clusters'):
+            LOCSFile.bounding_box([])
+
+        box = self.locs.read_bounding_box(start=100, stop=200)
+        self.assertEqual(box, LOCSFile.bounding_box(self.coords[100:200]))
+
+    def test_clusters_in_box(self):
+        box = (500, 250, 1500, 1000)
+        inside, coords = self.locs.clusters_in_box(box, start=100)
+        x, y = self.coords[100:, 0], self.coords[100:, 1]
+        expected = np.flatnonzero((x >= 500) & (x <= 1500) & (y >= 250)
+                                  & (y <= 1000))
+        self.assertGreater(len(expected), 0)
+        np.testing.assert_array_equal(inside, expected)
+        np.testing.assert_array_equal(coords, self.coords[100 + expected])
+
+    def test_clusters_in_box_bounds_included(self):
+        x, y = self.coords[7].tolist()
+        inside, _ = self.locs.clusters_in_box((x, y, x, y))
+        self.assertIn(7, inside)
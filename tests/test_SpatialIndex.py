@@ -0,0 +1,92 @@
+import os
+from unittest import TestCase
+
+import numpy as np
+
+from bcltools.SpatialIndex import SpatialIndex
+from tests.mixins import TestMixin
+
+
+class TestSpatialIndex(TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        rng = np.random.RandomState(0)
+        self.coords = rng.uniform(100, 2100, (5000, 2)).astype(np.float32)
+        self.index = SpatialIndex(self.coords, cell_size=50)
+
+    def in_box(self, box):
+        x_min, y_min, x_max, y_max = box
+        x, y = self.coords[:, 0], self.coords[:, 1]
+        in_x = (x >= x_min) & (x <= x_max)
+        return np.flatnonzero(in_x & (y >= y_min) & (y <= y_max))
+
+    def test_cells(self):
+        self.assertEqual(len(self.index), 5000)
+        self.assertEqual(self.index.offsets[-1], 5000)
+        # the clusters of every cell are stored together
+        cells = self.index.cells(self.index.coords)
+        self.assertTrue(np.all(np.diff(cells) >= 0))
+        np.testing.assert_array_equal(
+            self.index.coords, self.coords[self.index.order]
+        )
+
+    def test_sparse_cells(self):
+        # cells are made larger so that there are not many more than clusters
+        index = SpatialIndex([[0, 0], [5000, 5000]], cell_size=10)
+        self.assertLessEqual(index.shape[0] * index.shape[1], 4)
+        np.testing.assert_array_equal(index.query_box((-1, -1, 1, 1)), [0])
+
+    def test_query_box(self):
+        boxes = [
+            (500, 600, 900, 750),  # inside the grid
+            (0, 0, 3000, 3000),  # the whole tile
+            (-100, 1000, 150, 1200),  # across the edge of the grid
+            (2500, 0, 2600, 3000),  # outside of the grid
+            (1000, 1000, 999, 1200),  # empty
+        ]
+        for box in boxes:
+            with self.subTest(box=box):
+                np.testing.assert_array_equal(
+                    self.index.query_box(box), self.in_box(box)
+                )
+
+    def test_query_box_bounds_included(self):
+        x, y = self.coords[42].tolist()
+        self.assertIn(42, self.index.query_box((x, y, x, y)))
+
+    def test_query_radius(self):
+        x, y, radius = 1000, 1100, 120
+        dx, dy = self.coords[:, 0] - x, self.coords[:, 1] - y
+        expected = np.flatnonzero(dx * dx + dy * dy <= radius * radius)
+        self.assertGreater(len(expected), 0)
+        np.testing.assert_array_equal(
+            self.index.query_radius(x, y, radius), expected
+        )
+
+    def test_empty(self):
+        index = SpatialIndex(np.empty((0, 2)))
+        self.assertEqual(len(index), 0)
+        self.assertEqual(len(index.query_box((0, 0, 10, 10))), 0)
+        self.assertEqual(len(index.query_radius(0, 0, 10)), 0)
+
+    def test_save_load(self):
+        path = os.path.join(self.temp_dir, 's_1_1101.npz')
+        self.index.save(path)
+        self.assertEqual(os.listdir(self.temp_dir), ['s_1_1101.npz'])
+
+        index = SpatialIndex.load(path)
+        self.assertEqual(index.shape, self.index.shape)
+        self.assertEqual(index.cell_size, self.index.cell_size)
+        box = (500, 600, 900, 750)
+        np.testing.assert_array_equal(index.query_box(box), self.in_box(box))
+
+    def test_load_invalid(self):
+        path = os.path.join(self.temp_dir, 'index.npz')
+        self.index.save(path)
+        with np.load(path) as data:
+            arrays = dict(data)
+        arrays['offsets'] = arrays['offsets'][:-1]
+        np.savez(path, **arrays)
+        with self.assertRaisesRegex(ValueError, 'not a valid spatial index'):
+            SpatialIndex.load(path)
@@ -0,0 +1,250 @@
+import glob
+import gzip
+import os
+from unittest import TestCase
+
+import numpy as np
+
+import bcltools.bcltools as bcltools
+from bcltools.BCLRunFolder import BCLRunFolder
+from tests.mixins import TestMixin, make_reads, read_fastq, write_fastq
+
+
+def read_keys(reads):
+    """Sorted (lane, tile, x, y, filter flag, sequence, quality) of reads"""
+    keys = []
+    for header, seq, qual in reads:
+        name, comment = header.split(b' ')
+        lane, tile, x, y = name.split(b':')[3:7]
+        flag = comment.split(b':')[1]
+        keys.append((int(lane), int(tile), int(x), int(y), flag, seq, qual))
+    return sorted(keys)
+
+
+class TestBcltools(TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.run_path = os.path.join(self.temp_dir, 'run')
+        self.out_path = os.path.join(self.temp_dir, 'out')
+
+    def demux_reads(self, **kwargs):
+        bcltools.bcldemux(
+            self.run_path, self.out_path, include_non_pf=True, **kwargs
+        )
+        reads = []
+        pattern = os.path.join(self.out_path, '*_R1_001.fastq.gz')
+        for path in sorted(glob.glob(pattern)):
+            reads.extend(read_fastq(path))
+        return reads
+
+    def test_convert_demux(self):
+        reads = make_reads(3000, 12, lanes=(1, 2), tiles=(1101, 1102, 2104))
+        fastq_path = write_fastq(
+            os.path.join(self.temp_dir, 'r1.fastq.gz'), reads
+        )
+        for machine_type in ('miseq', 'nextseq'):
+            for locs_format in ('locs', 'clocs'):
+                with self.subTest(machine_type=machine_type,
+                                  locs_format=locs_format):
+                    name = f'{machine_type}_{locs_format}'
+                    self.run_path = os.path.join(self.temp_dir, name)
+                    self.out_path = os.path.join(self.temp_dir, name + '_out')
+                    bcltools.bclconvert(
+                        1,
+                        machine_type,
+                        self.run_path, [fastq_path],
+                        block_size=500,
+                        processes=2,
+                        locs_format=locs_format
+                    )
+                    self.assertEqual(
+                        read_keys(self.demux_reads()), read_keys(reads)
+                    )
+                    # the spill files are removed
+                    self.assertEqual(
+                        glob.glob(os.path.join(self.run_path, '.spill*')), []
+                    )
+
+    def test_convert_tiles(self):
+        reads = make_reads(1000, 4, lanes=(1, 3), tiles=(1101, 2104))
+        fastq_path = write_fastq(
+            os.path.join(self.temp_dir, 'r1.fastq.gz'), reads
+        )
+        bcltools.bclconvert(1, 'miseq', self.run_path, [fastq_path])
+
+        run_folder = BCLRunFolder(self.run_path)
+        self.assertEqual(
+            sorted(run_folder.tile_keys()), [(1, 1101), (1, 2104), (3, 1101),
+                                             (3, 2104)]
+        )
+
+    def test_convert_multiple_fastqs(self):
+        # the reads of the FASTQ files are concatenated into cycles
+        r1 = make_reads(200, 10, seed=1)
+        i1 = [(header, seq[:4], qual[:4])
+              for header, seq, qual in make_reads(200, 10, seed=2)]
+        paths = [
+            write_fastq(os.path.join(self.temp_dir, 'r1.fastq.gz'), r1),
+            write_fastq(os.path.join(self.temp_dir, 'i1.fastq.gz'), i1),
+        ]
+        bcltools.bclconvert(1, 'nextseq', self.run_path, paths)
+
+        demuxed = self.demux_reads(read_structure='10T4T')
+        index_reads = read_fastq(
+            os.path.join(self.out_path, 'Undetermined_S0_L001_R2_001.fastq.gz')
+        )
+        self.assertEqual(read_keys(demuxed), read_keys(r1))
+        self.assertEqual(
+            sorted(seq for _, seq, _ in index_reads),
+            sorted(seq for _, seq, _ in i1)
+        )
+
+    def test_convert_missing_final_newline(self):
+        # the last line of the swabseq example has no newline
+        bcltools.bclconvert(1, 'miseq', self.run_path, self.swabseq_paths)
+        reads = self.demux_reads(read_structure='26T8B8B')
+        self.assertEqual(
+            read_keys(reads), read_keys(read_fastq(self.swabseq_paths[0]))
+        )
+
+    def test_convert_headerless_reads(self):
+        reads = [(b'@read%d' % i, seq, qual)
+                 for i, (_, seq, qual) in enumerate(make_reads(100, 8))]
+        fastq_path = write_fastq(
+            os.path.join(self.temp_dir, 'r1.fastq.gz'), reads
+        )
+        bcltools.bclconvert(2, 'miseq', self.run_path, [fastq_path])
+
+        run_folder = BCLRunFolder(self.run_path)
+        self.assertEqual(sorted(run_folder.lanes), [1, 2])
+        demuxed = self.demux_reads()
+        self.assertEqual(
+            sorted(seq for _, seq, _ in demuxed),
+            sorted(seq for _, seq, _ in reads)
+        )
+
+    def test_convert_different_number_of_reads(self):
+        reads = make_reads(5000, 8)
+        paths = [
+            write_fastq(os.path.join(self.temp_dir, 'r1.fastq.gz'), reads),
+            write_fastq(
+                os.path.join(self.temp_dir, 'r2.fastq.gz'), reads[:2000]
+            ),
+        ]
+        # the shorter file ends on a block boundary, or within a block
+        for block_size in (1000, 3000):
+            with self.subTest(block_size=block_size):
+                with self.assertRaisesRegex(ValueError, 'different number'):
+                    bcltools.bclconvert(
+                        1, 'miseq', self.run_path, paths, block_size=block_size
+                    )
+                # nothing is left behind, so the conversion can be rerun
+                self.assertEqual(os.listdir(self.run_path), ['Data'])
+                self.assertEqual(
+                    os.listdir(os.path.join(self.run_path, 'Data')), []
+                )
+
+    def test_convert_existing_run_folder(self):
+        reads = make_reads(10, 8)
+        fastq_path = write_fastq(
+            os.path.join(self.temp_dir, 'r1.fastq.gz'), reads
+        )
+        bcltools.bclconvert(1, 'miseq', self.run_path, [fastq_path])
+        with self.assertRaises(FileExistsError):
+            bcltools.bclconvert(1, 'miseq', self.run_path, [fastq_path])
+
+    def test_demux_samples(self):
+        bcltools.bclconvert(1, 'miseq', self.run_path, self.swabseq_paths)
+        bcltools.bcldemux(
+            self.run_path,
+            self.out_path,
+            read_structure='26T8B8B',
+            sample_sheet=self.swabseq_sample_sheet
+        )
+
+        paths = sorted(glob.glob(os.path.join(self.out_path, '*.fastq.gz')))
+        n_reads = {}
+        for path in paths:
+            # files of samples without reads are valid, empty, gzip files
+            with gzip.open(path, 'rb') as f:
+                n_reads[os.path.basename(path)] = f.read().count(b'\n') // 4
+        self.assertEqual(len(paths), 9)
+        self.assertEqual(n_reads['Plate1-A01_S1_L001_R1_001.fastq.gz'], 0)
+        self.assertEqual(
+            sum(n for name, n in n_reads.items() if '_R1_' in name), 3
+        )
+
+        # headers number the reads in read structure order and end with the
+        # bases of the index reads
+        for path in paths:
+            if '_R1_' not in path:
+                continue
+            reads = {
+                name: read_fastq(path.replace('_R1_', f'_{name}_'))
+                for name in ('R1', 'I1', 'I2')
+            }
+            indexes = [
+                b'%s+%s' % (i1, i2)
+                for (_, i1, _), (_, i2, _) in zip(reads['I1'], reads['I2'])
+            ]
+            for number, name in enumerate(('R1', 'I1', 'I2'), 1):
+                comments = [
+                    header.split(b' ')[1] for header, _, _ in reads[name]
+                ]
+                self.assertEqual(
+                    comments, [b'%d:N:0:%s' % (number, i) for i in indexes]
+                )
+
+    def test_demux_barcode_collision(self):
+        paths = [
+            os.path.join(self.examples_dir, f'bad_{read}.fastq.gz')
+            for read in ('r1', 'r2', 'i1')
+        ]
+        sample_sheet = os.path.join(self.examples_dir, 'bad_samplesheet.csv')
+        bcltools.bclconvert(1, 'miseq', self.run_path, paths)
+        with self.assertRaisesRegex(SystemExit, 'Plate1-A01.*Plate1-A02'):
+            bcltools.bcldemux(
+                self.run_path,
+                self.out_path,
+                read_structure='26T8B8B',
+                sample_sheet=sample_sheet
+            )
+        bcltools.bcldemux(
+            self.run_path,
+            self.out_path,
+            read_structure='26T8B8B',
+            sample_sheet=sample_sheet,
+            allow_collisions=True
+        )
+
+    def test_format_clusters(self):
+        reads = make_reads(500, 6, filtered=0.5)
+        fastq_path = write_fastq(
+            os.path.join(self.temp_dir, 'r1.fastq.gz'), reads
+        )
+        bcltools.bclconvert(1, 'miseq', self.run_path, [fastq_path])
+
+        run_folder = BCLRunFolder(self.run_path)
+        indices = run_folder.tile_index(1, 1101).query_box((0, 0, 1000, 5000))
+        clusters = run_folder.load_clusters(1, 1101, indices)
+        lines = b''.join(bcltools.format_clusters(indices, clusters))
+
+        found = []
+        for line in lines.splitlines():
+            _, x, y, flag, seq, qual = line.split(b'\t')
+            found.append((int(float(x)), int(float(y)), flag, seq, qual))
+        # no-calls have the quality score 0 of the bcl files, demux writes
+        # them as # like bcl2fastq
+        expected = [(
+            x, y, flag, seq,
+            bytes(
+                ord('!') if base == ord('N') else q
+                for base, q in zip(seq, qual)
+            )
+        )
+                    for _, _, x, y, flag, seq, qual in read_keys(reads)
+                    if x <= 1000 and y <= 5000]
+        # N marks the clusters passing filter, as in FASTQ headers
+        self.assertEqual(sorted(found), expected)
+        self.assertTrue(np.any([flag == b'Y' for _, _, flag, _, _ in found]))
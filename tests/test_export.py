@@ -0,0 +1,100 @@
+import os
+from unittest import TestCase
+
+import numpy as np
+
+import bcltools.export as export
+from bcltools.BCLFile import BCLFile
+from bcltools.BCLRunFolder import Tile
+from bcltools.LOCSFile import LOCSFile
+from bcltools.config import EXPORT_EXTENSIONS
+from tests.mixins import TestMixin
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+def read_columns(path, out_format):
+    """Read back the columns of a file written by export.write_columns"""
+    if out_format == 'npy':
+        array = np.load(path)
+        return {name: array[name] for name in array.dtype.names}
+    if out_format == 'parquet':
+        table = pyarrow.parquet.read_table(path)
+    else:
+        with pyarrow.ipc.open_file(path) as reader:
+            table = reader.read_all()
+    return {
+        name: np.asarray(table.column(name).to_pylist())
+        for name in table.column_names
+    }
+
+
+class TestExport(TestMixin, TestCase):
+
+    def formats(self):
+        return ('npy', 'parquet', 'arrow') if pyarrow else ('npy',)
+
+    def test_export_records(self):
+        bcl = BCLFile(os.path.join(self.examples_dir, 'bcl.bcl'))
+        locs = LOCSFile(os.path.join(self.examples_dir, 'locs.locs'))
+        bases, quals = bcl.read_decoded_bcl(start=2, stop=9)
+        coords = locs.read_coords(indices=[3, 0])
+        for out_format in self.formats():
+            with self.subTest(out_format=out_format):
+                path = os.path.join(self.temp_dir, f'bcl.{out_format}')
+                export.export_records(bcl, out_format, path, start=2, stop=9)
+                columns = read_columns(path, out_format)
+                self.assertEqual(
+                    columns['base'].astype('S1').tobytes(), bases.tobytes()
+                )
+                np.testing.assert_array_equal(columns['qual'], quals - 33)
+
+                path = os.path.join(self.temp_dir, f'locs.{out_format}')
+                export.export_records(locs, out_format, path, indices=[3, 0])
+                columns = read_columns(path, out_format)
+                np.testing.assert_array_equal(
+                    np.column_stack((columns['x'], columns['y'])), coords
+                )
+
+    def test_export_tile(self):
+        bases = np.frombuffer(b'ACGTNA', dtype=np.uint8).reshape(3, 2)
+        tile = Tile(
+            lane=1,
+            tile=1101,
+            bases=bases,
+            quals=np.full((3, 2), ord('F'), dtype=np.uint8),
+            pass_filter=np.array([True, False, True]),
+            x=np.array([1.5, 2, 3], dtype=np.float32),
+            y=np.array([4, 5, 6.25], dtype=np.float32)
+        )
+        for out_format in self.formats():
+            with self.subTest(out_format=out_format):
+                out_path = os.path.join(self.temp_dir, out_format)
+                self.assertEqual(
+                    export.export_tile(tile, out_path, out_format), 3
+                )
+
+                extension = EXPORT_EXTENSIONS[out_format]
+                path = os.path.join(
+                    out_path, 'clusters', 'lane=1', 'tile=1101',
+                    'part-0' + extension
+                )
+                clusters = read_columns(path, out_format)
+                np.testing.assert_array_equal(clusters['cluster'], [0, 1, 2])
+                np.testing.assert_array_equal(
+                    clusters['pass_filter'], tile.pass_filter
+                )
+                np.testing.assert_array_equal(clusters['y'], tile.y)
+
+                # cycles are numbered from 1
+                path = os.path.join(
+                    out_path, 'bcl', 'lane=1', 'tile=1101', 'cycle=2',
+                    'part-0' + extension
+                )
+                bcl = read_columns(path, out_format)
+                self.assertEqual(bcl['base'].astype('S1').tobytes(), b'CTA')
+                np.testing.assert_array_equal(bcl['qual'], [37, 37, 37])
@@ -0,0 +1,95 @@
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+from tests.mixins import TestMixin
+
+
+class CommandMixin(TestMixin):
+
+    def bcltools(self, *args, check=True, stdin=None):
+        """Run the bcltools command line from the root of the repository"""
+        command = [sys.executable, '-m', 'bcltools.main'] + list(args)
+        process = subprocess.run(
+            command,
+            input=stdin,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=os.path.dirname(self.base_dir)
+        )
+        if check:
+            self.assertEqual(process.returncode, 0, process.stderr)
+        return process
+
+    def read_text(self, file_type, path, *args):
+        process = self.bcltools(
+            'read', '-x', 'nextseq', '-f', file_type, path, *args
+        )
+        return process.stdout
+
+    def read_lines(self, file_type, path, *args):
+        return self.read_text(file_type, path, *args).splitlines()
+
+
+class TestRead(CommandMixin, TestCase):
+
+    def test_read_range(self):
+        for file_type in ('bcl', 'locs', 'filter'):
+            path = os.path.join(self.examples_dir, f'{file_type}.{file_type}')
+            lines = self.read_lines(file_type, path)
+            self.assertGreaterEqual(len(lines), 10)
+            selections = [
+                (['--start', '3'], slice(3, None)),
+                (['--end', '5'], slice(None, 5)),
+                (['--start', '-4'], slice(-4, None)),
+                (['--start', '1', '--end', '-1', '--stride',
+                  '3'], slice(1, -1, 3)),
+            ]
+            for args, expected in selections:
+                with self.subTest(file_type=file_type, args=args):
+                    self.assertEqual(
+                        self.read_lines(file_type, path, *args), lines[expected]
+                    )
+
+    def test_read_clusters(self):
+        path = os.path.join(self.examples_dir, 'bcl.bcl')
+        lines = self.read_lines('bcl', path)
+        self.assertEqual(
+            self.read_lines('bcl', path, '-c', '5,0,-1,5'),
+            [lines[5], lines[0], lines[-1], lines[5]]
+        )
+
+    def test_read_invalid_selection(self):
+        path = os.path.join(self.examples_dir, 'bcl.bcl')
+        for args in (['-c', '1', '--start', '2'], ['--stride', '0'], ['-c',
+                                                                      '1,a']):
+            with self.subTest(args=args):
+                process = self.bcltools(
+                    'read', '-x', 'nextseq', path, *args, check=False
+                )
+                self.assertNotEqual(process.returncode, 0)
+                self.assertEqual(process.stdout, b'')
+
+
+class TestWrite(CommandMixin, TestCase):
+
+    def test_write_read_round_trip(self):
+        # the text of bcltools read is written back to the same file
+        for file_type in ('bcl', 'locs', 'filter'):
+            with self.subTest(file_type=file_type):
+                path = os.path.join(
+                    self.examples_dir, f'{file_type}.{file_type}'
+                )
+                out_path = os.path.join(self.temp_dir, f'out.{file_type}')
+                args = ['-x', 'nextseq', '-f', file_type, '-o', out_path]
+                text = self.read_text(file_type, path)
+                self.bcltools('write', *args, '-', stdin=text)
+                with open(path, 'rb') as f, open(out_path, 'rb') as g:
+                    self.assertEqual(g.read(), f.read())
+
+    def test_write_bgzf(self):
+        text = self.read_text('bcl', os.path.join(self.examples_dir, 'bcl.bcl'))
+        out_path = os.path.join(self.temp_dir, '0001.bcl.bgzf')
+        self.bcltools('write', '-x', 'nextseq', '-o', out_path, '-', stdin=text)
+        self.assertEqual(self.read_text('bcl', out_path), text)
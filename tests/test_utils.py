@@ -0,0 +1,153 @@
+from unittest import TestCase
+
+import numpy as np
+
+import bcltools.utils as utils
+
+
+class TestParseFastqHeaders(TestCase):
+
+    def assert_parsed(self, parsed, expected):
+        for key, values in expected.items():
+            np.testing.assert_array_equal(parsed[key], values, err_msg=key)
+
+    def test_parse_fastq_headers(self):
+        headers = [
+            b'@M00123:12:000000000-ABCDE:1:1101:15589:1333 1:N:0:ACGT\n',
+            b'@M00123:12:000000000-ABCDE:2:2114:9:26254 2:Y:0:TTGA\n',
+        ]
+        parsed = utils.parse_fastq_headers(headers, index=True)
+        self.assert_parsed(
+            parsed, {
+                'lane': [1, 2],
+                'tile': [1101, 2114],
+                'x': [15589, 9],
+                'y': [1333, 26254],
+                'pass_filter': [True, False],
+                'valid': [True, True],
+                'index': [b'ACGT', b'TTGA'],
+            }
+        )
+        self.assertEqual(parsed['lane'].dtype, np.int64)
+
+    def test_parse_fastq_headers_agrees_with_parse_fastq_header(self):
+        header = '@NB552046:38:HLHM2BGXF:1:11101:26254:5794 1:N:0:0'
+        parsed = utils.parse_fastq_headers([header.encode() + b'\n'])
+        fields = utils.parse_fastq_header(header)
+        for key in ('lane', 'tile', 'x', 'y'):
+            self.assertEqual(parsed[key][0], fields[key])
+        self.assertEqual(
+            parsed['pass_filter'][0], fields['is_filtered_out'] == 'N'
+        )
+
+    def test_parse_fastq_headers_empty(self):
+        parsed = utils.parse_fastq_headers([], index=True)
+        for key in ('lane', 'tile', 'x', 'y', 'pass_filter', 'valid', 'index'):
+            self.assertEqual(len(parsed[key]), 0, key)
+
+    def test_parse_fastq_headers_crlf_and_missing_newline(self):
+        headers = [
+            b'@M:1:FC:2:1101:5:7 1:N:0:AC\r\n',
+            b'@M:1:FC:2:1102:15:8 1:Y:0:GT',
+        ]
+        parsed = utils.parse_fastq_headers(headers, index=True)
+        self.assert_parsed(
+            parsed, {
+                'tile': [1101, 1102],
+                'y': [7, 8],
+                'pass_filter': [True, False],
+                'valid': [True, True],
+                'index': [b'AC', b'GT'],
+            }
+        )
+
+    def test_parse_fastq_headers_umi(self):
+        headers = [b'@M:1:FC:3:1101:5:7:ACGTACGT 1:N:0:GG\n']
+        parsed = utils.parse_fastq_headers(headers, index=True)
+        self.assert_parsed(
+            parsed, {
+                'lane': [3],
+                'x': [5],
+                'y': [7],
+                'valid': [True],
+                'index': [b'GG'],
+            }
+        )
+
+    def test_parse_fastq_headers_negative_coordinates(self):
+        headers = [b'@M:1:FC:1:1101:-5:7 1:N:0:1\n']
+        parsed = utils.parse_fastq_headers(headers)
+        self.assert_parsed(parsed, {'x': [-5], 'y': [7], 'valid': [True]})
+
+    def test_parse_fastq_headers_legacy(self):
+        headers = [b'@HWUSI-EAS100R:6:73:941:1973#ATCACG/1\n']
+        parsed = utils.parse_fastq_headers(headers, index=True)
+        self.assert_parsed(
+            parsed, {
+                'lane': [6],
+                'tile': [73],
+                'x': [941],
+                'y': [1973],
+                'pass_filter': [True],
+                'valid': [True],
+                'index': [b'ATCACG'],
+            }
+        )
+
+    def test_parse_fastq_headers_invalid(self):
+        # one invalid header does not invalidate the rest of the block
+        headers = [
+            b'@read1\n',
+            b'@M:1:FC:3:1101:5:7 1:Y:0:1\n',
+            b'@M:1:FC:3:11x01:5:7 1:N:0:1\n',
+            b'@M:1:FC:3:1101:5:7 1:N:0:1 extra\n',
+            b'@M:1:FC:3:1101:5:7 1:F:0:1\n',
+        ]
+        parsed = utils.parse_fastq_headers(headers)
+        self.assert_parsed(
+            parsed, {
+                'lane': [0, 3, 0, 0, 0],
+                'tile': [0, 1101, 0, 0, 0],
+                'pass_filter': [True, False, True, True, True],
+                'valid': [False, True, False, False, False],
+            }
+        )
+
+    def test_parse_fastq_headers_scan_matches_regex(self):
+        # the same headers parsed by the numpy scan, and one at a time with
+        # the regexes because of the invalid header appended to the block
+        rng = np.random.RandomState(0)
+        headers = []
+        for _ in range(500):
+            numbers = tuple(rng.randint(1, 1 << 20, 4))
+            flag = rng.choice([b'Y', b'N'])
+            index = rng.choice([b'ACGT', b'1', b'AC+GT'])
+            headers.append(
+                b'@M:1:FC:%d:%d:%d:%d 1:%s:0:%s\n' % (numbers + (flag, index))
+            )
+        scanned = utils.parse_fastq_headers(headers, index=True)
+        matched = utils.parse_fastq_headers(headers + [b'@read\n'], index=True)
+        for key in ('lane', 'tile', 'x', 'y', 'pass_filter', 'index'):
+            np.testing.assert_array_equal(
+                scanned[key], matched[key][:-1], err_msg=key
+            )
+
+
+class TestParseDigits(TestCase):
+
+    def test_parse_digits(self):
+        data = np.frombuffer(b'12:0:987654321', dtype=np.uint8)
+        numbers = utils.parse_digits(
+            data, np.array([0, 3, 5]), np.array([2, 4, 14])
+        )
+        np.testing.assert_array_equal(numbers, [12, 0, 987654321])
+
+    def test_parse_digits_invalid(self):
+        data = np.frombuffer(b'12:a4:', dtype=np.uint8)
+        self.assertIsNone(
+            utils.parse_digits(data, np.array([3]), np.array([5]))
+        )
+        # empty field
+        self.assertIsNone(
+            utils.parse_digits(data, np.array([2]), np.array([2]))
+        )